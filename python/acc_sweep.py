@@ -1,9 +1,9 @@
 import copy
-import random
+import sys
 
 from carfns import SwitchVTypeFn, changeFasterLaneBuilder
-from loopsim import LoopSim
 from agent_types import basicHumanParams as humanParams, basicIDMParams as IDMParams, basicACCParams as ACCParams
+from sweep import runSweep, printTable
 import config as defaults
 
 # this is the main entry point of this script
@@ -11,16 +11,15 @@ if __name__ == "__main__":
     # This sweep demonstrates that our ACC implementation is about as good as IDM in the loop setting
 
     changeFasterLane = changeFasterLaneBuilder()
-    hybridParams = copy.copy(humanParams)
-    hybridParams["name"] = "hybrid"
+    simArgs = {"name": "loopsim", "length": 1000, "numLanes": 2, "simStepLength": 0.5}
+    sumo = sys.argv[1] if len(sys.argv) > 1 else defaults.BINARY
 
+    jobs = []
     for count in [20, 25, 30, 35, 40, 45, 50, 55, 60, 70, 80]:
 
         # IDM sweep
-        if defaults.RANDOM_SEED:
-            print "Setting random seed to ", defaults.RANDOM_SEED
-            random.seed(defaults.RANDOM_SEED)
-
+        hybridParams = copy.copy(humanParams)
+        hybridParams["name"] = "hybrid"
         hybridParams["count"] = count
         hybridParams["function"] = SwitchVTypeFn("idm", 0.5, initCarFn=changeFasterLane)
 
@@ -29,17 +28,10 @@ if __name__ == "__main__":
             "simSteps"   : 500,
             "tag"        : "IDMSweep"
         }
-
-        sim = LoopSim("loopsim", length=1000, numLanes=2, simStepLength=0.5)
-
-        sim.simulate(opts)
-        sim.plot(show=True, save=True)
+        jobs.append({"sim": simArgs, "opts": opts, "simulate": {"sumo": sumo}, "plot": {}})
 
         # ACC sweep
-        if defaults.RANDOM_SEED:
-            print "Setting random seed to ", defaults.RANDOM_SEED
-            random.seed(defaults.RANDOM_SEED)
-
+        hybridParams = copy.copy(hybridParams)
         hybridParams["function"] = SwitchVTypeFn("acc", 0.5, initCarFn=changeFasterLane)
 
         opts = {
@@ -47,8 +39,8 @@ if __name__ == "__main__":
             "simSteps"   : 500,
             "tag"        : "ACCSweep"
         }
+        jobs.append({"sim": simArgs, "opts": opts, "simulate": {"sumo": sumo}, "plot": {}})
 
-        sim = LoopSim("loopsim", length=1000, numLanes=2, simStepLength=0.5)
-
-        sim.simulate(opts)
-        sim.plot(show=True, save=True)
+    # Each run gets its own port and output directory under sweep/acc/, and
+    # each worker keeps its SUMO running from one run to the next
+    printTable(runSweep(jobs, outdir="sweep/acc/", warm=True))
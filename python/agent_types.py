@@ -1,7 +1,8 @@
 import copy
 
-from carfns import randomChangeLaneFn, ACCFnBuilder, changeFasterLaneBuilder,\
-    MidpointFnBuilder, SwitchVTypeFn, FillGapFnBuilder, FillGapMidpointFnBuilder
+from carfns import randomChangeLaneFn, changeFasterLaneBuilder, SwitchVTypeFn
+from batchfns import ACCBatchBuilder, MidpointBatchBuilder, \
+    FillGapBatchBuilder, FillGapMidpointBatchBuilder
 import config as defaults
 
 # changeFasterLane = changeFasterLaneBuilder()
@@ -41,22 +42,22 @@ basicIDMParams["carFollowModel"] = "IDM"
 
 basicACCParams = copy.copy(basicRobotParams)
 basicACCParams["name"] = "acc"
-basicACCParams["function"] = ACCFnBuilder(follow_sec=1.0,
-                                          max_speed=defaults.MAX_SPEED,
-                                          gain=0.1, beta=0.9)
+basicACCParams["function"] = ACCBatchBuilder(follow_sec=1.0,
+                                             max_speed=defaults.MAX_SPEED,
+                                             gain=0.1, beta=0.9)
 
 basicGapFillerParams = copy.copy(basicRobotParams)
 basicGapFillerParams["name"] = "gapfiller"
-basicGapFillerParams["function"] = FillGapFnBuilder(duration=250)
+basicGapFillerParams["function"] = FillGapBatchBuilder(duration=250)
 
 basicFillGapMidpointParams = copy.copy(basicRobotParams)
 basicFillGapMidpointParams["name"] = "fillgapmidpoint"
 basicFillGapMidpointParams["function"] = \
-    FillGapMidpointFnBuilder(max_speed=40, gain=0.1, beta=0.9, duration=250,
-                             bias=1.0, ratio=0.25, gap_threshold=10)
+    FillGapMidpointBatchBuilder(max_speed=40, gain=0.1, beta=0.9, duration=250,
+                                bias=1.0, ratio=0.25, gap_threshold=10)
 
 basicMidpointParams = copy.copy(basicRobotParams)
 basicMidpointParams["name"] = "midpoint"
-basicMidpointParams["function"] = MidpointFnBuilder(max_speed=40, gain=0.1,
-                                                    beta=0.9, duration=250,
-                                                    bias=1.0, ratio=0.25)
+basicMidpointParams["function"] = MidpointBatchBuilder(max_speed=40, gain=0.1,
+                                                       beta=0.9, duration=250,
+                                                       bias=1.0, ratio=0.25)
@@ -0,0 +1,203 @@
+"""
+Vectorized versions of the car functions in carfns.py.
+
+A batch car function is called once per step for each vehicle type it is
+registered for (as the "function" of a carParams), instead of once per car:
+
+    speeds, lanes = batchFn(cars, sim, step)
+
+cars is a carstate.CarBatch holding the x, v, lane, ... arrays of every car
+of that type along with the slots of their leaders and followers.  The
+function returns an array of target speeds (NaN for no slowDown) and an
+array of target lanes (-1 for no changeLane), and LoopSim issues only those
+commands.  slowDown uses the function's duration (ms).
+"""
+import numpy as np
+
+
+# Duration (ms) of lane changes requested by batch car functions
+LANE_CHANGE_DURATION = 10000
+
+
+def batchFn(fn, duration):
+    """
+    Mark fn as a batch car function whose slowDown commands take duration ms
+    """
+    fn.batch = True
+    fn.duration = duration
+    return fn
+
+
+def isBatchFn(fn):
+    return getattr(fn, "batch", False)
+
+
+def noCommands(cars):
+    speeds = np.empty(len(cars))
+    speeds.fill(np.nan)
+    lanes = np.empty(len(cars), dtype=np.int32)
+    lanes.fill(-1)
+    return speeds, lanes
+
+
+def followSpeeds(curr_speed, front_speed, front_dist, follow_dist,
+                 max_speed, gain, beta, bias=0):
+    """
+    Target speeds for tracking follow_dist behind the front car, as in
+    ACCFnBuilder and MidpointFnBuilder; NaN where the speed is left alone
+    """
+    delta = front_dist - follow_dist
+    new_speed = curr_speed + beta * (front_speed-curr_speed) + gain * delta + bias
+    # speed up
+    faster = (follow_dist < front_dist) & (curr_speed < max_speed)
+    # slow down
+    slower = follow_dist > front_dist
+    return np.where(faster, np.minimum(new_speed, max_speed),
+                    np.where(slower, np.maximum(new_speed, 0), np.nan))
+
+
+def midpointSpeeds(cars, sim, ok, max_speed, gain, beta, bias, ratio):
+    """
+    Target speeds for the cars selected by ok tracking a fraction (ratio) of
+    the distance between their follower and leader, as in MidpointFnBuilder
+    """
+    state = cars.state
+    front, back = cars.leader[ok], cars.follower[ok]
+    front_dist = (state.x[front] - cars.x[ok]) % sim.length
+    back_dist = (cars.x[ok] - state.x[back]) % sim.length
+    return followSpeeds(cars.v[ok], state.v[front], front_dist,
+                        (front_dist + back_dist) * ratio,
+                        max_speed, gain, beta, bias)
+
+
+def fillGapLanes(cars, sim, gap_back, gap_forward, gap_threshold):
+    """
+    Lanes with the largest gap to move into, as in FillGapFnBuilder
+    :return: (lanes, speeds) target lane (-1 to stay) and the speed to
+             merge at for every car
+    """
+    state = cars.state
+    gap = np.zeros((sim.numLanes, len(cars)))
+    new_speed = np.zeros((sim.numLanes, len(cars)))
+    for lane in range(sim.numLanes):
+        back, front = cars.adjacent(lane)
+        ok = back >= 0
+        back, front = back[ok], front[ok]
+        back_dist = (cars.x[ok] - state.x[back]) % sim.length
+        front_dist = (state.x[front] - cars.x[ok]) % sim.length
+        # cars too close, no lane changing allowed
+        clear = (back_dist > gap_back) & (front_dist > gap_forward)
+        ok[ok] = clear
+        back, front = back[clear], front[clear]
+
+        gap[lane, ok] = (state.x[front] - state.x[back]) % sim.length
+        new_speed[lane, ok] = (state.v[front] + state.v[back]) / 2
+
+    rng = np.arange(len(cars))
+    max_lane = np.argmax(gap, axis=0)
+    change = (max_lane != cars.lane) & \
+             (gap[max_lane, rng] - gap[cars.lane, rng] > gap_threshold)
+    return np.where(change, max_lane, -1), new_speed[max_lane, rng]
+
+
+def ACCBatchBuilder(follow_sec = 3.0, max_speed = 26.8, gain = 0.01, beta = 0.5):
+    """
+    Batch version of ACCFnBuilder
+    :param follow_sec: number of seconds worth of following distance to keep from the front vehicle
+    :param max_speed: 26.8 m/s = 60 mph
+    :param gain: gain for tracking following distance
+    :param beta: gain for tracking speed of front vehicle
+    :return: ACCFn to input to a carParams
+    """
+
+    def ACCFn(cars, sim, step):
+        state = cars.state
+        speeds, lanes = noCommands(cars)
+
+        # Cars alone on their lane are left alone
+        ok = cars.leader >= 0
+        front = cars.leader[ok]
+        front_dist = (state.x[front] - cars.x[ok]) % sim.length
+        front_speed = state.v[front]
+        speeds[ok] = followSpeeds(cars.v[ok], front_speed, front_dist,
+                                  front_speed*follow_sec,
+                                  max_speed, gain, beta)
+        return speeds, lanes
+
+    return batchFn(ACCFn, 1000)
+
+
+def MidpointBatchBuilder(max_speed = 26.8, gain = 0.1, beta = 0.5, duration = 500, bias = 1.0, ratio = 0.5):
+    """
+    Batch version of MidpointFnBuilder
+    :param max_speed: 26.8 m/s = 60 mph
+    :param gain: gain for tracking following distance
+    :param beta: gain for tracking speed of front vehicle
+    :param duration: duration for transitioning to new speed (ms)
+    :param bias: additive speed bias term (m/s)
+    :param ratio: ratio of distance between front and back vehicles to track
+            as following distance (default is 0.5=midpoint)
+    :return: MidpointFn as input to a carParams
+    """
+
+    def MidpointFn(cars, sim, step):
+        speeds, lanes = noCommands(cars)
+        ok = cars.leader >= 0
+        speeds[ok] = midpointSpeeds(cars, sim, ok, max_speed, gain, beta,
+                                    bias, ratio)
+        return speeds, lanes
+
+    return batchFn(MidpointFn, duration)
+
+
+def FillGapBatchBuilder(duration=500, gap_back=10, gap_forward=5, gap_threshold=10):
+    """
+    Batch version of FillGapFnBuilder
+    :param duration: duration for transitioning to new speed (ms)
+    :param gap_back: Minimum required clearance behind car
+    :param gap_forward: Minimum required clearance in front car
+    :param gap_threshold: Minimum required gap difference between current lane and next lane
+    :return: carFn to input to a carParams
+    """
+    def carFn(cars, sim, step):
+        speeds, lanes = noCommands(cars)
+        lanes, merge_speed = fillGapLanes(cars, sim, gap_back, gap_forward,
+                                          gap_threshold)
+        change = lanes >= 0
+        speeds[change] = merge_speed[change]
+        return speeds, lanes
+
+    return batchFn(carFn, duration)
+
+
+def FillGapMidpointBatchBuilder(duration=500, gap_back=10, gap_forward=5,
+                                gap_threshold=10, max_speed=26.8, gain=0.1,
+                                beta=0.5, bias=1.0, ratio=0.5):
+    """
+    Batch version of FillGapMidpointFnBuilder
+    :param duration: duration for transitioning to new speed (ms)
+    :param gap_back: Minimum required clearance behind car
+    :param gap_forward: Minimum required clearance in front car
+    :param gap_threshold: Minimum required gap difference between current lane and next lane
+    :param max_speed: 26.8 m/s = 60 mph
+    :param gain: gain for tracking following distance
+    :param beta: gain for tracking speed of front vehicle
+    :param bias: additive speed bias term (m/s)
+    :param ratio: ratio of distance between front and back vehicles to track
+            as following distance (default is 0.5=midpoint)
+    :return: carFn to input to a carParams
+    """
+    def carFn(cars, sim, step):
+        speeds, lanes = noCommands(cars)
+        lanes, merge_speed = fillGapLanes(cars, sim, gap_back, gap_forward,
+                                          gap_threshold)
+        change = lanes >= 0
+        speeds[change] = merge_speed[change]
+
+        # Cars staying in their lane track the midpoint instead
+        ok = ~change & (cars.leader >= 0)
+        speeds[ok] = midpointSpeeds(cars, sim, ok, max_speed, gain, beta,
+                                    bias, ratio)
+        return speeds, lanes
+
+    return batchFn(carFn, duration)
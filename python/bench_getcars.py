@@ -0,0 +1,98 @@
+"""
+Benchmark LoopSim.getCars: the per-lane bisection index in CarState against
+the linear scan it replaced.  Both are run on the same synthetic ring with
+the queries changeFasterLaneBuilder and ACCFnBuilder make for every car in a
+step, and their results are checked to be identical.
+"""
+import random
+import timeit
+
+from carstate import CarState
+
+
+def scanCars(allCars, length, idx, numBack = None, numForward = None,
+                                   dxBack = None, dxForward = None,
+                                   lane = None):
+    """ Linear scan formerly used by LoopSim.getCars """
+    numCars = len(allCars)
+    ret = []
+    x = allCars[idx]["x"]
+
+    for i in range(idx-1, -1, -1) + range(numCars-1, idx, -1):
+        c = allCars[i]
+        if (dxBack is not None and (x - c["x"]) % length > dxBack) or \
+           (numBack is not None and len(ret) >= numBack):
+                break
+        if (lane is None or c["lane"] == lane):
+                ret.insert(0, c)
+
+    cnt = len(ret)
+
+    for i in range(idx+1, numCars) + range(0, idx):
+        c = allCars[i]
+        if (dxForward is not None and (c["x"]-x) % length > dxForward) or \
+           (numForward is not None and (len(ret) - cnt) >= numForward):
+                break
+        if (lane is None or c["lane"] == lane):
+                ret.append(c)
+
+    return ret
+
+
+def randomState(numCars, numLanes=2, length=1000, seed=0):
+    """ CarState for numCars cars spread randomly around the loop """
+    rng = random.Random(seed)
+    edgelen = length/4.
+    edgestarts = {"bottom": 0, "right": edgelen, "top": 2*edgelen, "left": 3*edgelen}
+    state = CarState(["car-%03d" % i for i in range(numCars)], edgestarts, length)
+    for slot in range(numCars):
+        edge = rng.choice(edgestarts.keys())
+        # round some positions so cars end up level with each other
+        pos = round(rng.uniform(0, edgelen), rng.choice([0, 6]))
+        state.set(slot, "human", edge, pos, rng.randrange(numLanes),
+                  rng.uniform(0, 30), 40., 1.)
+    state.update()
+    return state
+
+
+def stepQueries(numCars, numLanes):
+    """ (idx, kwargs) of the getCars calls made by one step of car functions """
+    queries = []
+    for idx in range(numCars):
+        for lane in range(numLanes):
+            queries.append((idx, dict(dxBack=10, dxForward=5, lane=lane)))
+            queries.append((idx, dict(dxBack=0, dxForward=60, lane=lane)))
+            queries.append((idx, dict(numBack=1, numForward=1, lane=lane)))
+    return queries
+
+
+def check(state, queries):
+    for (idx, kwargs) in queries:
+        expected = [c.rank for c in scanCars(state, state.length, idx, **kwargs)]
+        got = [c.rank for c in state.getCars(idx, **kwargs)]
+        assert got == expected, (idx, kwargs, got, expected)
+
+
+def bench(numCars, numLanes=2, repeat=3):
+    state = randomState(numCars, numLanes)
+    queries = stepQueries(numCars, numLanes)
+    check(state, queries)
+
+    def scan():
+        for (idx, kwargs) in queries:
+            scanCars(state, state.length, idx, **kwargs)
+
+    def index():
+        for (idx, kwargs) in queries:
+            state.getCars(idx, **kwargs)
+
+    tscan = min(timeit.repeat(scan, number=1, repeat=repeat))
+    tindex = min(timeit.repeat(index, number=1, repeat=repeat))
+    return tscan, tindex
+
+
+if __name__ == "__main__":
+    print "%6s %12s %12s %8s" % ("cars", "scan (s)", "index (s)", "speedup")
+    for numCars in [50, 200, 1000]:
+        tscan, tindex = bench(numCars)
+        print "%6d %12.4f %12.4f %7.1fx" % (numCars, tscan, tindex, tscan/tindex)
@@ -0,0 +1,68 @@
+"""
+Bytes written per LoopSim run for different output settings: every SUMO
+output (as makecirc wrote before outputs could be chosen), emission output
+only, sampled with outputPeriod, gzipped, and in-process recording instead.
+
+    python bench_outputs.py [sumo|ring] [simSteps]
+"""
+import copy
+import os
+import random
+import sys
+import time
+
+import config as defaults
+from agent_types import basicHumanParams, basicACCParams
+from loopsim import LoopSim
+
+
+# (name, simulate keyword arguments)
+SETTINGS = [
+    ("all outputs",          {}),
+    ("emission",             {"outputs": ["emission"]}),
+    ("emission, period 5s",  {"outputs": ["emission"], "outputPeriod": 5}),
+    ("emission, gz",         {"outputs": ["emission"], "compress": True}),
+    ("emission, 5s, gz",     {"outputs": ["emission"], "outputPeriod": 5,
+                              "compress": True}),
+    ("record only",          {"outputs": [], "record": True}),
+]
+
+
+def outputBytes(sim):
+    return sum(os.path.getsize(fn) for fn in sim.outs.values())
+
+
+def bench(sumo, simSteps):
+    humanParams = copy.copy(basicHumanParams)
+    humanParams["count"] = 40
+    accParams = copy.copy(basicACCParams)
+    accParams["count"] = 10
+    results = []
+    for (name, kwargs) in SETTINGS:
+        random.seed(defaults.RANDOM_SEED)
+        sim = LoopSim("outputs", length=1000, numLanes=2, simStepLength=0.5,
+                      port=None)
+        opts = {
+            "paramsList" : [humanParams, accParams],
+            "simSteps"   : simSteps,
+            "tag"        : name.replace(" ", "").replace(",", "-"),
+        }
+        start = time.time()
+        sim.simulate(opts, sumo=sumo, **kwargs)
+        tsim = time.time() - start
+        start = time.time()
+        sim.parse()
+        results.append((name, outputBytes(sim), tsim, time.time() - start))
+    return results
+
+
+if __name__ == "__main__":
+    sumo = sys.argv[1] if len(sys.argv) > 1 else defaults.BINARY
+    simSteps = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    results = bench(sumo, simSteps)
+    base = float(results[0][1])
+    print "%-22s %12s %8s %10s %10s" % ("outputs", "bytes", "vs all",
+                                        "run (s)", "parse (s)")
+    for (name, nbytes, tsim, tparse) in results:
+        print "%-22s %12d %7.1f%% %10.2f %10.2f" % (name, nbytes,
+                100 * nbytes / base, tsim, tparse)
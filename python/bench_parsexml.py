@@ -0,0 +1,248 @@
+"""
+Check parsexml.parsexml against the objectify based parser it replaced on a
+generated emission file, and compare their run time and peak memory.
+
+Also times parsexml.interp against the scipy interp1d version it replaced,
+and loading parsexml.cachedParsexml's cache against parsing.
+
+    python bench_parsexml.py [numCars] [numSteps]
+"""
+import os
+import random
+import resource
+import sys
+import time
+
+from lxml import objectify
+from scipy import interpolate
+import numpy as np
+
+from parsexml import cachedParsexml, interp, parsexml
+
+
+def interp1dInterp(x, y, xmax, vdefault=0):
+        """ interp as it was before: a new scipy interp1d every call """
+        if len(x) == 0:
+            x = [0]
+            y = [vdefault]
+
+        newx = []; newy = []
+
+        newindex = x.index(max(x))
+        newx.append(x[newindex] - xmax)
+        newy.append(y[newindex])
+
+        newindex = x.index(min(x))
+        newx.append(x[newindex] + xmax)
+        newy.append(y[newindex])
+
+        x.extend(newx); y.extend(newy)
+
+        f = interpolate.interp1d(x, y, assume_sorted=False)
+        return f
+
+
+def treeParsexml(fn, edgestarts, xmax, vdefault=0):
+    """ parsexml as it was before streaming: the whole file is loaded first """
+    obj = objectify.parse(file(fn)).getroot()
+
+    trng = []
+    xrng = range(0, xmax)
+    looptimes = {}
+    lanespeeds = {}
+    laneoccupancy = {}
+    avgspeeds = {}
+    totfuel = {}
+    typecolors = {}
+
+    for timestep in obj.timestep:
+        t = float(timestep.get("time"))
+
+        lanedata = {}
+        try:
+            for vehicle in timestep.vehicle:
+                d = {}
+                d["name"] = vehicle.get("id")
+                d["type"] = vehicle.get("id")[:-4]
+                d["edge"] = vehicle.get("lane")[:-2]
+                d["v"] = float(vehicle.get("speed"))
+                d["pos"] = float(vehicle.get("pos"))
+                d["x"] = d["pos"] + edgestarts[d["edge"]]
+
+                d["CO2"] = float(vehicle.get("CO2"))
+                d["CO"] = float(vehicle.get("CO"))
+                d["fuel"] = float(vehicle.get("fuel"))
+
+                lid = vehicle.get("lane")[-1]
+                lanedata.setdefault(lid, []).append(d)
+        except AttributeError:
+            pass
+
+        for lid, thislane in lanedata.iteritems():
+            vf = interp1dInterp([x["x"] for x in thislane], [x["v"] for x in thislane], xmax, vdefault)
+            ff = interp1dInterp([x["x"] for x in thislane], [x["fuel"] for x in thislane], xmax, 0)
+            types = set([x["type"] for x in thislane])
+            for tp in types:
+                if tp not in typecolors:
+                    typecolors[tp] = len(typecolors)+1
+
+            intx = dict((int(x["x"]), typecolors[x["type"]]) for x in thislane)
+
+            fx = vf(xrng)
+            lanespeeds.setdefault(lid, [[0]*len(xrng)]*len(trng)).append(fx)
+            laneoccupancy.setdefault(lid, [[0]*len(xrng)]*len(trng)).append([intx.get(x, 0) for x in xrng])
+
+            avgspeed = np.mean(vf(xrng))
+            looptime = xmax/avgspeed
+            loopfuel = np.mean([x["fuel"] for x in thislane])*looptime
+
+            # XXX Quick hack : Plot std dev of velocity instead.
+            loopfuel = np.std([x["v"] for x in thislane])
+
+            avgspeeds.setdefault(lid, [vdefault]*len(trng)).append(avgspeed)
+            totfuel.setdefault(lid, [0]*len(trng)).append(loopfuel)
+            looptimes.setdefault(lid, [xmax * 1.0 / vdefault]*len(trng)).append(looptime)
+
+        trng.append(t)
+
+    return trng, xrng, avgspeeds, lanespeeds, (laneoccupancy, typecolors), totfuel, looptimes
+
+
+def sampleEmissions(fn, numCars=40, numSteps=200, length=1000, seed=0,
+                    emptySteps=False):
+    """
+    Write a random emission file for a 2 lane loop.  Lane 1 is only used from
+    a third of the way in, to exercise the padding of lanes that show up
+    late.  Positions have enough digits that no two cars are level on a
+    lane, where interp1d ordered them arbitrarily.
+    :param emptySteps: leave some timesteps without any cars
+    :return: edgestarts of the loop
+    """
+    rng = random.Random(seed)
+    edges = ["bottom", "right", "top", "left"]
+    edgelen = length/4.
+    edgestarts = dict((e, i*edgelen) for (i, e) in enumerate(edges))
+    cars = ["%s-%03d" % (rng.choice(["human", "robot"]), i) for i in range(numCars)]
+
+    with open(fn, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<emission-export>\n')
+        for step in range(numSteps):
+            if emptySteps and step % 17 == 5:
+                f.write('    <timestep time="%.2f"/>\n' % step)
+                continue
+            f.write('    <timestep time="%.2f">\n' % step)
+            for car in cars:
+                lane = rng.randrange(2) if step > numSteps/3 else 0
+                fuel = rng.uniform(0, 3)
+                f.write('        <vehicle id="%s" eclass="HBEFA3/PC_G_EU4" '
+                        'CO2="%.2f" CO="%.2f" HC="0.00" NOx="0.00" PMx="0.00" '
+                        'fuel="%.2f" electricity="0.00" noise="60.00" '
+                        'route="r0" type="%s" waiting="0.00" lane="%s_%d" '
+                        'pos="%.6f" speed="%.2f" angle="0.00" x="0.00" y="0.00"/>\n'
+                        % (car, fuel*2300, fuel*1.5, fuel, car[:-4],
+                           rng.choice(edges), lane, rng.uniform(0, edgelen),
+                           rng.uniform(0, 30)))
+            f.write('    </timestep>\n')
+        f.write('</emission-export>\n')
+    return edgestarts
+
+
+def same(a, b):
+    """
+    Deep equality of parser outputs (lists, dicts, tuples and arrays), up to
+    the float32 precision of lanespeeds
+    """
+    if isinstance(a, dict):
+        return isinstance(b, dict) and sorted(a) == sorted(b) and \
+               all(same(a[k], b[k]) for k in a)
+    if isinstance(a, tuple):
+        return isinstance(b, tuple) and len(a) == len(b) and \
+               all(same(x, y) for (x, y) in zip(a, b))
+    a, b = np.array(a, dtype=float), np.array(b, dtype=float)
+    return a.shape == b.shape and np.allclose(a, b, rtol=1e-6, atol=1e-5)
+
+
+def benchInterp(numSteps=10000, numCars=50, xmax=1000, seed=0):
+    """
+    Interpolate numSteps random lanes both ways and check they agree
+    :return: (interp1d seconds, np.interp seconds)
+    """
+    rng = np.random.RandomState(seed)
+    xs = rng.uniform(0, xmax, (numSteps, numCars)).tolist()
+    ys = rng.uniform(0, 30, (numSteps, numCars)).tolist()
+    xrng, xq = range(xmax), np.arange(xmax)
+
+    start = time.time()
+    old = [interp1dInterp(list(x), list(y), xmax)(xrng) for (x, y) in zip(xs, ys)]
+    told = time.time() - start
+    start = time.time()
+    new = [interp(x, y, xmax)(xq) for (x, y) in zip(xs, ys)]
+    tnew = time.time() - start
+
+    assert np.allclose(old, new, rtol=0, atol=1e-9)
+    return told, tnew
+
+
+def measure(parse, *args):
+    """
+    Run parse in a child process
+    :return: (seconds, peak RSS in MB) of the child
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        start = time.time()
+        parse(*args)
+        elapsed = time.time() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+        os.write(w, "%f %f" % (elapsed, peak))
+        os._exit(0)
+    os.close(w)
+    out = os.read(r, 100)
+    os.waitpid(pid, 0)
+    return tuple(float(v) for v in out.split())
+
+
+if __name__ == "__main__":
+    numCars = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    numSteps = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    length = 1000
+    fn = "/tmp/bench_parsexml.emission.xml"
+    edgestarts = sampleEmissions(fn, numCars, numSteps, length)
+    print "%d cars, %d steps: %.1f MB" % (numCars, numSteps,
+            os.path.getsize(fn) / 1024. / 1024.)
+
+    # measure first: forked children inherit this process's peak RSS
+    print "%-10s %10s %14s" % ("parser", "time (s)", "peak RSS (MB)")
+    for (name, parse) in [("objectify", treeParsexml), ("iterparse", parsexml)]:
+        print "%-10s %10.2f %14.1f" % ((name,) + measure(parse, fn, edgestarts, length, 35))
+
+    assert same(parsexml(fn, edgestarts, length, 35),
+                treeParsexml(fn, edgestarts, length, 35))
+    print "Outputs identical"
+
+    # The old parser skipped the rows of timesteps without cars, leaving
+    # lanes with fewer rows than timesteps.  Now they get empty lane rows.
+    edgestarts = sampleEmissions(fn, numCars, 100, length, emptySteps=True)
+    trng, xrng, avgspeeds, lanespeeds, (occupancy, colors), totfuel, looptimes = \
+        parsexml(fn, edgestarts, length, 35)
+    for data in [avgspeeds, lanespeeds, occupancy, totfuel, looptimes]:
+        assert all(len(a) == len(trng) for a in data.values())
+    print "Every lane has a row per timestep"
+
+    # cache: first call parses and saves, the second loads
+    edgestarts = sampleEmissions(fn, numCars, numSteps, length)
+    start = time.time()
+    parsed = cachedParsexml(fn, edgestarts, length, 35)
+    tmiss = time.time() - start
+    start = time.time()
+    cached = cachedParsexml(fn, edgestarts, length, 35)
+    thit = time.time() - start
+    assert same(parsed, cached)
+    print "cachedParsexml: parse and save %.2fs, load %.4fs" % (tmiss, thit)
+
+    told, tnew = benchInterp()
+    print "interp, 10000 timesteps: interp1d %.2fs, np.interp %.2fs (%.1fx)" % (
+            told, tnew, told / tnew)
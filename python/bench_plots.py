@@ -0,0 +1,102 @@
+"""
+Time plots.pcolor_multi drawing and saving a LoopSim figure with a
+pcolormesh per lane against fast=True, for runs of 1k, 10k and 50k steps of
+generated stop-and-go waves on a 2 lane 1000 m loop.  Every render runs in
+its own process (with Agg), which also reports its peak memory.
+
+    python bench_plots.py [maxPcolormeshSteps]
+
+Runs longer than maxPcolormeshSteps are only rendered with fast=True.
+"""
+import os
+import resource
+import sys
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+
+from plots import pcolor_multi
+
+
+STEPS = [1000, 10000, 50000]
+
+
+def sampleParsed(numSteps, numLanes=2, length=1000, stepLength=0.5, seed=0):
+    """
+    parsexml-like output of a run with jams moving backwards around the loop
+    """
+    rng = np.random.RandomState(seed)
+    trng = (np.arange(numSteps) * stepLength).tolist()
+    xrng = range(length)
+    x = np.arange(length, dtype=np.float32)
+    avgspeeds, lanespeeds, stddevs, looptimes = {}, {}, {}, {}
+    for lane in range(numLanes):
+        lid = str(lane)
+        speeds = np.empty((numSteps, length), dtype=np.float32)
+        for (row, t) in enumerate(trng):
+            phase = 2 * np.pi * (x + 4 * t + 100 * lane) / length
+            speeds[row] = 15 + 10 * np.sin(3 * phase)
+        speeds += rng.uniform(-1, 1, speeds.shape).astype(np.float32)
+        lanespeeds[lid] = speeds
+        avgspeeds[lid] = speeds.mean(axis=1)
+        stddevs[lid] = speeds.std(axis=1)
+        looptimes[lid] = length / avgspeeds[lid]
+    return trng, xrng, avgspeeds, lanespeeds, stddevs, looptimes
+
+
+def render(parsed, fn, fast):
+    trng, xrng, avgspeeds, lanespeeds, stddevs, looptimes = parsed
+    plt = pcolor_multi("Traffic jams (2 lanes, bench)",
+            (xrng, "Position along loop (m)"),
+            (trng, "Time (s)"),
+            (avgspeeds, "Average loop speed (m/s)"),
+            (lanespeeds, 0, 30, "Speed (m/s)"),
+            (looptimes, "Loop transit time (s)"),
+            (stddevs, None, None, "Speed std. dev. (m/s)"),
+            fast=fast)
+    plt.gcf().savefig(fn)
+    plt.close("all")
+
+
+def measure(parsed, fn, fast):
+    """
+    Render in a child process
+    :return: (seconds, peak RSS in MB) of the child, or None if it failed
+    """
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        start = time.time()
+        render(parsed, fn, fast)
+        elapsed = time.time() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+        os.write(w, "%f %f" % (elapsed, peak))
+        os._exit(0)
+    os.close(w)
+    out = os.read(r, 100)
+    os.close(r)
+    os.waitpid(pid, 0)
+    if not out:
+        return None
+    return tuple(float(v) for v in out.split())
+
+
+if __name__ == "__main__":
+    maxOld = int(sys.argv[1]) if len(sys.argv) > 1 else max(STEPS)
+    print "%8s %-12s %10s %14s" % ("steps", "mode", "time (s)", "peak RSS (MB)")
+    for numSteps in STEPS:
+        parsed = sampleParsed(numSteps)
+        for (mode, fast) in [("pcolormesh", False), ("fast", True)]:
+            if not fast and numSteps > maxOld:
+                print "%8d %-12s %10s" % (numSteps, mode, "skipped")
+                continue
+            fn = "/tmp/bench_plots-%d-%s.png" % (numSteps, mode)
+            res = measure(parsed, fn, fast)
+            if res is None:
+                print "%8d %-12s %10s" % (numSteps, mode, "failed")
+            else:
+                print "%8d %-12s %10.2f %14.1f" % ((numSteps, mode) + res)
+        del parsed
@@ -0,0 +1,63 @@
+"""
+Startup cost of LoopSim runs with a new SUMO process per run against
+reusing one from a sumopool.SumoPool.  Startup is the time from starting
+(or reloading) the simulator until the cars are added and the first step
+can be made.
+
+    python bench_startup.py [sumo] [runs] [simSteps]
+"""
+import copy
+import random
+import sys
+import time
+
+import config as defaults
+from agent_types import basicHumanParams, basicACCParams
+from loopsim import LoopSim
+from sumopool import SumoPool
+
+
+def bench(sumo, runs, simSteps, pool=None):
+    """
+    :return: list of (startup seconds, total seconds) of each run
+    """
+    humanParams = copy.copy(basicHumanParams)
+    humanParams["count"] = 40
+    accParams = copy.copy(basicACCParams)
+    accParams["count"] = 10
+    times = []
+    for i in range(runs):
+        random.seed(defaults.RANDOM_SEED)
+        sim = LoopSim("startup", length=1000, numLanes=2, simStepLength=0.5,
+                      port=None)
+        opts = {
+            "paramsList" : [humanParams, accParams],
+            "simSteps"   : simSteps,
+            "tag"        : "run%d" % i,
+        }
+        start = time.time()
+        sim.simulate(opts, sumo=sumo, outputs=["emission"], pool=pool)
+        times.append((sim.startupTime, time.time() - start))
+    return times
+
+
+if __name__ == "__main__":
+    sumo = sys.argv[1] if len(sys.argv) > 1 else defaults.BINARY
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    simSteps = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+
+    cold = bench(sumo, runs, simSteps)
+    pool = SumoPool()
+    try:
+        warm = bench(sumo, runs, simSteps, pool=pool)
+    finally:
+        pool.close()
+
+    print "%-6s %12s %12s %12s %12s" % ("", "first (s)", "startup (s)",
+                                        "run (s)", "startup %")
+    for (name, times) in [("cold", cold), ("warm", warm)]:
+        startup = sum(t[0] for t in times[1:]) / max(1, len(times) - 1)
+        total = sum(t[1] for t in times[1:]) / max(1, len(times) - 1)
+        print "%-6s %12.2f %12.2f %12.2f %11.1f%%" % (name, times[0][0],
+                startup, total, 100 * startup / total)
+    print "(startup and run are averages over the runs after the first)"
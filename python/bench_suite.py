@@ -0,0 +1,334 @@
+"""
+Benchmark suite of the simulation and analysis pipeline, runnable without
+SUMO: TraCI is always faketraci's stand-in, so the numbers only depend on
+this code and the machine.
+
+    loopsim/fake  LoopSim steps against faketraci: state collection, sorting,
+                  commands and car functions, without any traffic dynamics
+    loopsim/ring  LoopSim steps on the built-in ring simulator
+    getcars       the getCars queries of a step of lane changers
+    carfns        every carfns and batchfns controller on its own, over all
+                  the cars of a step
+    parsexml      parsing emission files of increasing size with stop-and-go
+                  waves, from emissiongen
+    plots         pcolor_multi drawing and saving a LoopSim figure
+
+Every benchmark is run a few times on the same seeded input and its best
+time kept (averaged over enough runs per sample for MIN_SAMPLE seconds).
+The results are written as JSON, and --compare flags the benchmarks more
+than --threshold slower than in an earlier results file (exiting with
+status 1 if there are any).  The suite runs in a temporary directory, so
+the files of its runs are not left behind.
+
+    python bench_suite.py [-o results.json] [--quick] [--only carfns,getcars]
+    python bench_suite.py --compare baseline.json [--threshold 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import faketraci
+# before anything imports loopsim
+fake = faketraci.install()
+
+import numpy as np
+
+import bench_plots  # selects the Agg backend
+import carfns
+import batchfns
+from agent_types import basicHumanParams, basicACCParams
+from bench_getcars import randomState, stepQueries
+from cmdbuffer import CommandBuffer
+from emissiongen import generate
+from loopsim import LoopSim
+from parsexml import parsexml
+
+
+# A result this much slower than the baseline is a regression
+THRESHOLD = 0.2
+# Shorter benchmarks are run this many seconds' worth of times per sample
+MIN_SAMPLE = 0.05
+
+
+class ControllerSim(object):
+    """ The parts of a LoopSim that car functions use, around a CarState """
+
+    def __init__(self, allCars, numLanes):
+        self.allCars = allCars
+        self.length = allCars.length
+        self.numLanes = numLanes
+        self.simSteps = 1000
+        self.simStepLength = 1.
+        self.commands = CommandBuffer(None, self.simStepLength)
+
+    def getCars(self, idx, **kwargs):
+        return self.allCars.getCars(idx, **kwargs)
+
+
+def paramsList(numCars):
+    # a fifth of the cars with ACC, the others changing lanes
+    humanParams = dict(basicHumanParams, count=numCars - numCars // 5)
+    accParams = dict(basicACCParams, count=numCars // 5)
+    return [humanParams, accParams]
+
+
+def loopsimBench(tmpdir, backend, numCars, numLanes, simSteps):
+    def run():
+        random.seed(0)
+        if backend == "fake":
+            fake.reset()
+            sim = faketraci.fakeLoopSim(fake, 1000, numLanes, simStepLength=0.5)
+            sim.vid_path = tmpdir
+            kwargs = {}
+        else:
+            sim = LoopSim("bench", length=1000, numLanes=numLanes,
+                          simStepLength=0.5, port=None)
+            kwargs = {"sumo": backend, "outputs": []}
+        sim.start({"paramsList": paramsList(numCars), "simSteps": simSteps,
+                   "tag": "bench"}, **kwargs)
+        start = time.time()
+        for step in range(simSteps):
+            sim.step()
+        elapsed = time.time() - start
+        sim.finish()
+        return elapsed
+    return run
+
+
+def getcarsBench(numCars, numLanes=2):
+    state = randomState(numCars, numLanes)
+    queries = stepQueries(numCars, numLanes)
+
+    def run():
+        start = time.time()
+        for (idx, kwargs) in queries:
+            state.getCars(idx, **kwargs)
+        return time.time() - start
+    return run, len(queries)
+
+
+# (name, carFn) of the controllers, with their default parameters
+CONTROLLERS = [
+    ("randomChangeLane",    carfns.randomChangeLaneFn),
+    ("changeFasterLane",    carfns.changeFasterLaneBuilder()),
+    ("ACC",                 carfns.ACCFnBuilder()),
+    ("Midpoint",            carfns.MidpointFnBuilder()),
+    ("FillGap",             carfns.FillGapFnBuilder()),
+    ("FillGapMidpoint",     carfns.FillGapMidpointFnBuilder()),
+    ("ACCBatch",            batchfns.ACCBatchBuilder()),
+    ("MidpointBatch",       batchfns.MidpointBatchBuilder()),
+    ("FillGapBatch",        batchfns.FillGapBatchBuilder()),
+    ("FillGapMidpointBatch", batchfns.FillGapMidpointBatchBuilder()),
+]
+
+
+def carfnBench(carFn, numCars, numLanes=2):
+    state = randomState(numCars, numLanes)
+    slots = np.arange(numCars)
+
+    def run():
+        random.seed(0)
+        sim = ControllerSim(state, numLanes)
+        start = time.time()
+        if batchfns.isBatchFn(carFn):
+            carFn(state.batch(slots), sim, 0)
+        else:
+            for (idx, car) in enumerate(state):
+                carFn((idx, car), sim, 0)
+        return time.time() - start
+    return run
+
+
+def parsexmlBench(tmpdir, numCars, numSteps, length=1000):
+    fn = os.path.join(tmpdir, "bench-%d-%d.emission.xml" % (numCars, numSteps))
+    edgestarts = generate(fn, [("human", numCars - numCars // 10),
+                               ("robot", numCars // 10)],
+                          numSteps=numSteps, length=length)
+
+    def run():
+        start = time.time()
+        parsexml(fn, edgestarts, length, 35)
+        return time.time() - start
+    return run
+
+
+def plotsBench(tmpdir, numSteps, fast):
+    parsed = bench_plots.sampleParsed(numSteps)
+    fn = os.path.join(tmpdir, "bench-%d-%s.png" % (numSteps, fast))
+
+    def run():
+        start = time.time()
+        bench_plots.render(parsed, fn, fast)
+        return time.time() - start
+    return run
+
+
+def benchmarks(tmpdir, quick=False):
+    """
+    The suite, made lazily since some inputs take a while to generate
+    :return: list of (name, unit, work, make) where make() returns a
+             function that runs the benchmark once and returns its seconds,
+             and work is the number of units it processes
+    """
+    simSteps = 50 if quick else 300
+    suite = []
+    for backend in ["fake", "ring"]:
+        for numLanes in [1, 2]:
+            for numCars in [20, 50, 200]:
+                suite.append(("loopsim/%s/%dcars-%dlanes" % (backend, numCars, numLanes),
+                              "steps", simSteps,
+                              lambda b=backend, c=numCars, l=numLanes:
+                                  loopsimBench(tmpdir, b, c, l, simSteps)))
+    for numCars in [50, 200, 1000]:
+        # work is the number of queries, known once they are made
+        suite.append(("getcars/%dcars" % numCars, "queries", None,
+                      lambda c=numCars: getcarsBench(c)))
+    numCars = 50 if quick else 200
+    for (name, carFn) in CONTROLLERS:
+        suite.append(("carfns/%s/%dcars" % (name, numCars), "cars", numCars,
+                      lambda f=carFn: carfnBench(f, numCars)))
+    for numSteps in ([100, 500] if quick else [100, 500, 2000]):
+        suite.append(("parsexml/40cars-%dsteps" % numSteps, "timesteps", numSteps,
+                      lambda s=numSteps: parsexmlBench(tmpdir, 40, s)))
+    for (numSteps, fast) in [(1000, False), (1000, True)] + \
+                            ([] if quick else [(10000, True)]):
+        suite.append(("plots/%s-%dsteps" % ("fast" if fast else "pcolormesh", numSteps),
+                      "steps", numSteps,
+                      lambda s=numSteps, f=fast: plotsBench(tmpdir, s, f)))
+    return suite
+
+
+def gitRevision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runSuite(only=None, repeat=5, quick=False):
+    """
+    :param only: list of name prefixes of the benchmarks to run
+    :return: results dict, as written to JSON
+    """
+    results = {
+            "machine" : {
+                "python"   : platform.python_version(),
+                "numpy"    : np.__version__,
+                "platform" : platform.platform(),
+                "cpus"     : os.sysconf("SC_NPROCESSORS_ONLN"),
+                },
+            "revision" : gitRevision(),
+            "date"     : time.strftime("%Y-%m-%d %H:%M:%S"),
+            "quick"    : quick,
+            "repeat"   : repeat,
+            "benchmarks" : {},
+            }
+    tmpdir = tempfile.mkdtemp(prefix="bench_suite")
+    cwd = os.getcwd()
+    # LoopSim makes its net/, data/, img/ and video/ directories here
+    os.chdir(tmpdir)
+    try:
+        for (name, unit, work, make) in benchmarks(tmpdir, quick):
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            run = make()
+            if isinstance(run, tuple):
+                run, work = run
+            # an untimed run warms up caches and sizes the samples
+            number = max(1, int(MIN_SAMPLE / max(run(), 1e-6)))
+            times = sorted(sum(run() for j in range(number)) / number
+                           for i in range(repeat))
+            results["benchmarks"][name] = {
+                    "seconds" : times[0],
+                    "median"  : times[len(times) // 2],
+                    "times"   : times,
+                    "number"  : number,
+                    "unit"    : unit,
+                    "work"    : work,
+                    "rate"    : work / times[0] if times[0] > 0 else None,
+                    }
+            print "%-42s %10.5f s %12.1f %s/s" % (name, times[0],
+                    results["benchmarks"][name]["rate"] or 0, unit)
+            sys.stdout.flush()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return results
+
+
+def compare(baseline, results, threshold=THRESHOLD):
+    """
+    Print the change of every benchmark in both results
+    :return: names of the benchmarks over threshold slower
+    """
+    if baseline["machine"] != results["machine"]:
+        print "Warning: the baseline was run on another machine:", baseline["machine"]
+    if baseline.get("quick") != results.get("quick"):
+        print "Warning: comparing a --quick run with a full one"
+
+    regressions = []
+    print "%-42s %10s %10s %8s" % ("benchmark", "base (s)", "now (s)", "change")
+    for name in sorted(results["benchmarks"]):
+        old = baseline["benchmarks"].get(name)
+        if old is None:
+            print "%-42s %10s %10.5f %8s" % (name, "-",
+                    results["benchmarks"][name]["seconds"], "new")
+            continue
+        t0, t1 = old["seconds"], results["benchmarks"][name]["seconds"]
+        change = t1 / t0 - 1 if t0 > 0 else 0.
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print "%-42s %10.5f %10.5f %+7.1f%%%s" % (name, t0, t1, 100 * change, flag)
+    missing = sorted(set(baseline["benchmarks"]) - set(results["benchmarks"]))
+    if missing:
+        print "Not run:", ", ".join(missing)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", default="bench_suite.json",
+                        help="results file (default %(default)s)")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="results file to check this run against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="slowdown flagged as a regression (default %(default)s)")
+    parser.add_argument("--only", help="comma separated name prefixes to run")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="timed runs per benchmark (default %(default)s)")
+    parser.add_argument("--quick", action="store_true",
+                        help="fewer steps and cars, for a quick check")
+    args = parser.parse_args()
+
+    if args.compare and os.path.abspath(args.compare) == os.path.abspath(args.output):
+        parser.error("--output would overwrite the baseline")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = runSuite(only=args.only.split(",") if args.only else None,
+                       repeat=args.repeat, quick=args.quick)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print "Results written to", args.output
+
+    if baseline is not None:
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print "%d regression(s) over %d%%" % (len(regressions),
+                                                 100 * args.threshold)
+            sys.exit(1)
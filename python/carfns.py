@@ -1,13 +1,11 @@
 import random
 from numpy import mean
 
-import traci
-
 
 def randomChangeLaneFn((idx, car), sim, step):
     li = car["lane"]
     if random.random() > .99:
-        traci.vehicle.changeLane(car["id"], 1-li, 1000)
+        sim.commands.changeLane(car["id"], 1-li, 1000)
 
 
 def changeFasterLaneBuilder(speedThreshold = 5, likelihood_mult = 0.5, 
@@ -34,7 +32,7 @@ def changeFasterLaneBuilder(speedThreshold = 5, likelihood_mult = 0.5,
             if len(cars) > 0:
                 v[lane] = mean([c["v"] for c in cars])
             else:
-                v[lane] = traci.vehicle.getMaxSpeed(car["id"])
+                v[lane] = car["maxv"]
         maxv = max(v)
         maxl = v.index(maxv)
         myv = v[car["lane"]]
@@ -42,7 +40,7 @@ def changeFasterLaneBuilder(speedThreshold = 5, likelihood_mult = 0.5,
         if maxl != car["lane"] and \
            (maxv - myv) > speedThreshold and \
            random.random() < likelihood_mult * car["f"]:
-            traci.vehicle.changeLane(car["id"], maxl, 10000)
+            sim.commands.changeLane(car["id"], maxl, 10000)
     return carFn
 
 
@@ -85,13 +83,13 @@ def ACCFnBuilder(follow_sec = 3.0, max_speed = 26.8, gain = 0.01, beta = 0.5):
         if follow_dist < front_dist and curr_speed < max_speed:
             # speed up
             new_speed = min(curr_speed + beta * (front_speed-curr_speed) + gain * delta, max_speed)
-            traci.vehicle.slowDown(vehID, new_speed, 1000) # 2.5 sec
+            sim.commands.slowDown(vehID, new_speed, 1000) # 2.5 sec
             # print "t=%d, FASTER, %0.1f -> %0.1f (%0.1f) | d=%0.2f = %0.2f vs %0.2f" % \
             #       (step, curr_speed, new_speed, front_speed, delta, front_dist, follow_dist)
         elif follow_dist > front_dist:
             # slow down
             new_speed = max(curr_speed + beta * (front_speed-curr_speed) + gain * delta, 0)
-            traci.vehicle.slowDown(vehID, new_speed, 1000) # 2.5 sec
+            sim.commands.slowDown(vehID, new_speed, 1000) # 2.5 sec
             # print "t=%d, SLOWER, %0.1f -> %0.1f (%0.1f) | d=%0.2f = %0.2f vs %0.2f" % \
             #       (step, curr_speed, new_speed, front_speed, delta, front_dist, follow_dist)
 
@@ -138,13 +136,13 @@ def MidpointFnBuilder(max_speed = 26.8, gain = 0.1, beta = 0.5, duration = 500,
         if follow_dist < front_dist and curr_speed < max_speed:
             # speed up
             new_speed = min(curr_speed + beta * (front_speed-curr_speed) + gain * delta + bias, max_speed)
-            traci.vehicle.slowDown(vehID, new_speed, duration) # 2.5 sec
+            sim.commands.slowDown(vehID, new_speed, duration) # 2.5 sec
             # print "t=%d, FASTER, %0.1f -> %0.1f (%0.1f) | d=%0.2f = %0.2f vs %0.2f" % \
             #       (step, curr_speed, new_speed, front_speed, delta, front_dist, follow_dist)
         elif follow_dist > front_dist:
             # slow down
             new_speed = max(curr_speed + beta * (front_speed-curr_speed) + gain * delta + bias, 0)
-            traci.vehicle.slowDown(vehID, new_speed, duration) # 2.5 sec
+            sim.commands.slowDown(vehID, new_speed, duration) # 2.5 sec
             # print "t=%d, SLOWER, %0.1f -> %0.1f (%0.1f) | d=%0.2f = %0.2f vs %0.2f" % \
             #       (step, curr_speed, new_speed, front_speed, delta, front_dist, follow_dist)
 
@@ -182,8 +180,8 @@ def FillGapFnBuilder(duration=500, gap_back=10, gap_forward=5, gap_threshold=10)
         max_lane = gap.index(max_gap)
 
         if max_lane != car["lane"] and max_gap-gap[car["lane"]] > gap_threshold:
-            traci.vehicle.slowDown(car["id"], new_speed[max_lane], duration)
-            traci.vehicle.changeLane(car["id"], max_lane, 10000)
+            sim.commands.slowDown(car["id"], new_speed[max_lane], duration)
+            sim.commands.changeLane(car["id"], max_lane, 10000)
 
     return carFn
 
@@ -227,8 +225,8 @@ def FillGapMidpointFnBuilder(duration=500, gap_back=10, gap_forward=5,
         max_lane = gap.index(max_gap)
 
         if max_lane != car["lane"] and max_gap-gap[car["lane"]] > gap_threshold:
-            traci.vehicle.slowDown(car["id"], new_speed[max_lane], duration)
-            traci.vehicle.changeLane(car["id"], max_lane, 10000)
+            sim.commands.slowDown(car["id"], new_speed[max_lane], duration)
+            sim.commands.changeLane(car["id"], max_lane, 10000)
         else:
             vehID = car["id"]
 
@@ -249,13 +247,13 @@ def FillGapMidpointFnBuilder(duration=500, gap_back=10, gap_forward=5,
             if follow_dist < front_dist and curr_speed < max_speed:
                 # speed up
                 new_speed = min(curr_speed + beta * (front_speed-curr_speed) + gain * delta + bias, max_speed)
-                traci.vehicle.slowDown(vehID, new_speed, duration) # 2.5 sec
+                sim.commands.slowDown(vehID, new_speed, duration) # 2.5 sec
                 # print "t=%d, FASTER, %0.1f -> %0.1f (%0.1f) | d=%0.2f = %0.2f vs %0.2f" % \
                 #       (step, curr_speed, new_speed, front_speed, delta, front_dist, follow_dist)
             elif follow_dist > front_dist:
                 # slow down
                 new_speed = max(curr_speed + beta * (front_speed-curr_speed) + gain * delta + bias, 0)
-                traci.vehicle.slowDown(vehID, new_speed, duration) # 2.5 sec
+                sim.commands.slowDown(vehID, new_speed, duration) # 2.5 sec
                 # print "t=%d, SLOWER, %0.1f -> %0.1f (%0.1f) | d=%0.2f = %0.2f vs %0.2f" % \
                 #       (step, curr_speed, new_speed, front_speed, delta, front_dist, follow_dist)
 
@@ -278,7 +276,7 @@ def SwitchVTypeFn(car_type, switch_point, initCarFn=None):
         if initCarFn is not None:
             initCarFn((idx, car), sim, step)
         if step == int(float(sim.simSteps) * switch_point):
-            traci.vehicle.setType(car["id"], car_type)
+            sim.commands.setType(car["id"], car_type)
 
     return CarFn
 
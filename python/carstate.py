@@ -0,0 +1,270 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+def _firstTrue(pred, lo, hi):
+    """
+    First i in [lo, hi) for which the monotone predicate pred(i) holds, or hi
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if pred(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+class CarState(object):
+    """
+    Struct-of-arrays store for the per-step state of every car in a LoopSim.
+
+    Arrays are indexed by slot (the car's position in carNames) and allocated
+    once; each step they are refilled in place with set() and then update()
+    recomputes loop positions and the sort order.  Indexing the state with a
+    rank returns a CarView of the rank-th car in order of loop position, so
+    enumerate(state) yields the same (idx, car) pairs car functions got from
+    the old list of dicts.
+
+    update() also builds a per-lane index of ranks so getCars can find
+    neighbors by bisection instead of scanning the whole loop.
+    """
+
+    def __init__(self, carNames, edgestarts, length):
+        n = len(carNames)
+        self.length = length
+        self.ids = list(carNames)
+        self.index = dict((v, i) for (i, v) in enumerate(self.ids))
+
+        self.edges = sorted(edgestarts, key=edgestarts.get)
+        self.edgeCodes = dict((e, i) for (i, e) in enumerate(self.edges))
+        self.edgestarts = np.array([edgestarts[e] for e in self.edges], dtype=float)
+        self.types = []
+        self.typeCodes = {}
+
+        self.type = np.zeros(n, dtype=np.int32)
+        self.edge = np.zeros(n, dtype=np.int32)
+        self.lane = np.zeros(n, dtype=np.int32)
+        self.pos = np.zeros(n, dtype=float)
+        self.x = np.zeros(n, dtype=float)
+        self.v = np.zeros(n, dtype=float)
+        self.maxv = np.zeros(n, dtype=float)
+        self.f = np.zeros(n, dtype=float)
+
+        # order[rank] is the slot of the rank-th car along the loop
+        self.order = np.arange(n)
+        self.rank = np.arange(n)
+        self.sortedX = [0.] * n
+        self.allRanks = range(n)
+        self.laneRankArrays = {}
+        self.laneRanks = {}
+        self._views = [CarView(self, rank) for rank in range(n)]
+
+    def typeCode(self, name):
+        code = self.typeCodes.get(name)
+        if code is None:
+            code = self.typeCodes[name] = len(self.types)
+            self.types.append(name)
+        return code
+
+    def set(self, slot, typeID, edge, pos, lane, v, maxv, f):
+        self.type[slot] = self.typeCode(typeID)
+        self.edge[slot] = self.edgeCodes[edge]
+        self.pos[slot] = pos
+        self.lane[slot] = lane
+        self.v[slot] = v
+        self.maxv[slot] = maxv
+        self.f[slot] = f
+
+    def update(self):
+        """
+        Recompute loop positions and the sort order after all cars were set
+        """
+        np.add(self.edgestarts[self.edge], self.pos, out=self.x)
+        # stable, so ties keep carNames order like list.sort did
+        self.order = np.argsort(self.x, kind="mergesort")
+        self.rank[self.order] = np.arange(len(self.order))
+        self.sortedX = self.x[self.order].tolist()
+
+        lanes = self.lane[self.order]
+        self.laneRankArrays = dict((lane, np.flatnonzero(lanes == lane))
+                                   for lane in np.unique(lanes).tolist())
+        self.laneRanks = dict((lane, ranks.tolist())
+                              for (lane, ranks) in self.laneRankArrays.iteritems())
+
+    def adjacent(self, slots, lane):
+        """
+        Vectorized getCars(idx, numBack=1, numForward=1, lane=lane) for the
+        cars in slots.  lane is a single lane or one per car.
+        :return: (back, front) slot arrays, -1 where the lane has no other car
+        """
+        slots = np.asarray(slots)
+        lanes = np.zeros(len(slots), dtype=np.int32) + lane
+        back = np.empty(len(slots), dtype=np.intp)
+        back.fill(-1)
+        front = back.copy()
+
+        for l in np.unique(lanes).tolist():
+            ranks = self.laneRankArrays.get(l)
+            if ranks is None:
+                continue
+            sel = np.flatnonzero(lanes == l)
+            m = len(ranks)
+            rq = self.rank[slots[sel]]
+            pos = np.searchsorted(ranks, rq)
+            inLane = (self.lane[slots[sel]] == l).astype(np.intp)
+            ok = sel[m - inLane > 0]
+            pos, inLane = pos[m - inLane > 0], inLane[m - inLane > 0]
+            back[ok] = self.order[ranks[(pos - 1) % m]]
+            front[ok] = self.order[ranks[(pos + inLane) % m]]
+
+        return back, front
+
+    def batch(self, slots):
+        return CarBatch(self, slots)
+
+    def _scanLimit(self, idx, dx, forward):
+        """
+        Number of cars a linear scan around the loop from rank idx passes
+        before reaching the first one more than dx away.  The scan visits
+        ranks idx+1..n-1, 0..idx-1 going forward and idx-1..0, n-1..idx+1
+        going back.  Distances grow along the scan except for cars level
+        with idx, which come last (at distance 0) when they wrap around.
+        """
+        n = len(self.ids)
+        if dx is None:
+            return n - 1
+        xs, x, length = self.sortedX, self.sortedX[idx], self.length
+
+        if forward:
+            na, nb = n - 1 - idx, bisect_left(xs, x, 0, idx)
+            pos = _firstTrue(lambda p: (xs[idx+1+p] - x) % length > dx, 0, na)
+            if pos == na:
+                pos = _firstTrue(lambda p: (xs[p-na] - x) % length > dx,
+                                 na, na + nb)
+        else:
+            na, nb = idx, n - bisect_right(xs, x, idx + 1, n)
+            pos = _firstTrue(lambda p: (x - xs[idx-1-p]) % length > dx, 0, na)
+            if pos == na:
+                pos = _firstTrue(lambda p: (x - xs[n-1-p+na]) % length > dx,
+                                 na, na + nb)
+        return pos if pos < na + nb else n - 1
+
+    def getCars(self, idx, numBack=None, numForward=None,
+                           dxBack=None, dxForward=None,
+                           lane=None):
+        """
+        Cars around the rank-idx car, ordered back to front: at most numBack
+        behind it within dxBack (m) and at most numForward ahead of it within
+        dxForward, optionally restricted to one lane.  Same results as
+        scanning the loop car by car, in O(log N) plus the number returned.
+        """
+        n = len(self.ids)
+        ranks = self.allRanks if lane is None else self.laneRanks.get(lane, [])
+        m = len(ranks)
+        # ranks[:p] are behind idx along the loop, ranks[q:] ahead of it
+        p = bisect_left(ranks, idx)
+        q = p + 1 if p < m and ranks[p] == idx else p
+
+        back = []
+        limit = self._scanLimit(idx, dxBack, False)
+        for k in xrange(m - q + p):
+            r = ranks[(p - 1 - k) % m]
+            scanpos = idx - 1 - r if r < idx else idx - 1 + n - r
+            if scanpos >= limit or (numBack is not None and len(back) >= numBack):
+                break
+            back.append(self._views[r])
+        back.reverse()
+
+        front = []
+        limit = self._scanLimit(idx, dxForward, True)
+        for k in xrange(m - q + p):
+            r = ranks[(q + k) % m]
+            scanpos = r - idx - 1 if r > idx else n - 1 - idx + r
+            if scanpos >= limit or (numForward is not None and len(front) >= numForward):
+                break
+            front.append(self._views[r])
+
+        return back + front
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, rank):
+        return self._views[rank]
+
+    def __iter__(self):
+        return iter(self._views)
+
+
+class CarBatch(object):
+    """
+    Columns of a CarState for a subset of cars (usually all cars of one
+    vehicle type), as handed to batch car functions.  follower and leader
+    are the slots of the adjacent cars on each car's own lane (-1 if it is
+    alone there); index the state's arrays with them to read their x, v...
+    """
+
+    def __init__(self, state, slots):
+        self.state = state
+        self.slots = slots
+        self.ids = [state.ids[slot] for slot in slots]
+        self.x = state.x[slots]
+        self.v = state.v[slots]
+        self.lane = state.lane[slots]
+        self.maxv = state.maxv[slots]
+        self.f = state.f[slots]
+        self.follower, self.leader = state.adjacent(slots, self.lane)
+
+    def adjacent(self, lane):
+        """ (back, front) slots of the adjacent cars on the given lane(s) """
+        return self.state.adjacent(self.slots, lane)
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class CarView(object):
+    """
+    Read-only, dict-like view of the car at a given rank of a CarState
+    """
+    __slots__ = ("_state", "rank")
+
+    def __init__(self, state, rank):
+        self._state = state
+        self.rank = rank
+
+    @property
+    def slot(self):
+        return self._state.order[self.rank]
+
+    def __getitem__(self, key):
+        s = self._state
+        slot = s.order[self.rank]
+        if key == "x":
+            return float(s.x[slot])
+        elif key == "v":
+            return float(s.v[slot])
+        elif key == "lane":
+            return int(s.lane[slot])
+        elif key == "id":
+            return s.ids[slot]
+        elif key == "type":
+            return s.types[s.type[slot]]
+        elif key == "edge":
+            return s.edges[s.edge[slot]]
+        elif key == "maxv":
+            return float(s.maxv[slot])
+        elif key == "f":
+            return float(s.f[slot])
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return "<CarView %s rank=%d>" % (self["id"], self.rank)
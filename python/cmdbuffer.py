@@ -0,0 +1,95 @@
+from collections import OrderedDict
+
+
+class CommandBuffer(object):
+    """
+    Collects the vehicle commands issued during a LoopSim step and sends them
+    to TraCI in one pass with flush(), right before the next simulationStep.
+
+    Commands that would not change anything are dropped: a color a car
+    already has, or a slowDown/changeLane identical to one sent earlier
+    whose duration has not run out yet.  When the same kind of command is
+    given to a car twice within a step only the last one is sent.
+
+    counts holds one (issued, dropped) pair per flushed step; LoopSim.finish
+    reports their totals (summary).
+    """
+
+    def __init__(self, conn, stepLength):
+        self.conn = conn
+        self.stepLength = stepLength
+        self.time = 0.
+        self.pending = OrderedDict()
+        self.sent = {}
+        self.dropped = 0
+        self.counts = []
+
+    def _add(self, kind, vehID, args, duration=None):
+        # duration (ms) is how long the command stays in effect, None=forever
+        last = self.sent.get((kind, vehID))
+        if last is not None and last[0] == args and \
+           (last[1] is None or self.time < last[1]):
+            self.dropped += 1
+            return
+        key = (kind, vehID)
+        if key in self.pending:
+            # superseded within the same step
+            self.dropped += 1
+            del self.pending[key]
+        self.pending[key] = (args, duration)
+
+    def setColor(self, vehID, color):
+        # TraCI sends colors as bytes, so integer colors lose nothing
+        self._add("setColor", vehID, tuple(int(c) for c in color))
+
+    def slowDown(self, vehID, speed, duration):
+        self._add("slowDown", vehID, (speed, duration), duration)
+
+    def changeLane(self, vehID, laneIndex, duration):
+        self._add("changeLane", vehID, (laneIndex, duration), duration)
+
+    def setType(self, vehID, typeID):
+        self._add("setType", vehID, (typeID,))
+
+    def flush(self):
+        """
+        Send all pending commands, then advance the buffer's clock by one step
+        """
+        vehicle = self.conn.vehicle
+        for ((kind, vehID), (args, duration)) in self.pending.iteritems():
+            if kind == "setColor":
+                vehicle.setColor(vehID, args)
+            else:
+                getattr(vehicle, kind)(vehID, *args)
+            until = None if duration is None else self.time + duration
+            self.sent[(kind, vehID)] = (args, until)
+            if kind == "setType":
+                # a new type resets what the car is doing
+                self.sent.pop(("slowDown", vehID), None)
+
+        self.counts.append((len(self.pending), self.dropped))
+        self.pending.clear()
+        self.dropped = 0
+        self.time += self.stepLength * 1000.
+
+    def state(self):
+        """
+        The commands still pending and in effect, and the buffer's clock,
+        for restore
+        """
+        return {"time": self.time, "pending": OrderedDict(self.pending),
+                "sent": dict(self.sent)}
+
+    def restore(self, state):
+        """ Carry on from a state() of another buffer """
+        self.time = state["time"]
+        self.pending = OrderedDict(state["pending"])
+        self.sent = dict(state["sent"])
+
+    def summary(self):
+        """
+        :return: (issued, dropped) command totals over all flushed steps
+        """
+        issued = sum(c[0] for c in self.counts)
+        dropped = sum(c[1] for c in self.counts)
+        return issued, dropped
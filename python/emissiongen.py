@@ -0,0 +1,161 @@
+"""
+Synthetic SUMO emission output, for testing parsexml and the plots at any
+scale without running SUMO.
+
+The cars drive around the four-edge loop makenet builds, in the format of
+SUMO's emission-output (the same as ringsim writes), with "<type>-NNN" ids.
+Their speeds follow stop-and-go waves: every lane has numJams jams moving
+backwards around the loop at waveSpeed, in which the speed drops by up to
+jamDepth of maxSpeed, plus some noise per car.  A car's speed only depends
+on where it is, so cars on a lane keep their order.  Fuel and CO/CO2 come
+from ringsim's road-load estimate.
+
+The file is written a timestep at a time (gzipped if its name ends in .gz),
+so its size is only limited by the disk:
+
+    python emissiongen.py out.emission.xml [--cars human:36,robot:4]
+        [--lanes 2] [--length 1000] [--steps 3600] [--step-length 1]
+        [--jams 2] [--jam-depth 0.8] [--jam-width 60] [--wave-speed -4]
+"""
+import argparse
+import gzip
+import os
+import random
+import time
+
+import numpy as np
+
+from ringsim import EDGES, EMISSION_VEHICLE, CO2_PER_FUEL, CO_PER_FUEL, fuelRate
+
+
+def carIds(types, seed=0):
+    """
+    :param types: list of (type name, count)
+    :return: ids of all the cars, shuffled
+    """
+    ids = []
+    for (vtype, count) in types:
+        if count > 1000:
+            # parsexml takes the type to be all but the last 4 characters
+            raise ValueError("At most 1000 cars per type, not %d %s" % (count, vtype))
+        ids.extend("%s-%03d" % (vtype, i) for i in range(count))
+    random.Random(seed).shuffle(ids)
+    return ids
+
+
+def jamSpeeds(x, lane, t, length, maxSpeed, numJams, jamDepth, jamWidth,
+              waveSpeed):
+    """ Speed at positions x on lanes lane at time t, without noise """
+    factor = np.ones(len(x))
+    for j in range(numJams):
+        # each lane's jams are a quarter of their spacing ahead of the last's
+        center = (length * (j + 0.25 * lane) / numJams + waveSpeed * t) % length
+        d = np.abs(x - center)
+        d = np.minimum(d, length - d)
+        factor -= jamDepth * np.exp(-0.5 * (d / jamWidth) ** 2)
+    return maxSpeed * np.clip(factor, 0, 1)
+
+
+def generate(fn, types=(("human", 36), ("robot", 4)), numLanes=2, length=1000,
+             numSteps=3600, stepLength=1., maxSpeed=30., numJams=2,
+             jamDepth=0.8, jamWidth=60., waveSpeed=-4., noise=0.5, seed=0):
+    """
+    Write an emission file
+    :param types: list of (type name, count) of the cars
+    :param numJams: jams per lane, 0 for free flow
+    :param jamDepth: fraction of maxSpeed lost at the middle of a jam
+    :param jamWidth: standard deviation (m) of a jam's speed drop
+    :param waveSpeed: speed (m/s) of the jams, negative for backwards
+    :param noise: standard deviation (m/s) of the cars' speed noise
+    :return: edgestarts of the loop, to parse the file with
+    """
+    if not 1 <= numLanes <= 10:
+        # parsexml takes the lane to be the last character of its id
+        raise ValueError("Between 1 and 10 lanes, not %d" % numLanes)
+    rng = np.random.RandomState(seed)
+    ids = carIds(types, seed)
+    numCars = len(ids)
+    typeNames = [carId[:-4] for carId in ids]
+    edgelen = length / 4.
+    edgestarts = dict((e, i * edgelen) for (i, e) in enumerate(EDGES))
+    starts = np.array([edgestarts[e] for e in EDGES])
+
+    # cars spread evenly over the lanes, and along each lane
+    lane = np.arange(numCars) % numLanes
+    x = np.empty(numCars)
+    for l in range(numLanes):
+        onLane = np.flatnonzero(lane == l)
+        x[onLane] = length * np.arange(len(onLane)) / float(max(1, len(onLane)))
+    v = jamSpeeds(x, lane, 0., length, maxSpeed, numJams, jamDepth, jamWidth,
+                  waveSpeed)
+    lanes = lane.tolist()
+    r = length / np.pi
+
+    # the default level 9 takes several times longer than making the rows
+    out = gzip.open(fn, "wb", 1) if fn.endswith(".gz") else open(fn, "w")
+    try:
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<emission-export>\n')
+        for step in range(numSteps):
+            t = (step + 1) * stepLength
+            vnext = jamSpeeds(x, lane, t, length, maxSpeed, numJams, jamDepth,
+                              jamWidth, waveSpeed)
+            if noise:
+                vnext = np.clip(vnext + rng.normal(0, noise, numCars), 0, maxSpeed)
+            fuel = fuelRate(vnext, (vnext - v) / stepLength)
+            x = (x + vnext * stepLength) % length
+            v = vnext
+
+            edge = np.minimum((x / edgelen).astype(int), len(EDGES) - 1)
+            edges = [EDGES[e] for e in edge.tolist()]
+            theta = 2 * np.pi * x / length - np.pi / 2
+            rows = zip(ids, (fuel * CO2_PER_FUEL).tolist(),
+                       (fuel * CO_PER_FUEL).tolist(), fuel.tolist(), edges,
+                       typeNames, edges, lanes, (x - starts[edge]).tolist(),
+                       v.tolist(), (np.degrees(-theta) % 360).tolist(),
+                       (r * np.cos(theta)).tolist(), (r * np.sin(theta)).tolist())
+            out.write('    <timestep time="%.2f">\n' % t)
+            out.write("".join([EMISSION_VEHICLE % row for row in rows]))
+            out.write('    </timestep>\n')
+        out.write('</emission-export>\n')
+    finally:
+        out.close()
+    return edgestarts
+
+
+def parseTypes(spec):
+    """ "human:36,robot:4" -> [("human", 36), ("robot", 4)] """
+    types = []
+    for item in spec.split(","):
+        name, count = item.split(":")
+        types.append((name, int(count)))
+    return types
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("fn", help="output file, gzipped if it ends in .gz")
+    parser.add_argument("--cars", default="human:36,robot:4",
+                        help="type:count,... (default %(default)s)")
+    parser.add_argument("--lanes", type=int, default=2)
+    parser.add_argument("--length", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=3600)
+    parser.add_argument("--step-length", type=float, default=1.)
+    parser.add_argument("--max-speed", type=float, default=30.)
+    parser.add_argument("--jams", type=int, default=2)
+    parser.add_argument("--jam-depth", type=float, default=0.8)
+    parser.add_argument("--jam-width", type=float, default=60.)
+    parser.add_argument("--wave-speed", type=float, default=-4.)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.time()
+    generate(args.fn, parseTypes(args.cars), args.lanes, args.length,
+             args.steps, args.step_length, args.max_speed, args.jams,
+             args.jam_depth, args.jam_width, args.wave_speed, args.noise,
+             args.seed)
+    elapsed = time.time() - start
+    size = os.path.getsize(args.fn) / 1024. / 1024.
+    print "%s: %.1f MB in %.1f s (%.1f MB/s)" % (args.fn, size, elapsed,
+                                                 size / elapsed)
@@ -0,0 +1,357 @@
+"""
+Fake TraCI connection for running LoopSim without SUMO.
+
+Vehicles drive around a four-edge ring (the same bottom/right/top/left
+layout makenet builds) at a constant speed unless slowed down.  Every call
+that would be a socket round trip to a real SUMO instance is counted in
+FakeTraCI.calls, so different state collection strategies can be compared
+without a SUMO install.
+"""
+import os
+import sys
+import types
+
+# TraCI protocol constants used by LoopSim (see traci/constants.py)
+CMD_GET_VEHICLE_VARIABLE = 0xa4
+VAR_SPEED = 0x40
+VAR_MAXSPEED = 0x41
+VAR_TYPE = 0x4f
+VAR_ROAD_ID = 0x50
+VAR_LANE_INDEX = 0x52
+VAR_LANEPOSITION = 0x56
+VAR_SPEED_FACTOR = 0x5e
+
+EDGES = ["bottom", "right", "top", "left"]
+
+
+class FatalTraCIError(Exception):
+    pass
+
+
+class _Domain(object):
+    def __init__(self, conn):
+        self._conn = conn
+
+    def _call(self):
+        self._conn.calls += 1
+
+
+class _VehicleTypeDomain(_Domain):
+
+    def _set(self, typeID, key, value):
+        self._call()
+        self._conn.types.setdefault(typeID, {})[key] = value
+
+    def setMaxSpeed(self, typeID, speed):
+        self._set(typeID, "maxSpeed", speed)
+
+    def setAccel(self, typeID, accel):
+        self._set(typeID, "accel", accel)
+
+    def setDecel(self, typeID, decel):
+        self._set(typeID, "decel", decel)
+
+    def setImperfection(self, typeID, sigma):
+        self._set(typeID, "sigma", sigma)
+
+    def setTau(self, typeID, tau):
+        self._set(typeID, "tau", tau)
+
+    def setSpeedFactor(self, typeID, factor):
+        self._set(typeID, "speedFactor", factor)
+
+    def setSpeedDeviation(self, typeID, deviation):
+        self._set(typeID, "speedDev", deviation)
+
+    def setShapeClass(self, typeID, shapeClass):
+        self._set(typeID, "shape", shapeClass)
+
+
+class _VehicleDomain(_Domain):
+
+    def __init__(self, conn):
+        _Domain.__init__(self, conn)
+        self._subscriptions = {}
+
+    def addFull(self, vehID, routeID, typeID="DEFAULT_VEHTYPE", **kwargs):
+        self._call()
+        self._conn.vehicles[vehID] = {
+                "type": typeID,
+                "edge": routeID[len("route"):],
+                "lane": 0,
+                "pos": 0.,
+                "speed": self._conn.speed,
+                }
+
+    def moveTo(self, vehID, laneID, pos):
+        self._call()
+        edge, lane = laneID.rsplit("_", 1)
+        veh = self._conn.vehicles[vehID]
+        veh["edge"] = edge
+        veh["lane"] = int(lane)
+        veh["pos"] = pos
+
+    def _type(self, vehID):
+        return self._conn.types.get(self._conn.vehicles[vehID]["type"], {})
+
+    def getTypeID(self, vehID):
+        self._call()
+        return self._conn.vehicles[vehID]["type"]
+
+    def getRoadID(self, vehID):
+        self._call()
+        return self._conn.vehicles[vehID]["edge"]
+
+    def getLanePosition(self, vehID):
+        self._call()
+        return self._conn.vehicles[vehID]["pos"]
+
+    def getLaneIndex(self, vehID):
+        self._call()
+        return self._conn.vehicles[vehID]["lane"]
+
+    def getSpeed(self, vehID):
+        self._call()
+        return self._conn.vehicles[vehID]["speed"]
+
+    def getMaxSpeed(self, vehID):
+        self._call()
+        return self._type(vehID).get("maxSpeed", 70.)
+
+    def getSpeedFactor(self, vehID):
+        self._call()
+        return self._type(vehID).get("speedFactor", 1.)
+
+    def setColor(self, vehID, color):
+        self._call()
+
+    def setType(self, vehID, typeID):
+        self._call()
+        self._conn.vehicles[vehID]["type"] = typeID
+
+    def slowDown(self, vehID, speed, duration):
+        self._call()
+        self._conn.vehicles[vehID]["speed"] = speed
+
+    def changeLane(self, vehID, laneIndex, duration):
+        self._call()
+        self._conn.vehicles[vehID]["lane"] = laneIndex
+
+    def subscribe(self, objectID, varIDs=(VAR_ROAD_ID, VAR_LANEPOSITION),
+                  begin=0, end=2**31-1):
+        self._call()
+        self._subscriptions[objectID] = varIDs
+
+    def getSubscriptionResults(self, objectID=None):
+        # Results arrive with the simulationStep response, no extra call
+        if objectID is None:
+            return dict((v, self._conn._results(v, varIDs))
+                        for (v, varIDs) in self._subscriptions.iteritems())
+        if objectID not in self._subscriptions:
+            return None
+        return self._conn._results(objectID, self._subscriptions[objectID])
+
+
+class _EdgeDomain(_Domain):
+
+    def __init__(self, conn):
+        _Domain.__init__(self, conn)
+        self._contexts = {}
+
+    def subscribeContext(self, objectID, domain, dist,
+                         varIDs=(VAR_ROAD_ID, VAR_LANEPOSITION),
+                         begin=0, end=2**31-1):
+        self._call()
+        self._contexts[objectID] = varIDs
+
+    def getContextSubscriptionResults(self, objectID=None):
+        varIDs = self._contexts.get(objectID)
+        if varIDs is None:
+            return None
+        return dict((v, self._conn._results(v, varIDs))
+                    for (v, veh) in self._conn.vehicles.iteritems()
+                        if veh["edge"] == objectID)
+
+
+class _GuiDomain(_Domain):
+
+    def screenshot(self, viewID, filename):
+        self._call()
+
+
+class FakeTraCI(object):
+    """
+    Stand-in for the traci module.  Vehicles keep their speed (default
+    `speed` m/s) until slowDown is called and never interact.
+    """
+
+    def __init__(self, length=1000, speed=10.):
+        self.length = length
+        self.speed = speed
+        self.vehicle = _VehicleDomain(self)
+        self.vehicletype = _VehicleTypeDomain(self)
+        self.edge = _EdgeDomain(self)
+        self.gui = _GuiDomain(self)
+        self.cwd = os.getcwd()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.steps = 0
+        self.vehicles = {}
+        self.types = {}
+        self.vehicle._subscriptions.clear()
+        self.edge._contexts.clear()
+
+    def _results(self, vehID, varIDs):
+        veh = self.vehicles[vehID]
+        tp = self.types.get(veh["type"], {})
+        allvars = {
+                VAR_TYPE: veh["type"],
+                VAR_ROAD_ID: veh["edge"],
+                VAR_LANEPOSITION: veh["pos"],
+                VAR_LANE_INDEX: veh["lane"],
+                VAR_SPEED: veh["speed"],
+                VAR_MAXSPEED: tp.get("maxSpeed", 70.),
+                VAR_SPEED_FACTOR: tp.get("speedFactor", 1.),
+                }
+        return dict((var, allvars[var]) for var in varIDs)
+
+    def init(self, port=8813, numRetries=10, host="localhost", label="default"):
+        self.calls += 1
+
+    def connect(self, port=8813, numRetries=10, host="localhost", proc=None):
+        # a single fake stands in for every connection
+        self.calls += 1
+        # where the SUMO process behind it would have been started
+        self.cwd = os.getcwd()
+        return self
+
+    def close(self):
+        self.calls += 1
+
+    def load(self, args):
+        # SUMO finds the files it loads from its own working directory, not
+        # the caller's, and exits if they are not there
+        for (opt, fn) in zip(args, args[1:]):
+            if opt in ("-c", "-n") and not os.path.exists(os.path.join(
+                    self.cwd, fn)):
+                raise FatalTraCIError("SUMO could not load %s" % fn)
+        # a new simulation, without the vehicles and types of the last one
+        self.vehicles.clear()
+        self.types.clear()
+        self.vehicle._subscriptions.clear()
+        self.edge._contexts.clear()
+        self.calls += 1
+
+    def wait(self):
+        # stands in for the SUMO subprocess as well
+        return 0
+
+    def simulationStep(self, step=0):
+        self.calls += 1
+        self.steps += 1
+        edgelen = self.length/4.
+        for veh in self.vehicles.itervalues():
+            pos = veh["pos"] + veh["speed"]
+            while pos >= edgelen:
+                pos -= edgelen
+                veh["edge"] = EDGES[(EDGES.index(veh["edge"])+1) % len(EDGES)]
+            veh["pos"] = pos
+
+
+def install(fake=None):
+    """
+    Register `fake` as the traci, traci.constants and sumolib modules, so that
+    LoopSim can be imported without SUMO.  Must be called before loopsim is
+    imported; later calls return the fake that is already installed.
+    """
+    installed = getattr(sys.modules.get("traci"), "fake", None)
+    if installed is not None:
+        return installed
+    if fake is None:
+        fake = FakeTraCI()
+
+    constants = types.ModuleType("traci.constants")
+    for (k, v) in globals().items():
+        if k.startswith("VAR_") or k.startswith("CMD_"):
+            setattr(constants, k, v)
+
+    module = types.ModuleType("traci")
+    module.constants = constants
+    module.fake = fake
+    module.FatalTraCIError = FatalTraCIError
+    for name in ["vehicle", "vehicletype", "edge", "gui",
+                 "init", "connect", "close", "load", "simulationStep"]:
+        setattr(module, name, getattr(fake, name))
+
+    sumolib = types.ModuleType("sumolib")
+    sumolib.checkBinary = lambda name: name
+
+    sys.modules["traci"] = module
+    sys.modules["traci.constants"] = constants
+    sys.modules["sumolib"] = sumolib
+    return fake
+
+
+def fakeLoopSim(fake, length=1000, numLanes=2, simStepLength=1.):
+    """
+    A LoopSim that runs against `fake` (see install) without netconvert or a
+    SUMO subprocess
+    """
+    from loopsim import LoopSim
+
+    class FakeLoopSim(LoopSim):
+        # Skip netconvert and the SUMO subprocess
+        def __init__(self):
+            self.name = "fake-%dm%dl" % (length, numLanes)
+            self.length = length
+            self.numLanes = numLanes
+            self.speedLimit = 35
+            self.simStepLength = simStepLength
+            edgelen = length/4.
+            self.edgestarts = dict((e, i*edgelen) for (i, e) in enumerate(EDGES))
+            self.vid_path = "/tmp"
+
+        def _simInit(self, paramsList, sumo, sublane, *outputArgs):
+            self.outs = {}
+            self.sumoProcess = fake
+            self.conn = fake
+            fake.init()
+
+        def _subscribe(self, collect):
+            # Only count calls made once the cars are in
+            fake.calls = 0
+            LoopSim._subscribe(self, collect)
+
+    fake.length = length
+    return FakeLoopSim()
+
+
+def roundTrips(numCars=100, numLanes=2, length=1000, simSteps=20):
+    """
+    Run LoopSim against a FakeTraCI with each state collection mode and
+    return the number of TraCI round trips per simulation step (including
+    subscription setup and per-car setColor calls)
+    """
+    fake = install()
+    from loopsim import COLLECT_MODES
+
+    ret = {}
+    for collect in COLLECT_MODES:
+        fake.reset()
+        sim = fakeLoopSim(fake, length, numLanes)
+        opts = {
+                "paramsList" : [{"name": "human", "count": numCars}],
+                "simSteps"   : simSteps,
+                }
+        sim.simulate(opts, collect=collect)
+        ret[collect] = fake.calls * 1. / simSteps
+    return ret
+
+
+if __name__ == "__main__":
+    for numCars in [22, 100, 200]:
+        trips = roundTrips(numCars=numCars)
+        print "%d cars:" % numCars, ", ".join(
+                "%s=%.1f" % (k, trips[k]) for k in sorted(trips)), "round trips/step"
@@ -1,13 +1,13 @@
 import copy
-import random
+import sys
 
 from carfns import SwitchVTypeFn, changeFasterLaneBuilder
-from loopsim import LoopSim
 from agent_types import basicHumanParams as humanParams, \
     basicIDMParams as IDMParams, basicACCParams as ACCParams, \
     basicGapFillerParams as gapFillerParams, \
     basicFillGapMidpointParams as fillGapMidpointParams,\
     basicMidpointParams as midpointParams
+from sweep import runSweep, printTable
 import config as defaults
 
 
@@ -19,39 +19,57 @@ if __name__ == "__main__":
     numLanes = 2
     length = 1000
     simSteps = 500
+    sumo = sys.argv[1] if len(sys.argv) > 1 else defaults.BINARY
 
     nRobotss = [40, 60]
     vtypes = ["idm", "acc", "midpoint", "gapfiller", "fillgapmidpoint"]
 
     humanParams["count"] = 50
     changeFasterLane = changeFasterLaneBuilder()
-    hybridParams = copy.copy(humanParams)
-    hybridParams["name"] = "hybrid"
 
+    jobs = []
     # for nRobots in range(1, 22, 3):
     for nRobots in nRobotss:
+        # The hybrids switch to each type half way, so the first half is
+        # simulated once per nRobots and the types branch off from there
+        # (loopsim.branches).  The recording gives every branch's plot the
+        # whole run.
+        hybridParams = copy.copy(humanParams)
+        hybridParams["name"] = "hybrid"
+        hybridParams["count"] = nRobots
+        hybridParams["function"] = changeFasterLane
+
+        branchOpts = []
         for vtype in vtypes:
             # Sweep through each type
-
-            # reset the random seed so that the first half of the sim is held constant per nRobots
-            if defaults.RANDOM_SEED:
-                print "Setting random seed to ", defaults.RANDOM_SEED
-                random.seed(defaults.RANDOM_SEED)
-
-            hybridParams["count"] = nRobots
-            hybridParams["function"] = SwitchVTypeFn(vtype, 0.5,
+            switchParams = copy.copy(hybridParams)
+            switchParams["function"] = SwitchVTypeFn(vtype, 0.5,
                                                      initCarFn=changeFasterLane)
-
-            opts = {
+            branchOpts.append({
                 "paramsList" : [humanParams, IDMParams, ACCParams,
                                 gapFillerParams, fillGapMidpointParams,
-                                hybridParams, midpointParams],
+                                switchParams, midpointParams],
                 "simSteps"   : simSteps,
                 "tag"        : "few-%s-sweep" % vtype,
-            }
+            })
+
+        opts = {
+            "paramsList" : [humanParams, IDMParams, ACCParams,
+                            gapFillerParams, fillGapMidpointParams,
+                            hybridParams, midpointParams],
+            "simSteps"   : simSteps,
+            "tag"        : "few-warmup",
+        }
 
-            sim = LoopSim("loopsim", length=length, numLanes=numLanes,
-                          simStepLength=simStepLength)
+        jobs.append({
+            "sim"        : {"name": "loopsim", "length": length,
+                            "numLanes": numLanes,
+                            "simStepLength": simStepLength},
+            "opts"       : opts,
+            "branchStep" : int(simSteps * 0.5),
+            "branches"   : branchOpts,
+            "simulate"   : {"sumo": sumo, "record": True},
+            "plot"       : {},
+        })
 
-            sim.simulate(opts)
-            sim.plot(show=True, save=True)
+    printTable(runSweep(jobs, outdir="sweep/few_robots/", warm=True))
@@ -2,6 +2,7 @@ import random
 
 import config as defaults
 from loopsim import LoopSim
+from video import RingVideo
 from agent_types import basicHumanParams as humanParams, \
     basicIDMParams as IDMParams, basicACCParams as ACCParams, \
     basicGapFillerParams as gapFillerParams, \
@@ -73,7 +74,11 @@ if __name__ == "__main__":
                     print "robot type =", rParams["name"], "run = ", run
                     print "***"
                     speedRange = (0,30)
-                    sim.simulate(opts, sumo='sumo-gui', speedRange=speedRange, sublane=False)
+                    # a video drawn from the car positions rather than a
+                    # sumo-gui screenshot per step
+                    sim.simulate(opts, sumo=defaults.BINARY, speedRange=speedRange,
+                                 sublane=False,
+                                 live=RingVideo(fps=fps, speedRange=speedRange))
                     sim.plot(show=False, save=True, speedRange=speedRange).close("all")
                 if numRobots == 0:
                     break
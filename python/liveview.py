@@ -0,0 +1,124 @@
+"""
+Live view of a LoopSim run, drawn from the car state the run collects every
+step, as it goes.
+
+A LiveHeatmap keeps a ring buffer of the last `window` speed profiles of
+every lane (speed at each metre of the loop, interpolated between cars like
+parsexml does) and shows them as a position / time heatmap.  Only the
+images and the clock are redrawn, by blitting them onto the rest of the
+figure drawn once.  Pass one to simulate (or start):
+
+    sim.simulate(opts, live=LiveHeatmap())                # in a window
+    sim.simulate(opts, live=LiveHeatmap(frames="live/"))  # PNG frames
+
+Without a display, frames= writes a PNG every redrawEvery steps instead, so
+a sweep's runs can be watched (and bad ones stopped) while they run.
+"""
+import os
+
+import numpy as np
+import matplotlib.image
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from parsexml import interp
+from plots import my_cmap
+
+
+class LiveHeatmap(object):
+    """
+    :param window: number of speed profiles shown per lane
+    :param every: add a speed profile every that many steps
+    :param redrawEvery: redraw (or write a frame) every that many steps
+    :param frames: directory to write PNG frames to (in a subdirectory per
+                   run) instead of showing a window
+    :param speedRange: (min, max) of the color scale, by default 0 to the
+                       fastest car type's maxSpeed
+    """
+
+    def __init__(self, window=500, every=1, redrawEvery=10, frames=None,
+                 speedRange=None):
+        self.window = window
+        self.every = every
+        self.redrawEvery = redrawEvery
+        self.frames = frames
+        self.speedRange = speedRange
+        self.fig = None
+
+    def start(self, sim):
+        """ Set up the buffers and the figure for a run of sim """
+        self.rows = 0
+        self.xq = np.arange(sim.length)
+        self.buf = np.empty((sim.numLanes, self.window, sim.length), dtype=np.float32)
+        self.buf.fill(np.nan)
+        vmin, vmax = self.speedRange or (0, sim.maxSpeed)
+
+        if self.frames is not None:
+            self.frameDir = os.path.join(self.frames, sim.name+"-"+sim.label)
+            if not os.path.isdir(self.frameDir):
+                os.makedirs(self.frameDir)
+            self.fig = Figure(figsize=(8, 1 + 2.5*sim.numLanes), dpi=80)
+            FigureCanvasAgg(self.fig)
+        else:
+            import matplotlib.pyplot as plt
+            self.fig = plt.figure(figsize=(8, 1 + 2.5*sim.numLanes), dpi=80)
+            plt.show(block=False)
+
+        span = self.window * self.every * sim.simStepLength
+        self.images = []
+        for lane in range(sim.numLanes):
+            ax = self.fig.add_subplot(sim.numLanes, 1, lane+1)
+            im = ax.imshow(self.buf[lane].T, origin='lower', aspect='auto',
+                    interpolation='nearest', extent=(-span, 0, 0, sim.length),
+                    vmin=vmin, vmax=vmax, cmap=my_cmap, animated=True)
+            ax.set_ylabel("Position along loop (m)\nLane %d" % lane)
+            self.images.append(im)
+        ax.set_xlabel("Time before now (s)")
+        self.fig.colorbar(im, ax=self.fig.axes).set_label("Speed (m/s)")
+        self.clock = self.fig.axes[0].set_title("%s, t = 0 s" % sim.label,
+                                                animated=True)
+
+        # everything but the animated artists, to blit them onto
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def update(self, sim, step):
+        """ Called by sim after every step """
+        if step % self.every == 0:
+            cars = sim.allCars
+            row = self.rows % self.window
+            for lane in range(sim.numLanes):
+                onLane = cars.lane == lane
+                if onLane.any():
+                    self.buf[lane, row] = interp(cars.x[onLane], cars.v[onLane],
+                                                 sim.length)(self.xq)
+                else:
+                    self.buf[lane, row] = np.nan
+            self.rows += 1
+        if step % self.redrawEvery == 0:
+            self.redraw(sim, step)
+
+    def redraw(self, sim, step):
+        # oldest profile first
+        shift = -(self.rows % self.window)
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        for (lane, im) in enumerate(self.images):
+            im.set_data(np.roll(self.buf[lane], shift, axis=0).T)
+            im.axes.draw_artist(im)
+        self.clock.set_text("%s, t = %.1f s" % (sim.label,
+                                                (step + 1) * sim.simStepLength))
+        self.fig.axes[0].draw_artist(self.clock)
+
+        if self.frames is not None:
+            w, h = canvas.get_width_height()
+            rgba = np.asarray(canvas.buffer_rgba()).reshape(h, w, 4)
+            matplotlib.image.imsave(os.path.join(self.frameDir, "%08d.png" % step),
+                                    rgba)
+        else:
+            canvas.blit(self.fig.bbox)
+            canvas.flush_events()
+
+    def finish(self, sim):
+        """ Called by sim when the run ends: draw its last state """
+        self.redraw(sim, sim.stepNum - 1)
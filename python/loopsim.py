@@ -1,37 +1,74 @@
 import subprocess
 import sys
 import os
+import time
 import errno
 import random
 import copy
+import socket
 import numpy as np
 
-# Make sure $SUMO_HOME/tools is in $PYTHONPATH
-from sumolib import checkBinary
-import traci
-import traci.constants as tc
-
 import config as defaults
+import ringsim
+try:
+    # Make sure $SUMO_HOME/tools is in $PYTHONPATH
+    from sumolib import checkBinary
+    import traci
+    import traci.constants as tc
+except ImportError:
+    # Without SUMO only the built-in ring backend (sumo="ring") can run
+    checkBinary = traci = None
+    tc = ringsim
+from carstate import CarState
+from batchfns import isBatchFn, LANE_CHANGE_DURATION
+from cmdbuffer import CommandBuffer
 from makecirc import makecirc, makenet
-from parsexml import parsexml
+from parsexml import cachedParsexml
+from recorder import TrajectoryRecorder, parsetrajectory
 from plots import pcolor, pcolor_multi
+from profiler import StepProfiler, CountingConnection, formatSummary
+from metrics import OnlineMetrics
 
 
+# carParams keys and the vehicletype setters they are passed to
 KNOWN_PARAMS = {
-        "maxSpeed"      : traci.vehicletype.setMaxSpeed,
-        "accel"         : traci.vehicletype.setAccel,
-        "decel"         : traci.vehicletype.setDecel,
-        "sigma"         : traci.vehicletype.setImperfection,
-        "tau"           : traci.vehicletype.setTau,
-        "speedFactor"   : traci.vehicletype.setSpeedFactor,
-        "speedDev"      : traci.vehicletype.setSpeedDeviation,
-        "shape"         : traci.vehicletype.setShapeClass,
+        "maxSpeed"      : "setMaxSpeed",
+        "accel"         : "setAccel",
+        "decel"         : "setDecel",
+        "sigma"         : "setImperfection",
+        "tau"           : "setTau",
+        "speedFactor"   : "setSpeedFactor",
+        "speedDev"      : "setSpeedDeviation",
+        "shape"         : "setShapeClass",
         }
 
+# Per-car variables read every step, in the order they are requested
+STATE_VARS = (tc.VAR_TYPE, tc.VAR_ROAD_ID, tc.VAR_LANEPOSITION,
+              tc.VAR_LANE_INDEX, tc.VAR_SPEED, tc.VAR_MAXSPEED,
+              tc.VAR_SPEED_FACTOR)
+
+# How LoopSim.step reads car state from SUMO:
+#   getters   - one TraCI call per variable per car per step
+#   subscribe - one variable subscription per car, results come back
+#               with each simulationStep
+#   context   - one context subscription per loop edge
+COLLECT_MODES = ("getters", "subscribe", "context")
+
 if defaults.RANDOM_SEED:
     print "Setting random seed to ", defaults.RANDOM_SEED
     random.seed(defaults.RANDOM_SEED)
 
+def freePort():
+    """
+    A TCP port no one is listening on, as picked by the OS
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
 def ensure_dir(path):
     try:
         os.makedirs(path)
@@ -45,6 +82,9 @@ class LoopSim:
     def __init__(self, name, length, numLanes, 
             simStepLength=defaults.SIM_STEP_LENGTH,
             speedLimit=defaults.SPEED_LIMIT, port=defaults.PORT):
+        """
+        :param port: TraCI port of this sim's SUMO, None for a free one
+        """
         self.name = "%s-%dm%dl" % (name, length, numLanes)
         self.length = length
         self.numLanes = numLanes
@@ -58,13 +98,16 @@ class LoopSim:
                            "left": 3*edgelen}
 
         self._mkdirs(name)
-        # Make loop network
-        self.netfn = makenet(self.name, 
-                length=self.length, 
-                lanes=self.numLanes,
-                speedLimit=speedLimit,
-                path=self.net_path)
+        # The loop network is only made once a SUMO run needs it
+        self.netfn = None
         self.port = port
+        self.parsed = None
+        self.recorder = None
+        self.server = None
+        self.live = []
+        self.profiler = None
+        self.metrics = None
+        self.stopped = None
 
     def _mkdirs(self, name):
         self.net_path = ensure_dir("%s" % defaults.NET_PATH)
@@ -72,28 +115,77 @@ class LoopSim:
         self.img_path = ensure_dir("%s" % defaults.IMG_PATH)
         self.vid_path = ensure_dir("%s" % defaults.VID_PATH)
 
-    def _simInit(self, typeList, sumo, sublane):
+    def _simInit(self, paramsList, sumo, sublane, outputs, outputPeriod, compress,
+            pool=None):
+        if sumo == ringsim.BACKEND:
+            self._ringInit(paramsList, outputs, outputPeriod, compress)
+            return
+        if traci is None:
+            raise ImportError("SUMO tools not found: add $SUMO_HOME/tools to "
+                              "$PYTHONPATH or simulate with sumo=\"%s\"" % ringsim.BACKEND)
+
+        if self.netfn is None:
+            # Make loop network
+            self.netfn = makenet(self.name, 
+                    length=self.length, 
+                    lanes=self.numLanes,
+                    speedLimit=self.speedLimit,
+                    path=self.net_path)
+
         self.cfgfn, self.outs = makecirc(self.name+"-"+self.label, 
                 netfn=self.netfn, 
                 numcars=0, 
-                typelist=typeList,
-                dataprefix = defaults.DATA_PATH)
+                typelist=[x["name"] for x in paramsList],
+                dataprefix = defaults.DATA_PATH,
+                outputs=outputs,
+                period=outputPeriod,
+                compress=compress)
 
-        # Start simulator
         sumoBinary = checkBinary(sumo)
-        sumoProcessArgs = [
-                sumoBinary, 
+        # a pooled SUMO keeps the working directory it was started in, so
+        # it gets its files as absolute paths
+        sumoArgs = [
                 "--step-length", repr(self.simStepLength),
                 "--no-step-log",
-                "-c", self.cfgfn,
-                "--remote-port", str(self.port)]
+                "-c", os.path.abspath(self.cfgfn)]
         if sublane:
-            sumoProcessArgs.extend(["--lateral-resolution", "5"])
-        self.sumoProcess = subprocess.Popen(sumoProcessArgs,
+            sumoArgs.extend(["--lateral-resolution", "5"])
+
+        if pool is not None:
+            # Reuse a running SUMO (see sumopool)
+            self.server = pool.acquire(sumoBinary, sumoArgs)
+            self.sumoProcess = None
+            self.conn = self.server.conn
+            return
+
+        # Start simulator
+        if self.port is None:
+            self.port = freePort()
+        self.sumoProcess = subprocess.Popen(
+            [sumoBinary] + sumoArgs + ["--remote-port", str(self.port)],
             stdout=sys.stdout, stderr=sys.stderr)
 
-        # Initialize TraCI
-        traci.init(self.port)
+        # Each LoopSim has its own TraCI connection, so several of them can
+        # run side by side in one process
+        self.conn = traci.connect(self.port)
+
+    def _ringInit(self, paramsList, outputs, outputPeriod, compress):
+        # the ring simulator can only write emission output
+        emfn = None
+        self.outs = {}
+        if outputs is None or "emission" in outputs:
+            emfn = "%s%s.emission.xml" % (defaults.DATA_PATH, self.name+"-"+self.label)
+            if compress:
+                emfn += ".gz"
+            self.outs["emission"] = emfn
+        self.sumoProcess = None
+        self.conn = ringsim.RingSim(self.length, self.numLanes, self.speedLimit,
+                stepLength=self.simStepLength,
+                carFollowModels=dict((x["name"], x["carFollowModel"])
+                                     for x in paramsList if "carFollowModel" in x),
+                emissionFile=emfn,
+                emissionPeriod=outputPeriod,
+                seed=random.randint(0, 2**31-1))
 
     def _getEdge(self, x):
         for (e, s) in self.edgestarts.iteritems():
@@ -116,14 +208,14 @@ class LoopSim:
 
             for (pname, pvalue) in params.iteritems():
                 if pname in KNOWN_PARAMS:
-                    KNOWN_PARAMS[pname](name, pvalue)
+                    getattr(self.conn.vehicletype, KNOWN_PARAMS[pname])(name, pvalue)
 
             self.maxSpeed = max(self.maxSpeed, maxSpeed)
 
     def _createCar(self, name, x, vtype, lane):
         starte, startx = self._getEdge(x)
-        traci.vehicle.addFull(name, "route"+starte, typeID=vtype)
-        traci.vehicle.moveTo(name, starte + "_" + repr(lane), startx)
+        self.conn.vehicle.addFull(name, "route"+starte, typeID=vtype)
+        self.conn.vehicle.moveTo(name, starte + "_" + repr(lane), startx)
 
     def _addCars(self, paramsList):
         cars = {}
@@ -150,6 +242,16 @@ class LoopSim:
 
         self.carNames = cars.keys()
 
+    def _restoreCars(self, snapshot, paramsList):
+        # The cars of a snapshot in place of new ones
+        names = ["%s-%03d" % (param["name"], i) for param in paramsList
+                 for i in range(param["count"])]
+        if sorted(names) != sorted(snapshot["carNames"]):
+            raise ValueError("The snapshot has other cars than %s" % self.label)
+        self.conn.simulation.loadState(snapshot["state"])
+        self.carNames = list(snapshot["carNames"])
+        self.numCars = len(self.carNames)
+
     def _setCarColor(self, car, speedRange):
         if speedRange is None:
             mn, mx = 0, self.maxSpeed
@@ -174,69 +276,225 @@ class LoopSim:
             # green
             color = (0, 255, 0, 0)
 
-        traci.vehicle.setColor(car["id"], color)
+        self.commands.setColor(car["id"], color)
 
-    def _run(self, simSteps, speedRange, sumo):
-        vid_path = ensure_dir("%s/%s" % (self.vid_path, self.name+"-"+self.label))
-        for step in range(simSteps):
-            traci.simulationStep()
-            self.allCars = []
+    def _subscribe(self, collect):
+        if collect == "subscribe":
             for v in self.carNames:
-                car = {}
-                car["id"] = v
-                car["type"] = traci.vehicle.getTypeID(v)
-                car["edge"] = traci.vehicle.getRoadID(v)
-                position = traci.vehicle.getLanePosition(v)
-                car["lane"] = traci.vehicle.getLaneIndex(v)
-                car["x"] = self._getX(car["edge"], position)
-                car["v"] = traci.vehicle.getSpeed(v)
-                car["maxv"] = traci.vehicle.getMaxSpeed(v)
-                car["f"] = traci.vehicle.getSpeedFactor(v)
-                self.allCars.append(car)
-            self.allCars.sort(key=lambda x: x["x"])
-
-            for (idx, car) in enumerate(self.allCars):
-                self._setCarColor(car, speedRange)
-                carFn = self.carFns[car["type"]]
-                if carFn is not None:
-                    carFn((idx, car), self, step)
-            if sumo == "sumo-gui":
-                # Save a frame of the gui output to file 
-                # Combine all frames to make a video animation of sim results
-                traci.gui.screenshot("View #0", "%s/%08d.png" % (vid_path, step))
-
-        traci.close()
+                self.conn.vehicle.subscribe(v, STATE_VARS)
+        elif collect == "context":
+            for edge in self.edgestarts:
+                self.conn.edge.subscribeContext(edge,
+                        tc.CMD_GET_VEHICLE_VARIABLE, 0, STATE_VARS)
+        elif collect != "getters":
+            raise ValueError("Unknown state collection mode: %s" % collect)
+
+    def _queryCar(self, v):
+        return {
+                tc.VAR_TYPE         : self.conn.vehicle.getTypeID(v),
+                tc.VAR_ROAD_ID      : self.conn.vehicle.getRoadID(v),
+                tc.VAR_LANEPOSITION : self.conn.vehicle.getLanePosition(v),
+                tc.VAR_LANE_INDEX   : self.conn.vehicle.getLaneIndex(v),
+                tc.VAR_SPEED        : self.conn.vehicle.getSpeed(v),
+                tc.VAR_MAXSPEED     : self.conn.vehicle.getMaxSpeed(v),
+                tc.VAR_SPEED_FACTOR : self.conn.vehicle.getSpeedFactor(v),
+                }
+
+    def _collectState(self, collect):
+        if collect == "subscribe":
+            results = dict((v, self.conn.vehicle.getSubscriptionResults(v))
+                           for v in self.carNames)
+        elif collect == "context":
+            results = {}
+            for edge in self.edgestarts:
+                results.update(
+                    self.conn.edge.getContextSubscriptionResults(edge) or {})
+        else:
+            results = {}
+
+        for (slot, v) in enumerate(self.carNames):
+            res = results.get(v)
+            if not res:
+                # Not subscribed, or missing from this step's results
+                # (e.g. teleporting); fall back to individual getters
+                res = self._queryCar(v)
+            self.allCars.set(slot,
+                    res[tc.VAR_TYPE],
+                    res[tc.VAR_ROAD_ID],
+                    res[tc.VAR_LANEPOSITION],
+                    res[tc.VAR_LANE_INDEX],
+                    res[tc.VAR_SPEED],
+                    res[tc.VAR_MAXSPEED],
+                    res[tc.VAR_SPEED_FACTOR])
+
+    def step(self):
+        """
+        Advance the simulation started with start() by one step and run the
+        car functions on the new state
+        """
+        step = self.stepNum
+        prof = self.profiler
+        if prof is not None:
+            prof.begin(step)
+        # Send the commands issued during the previous step
+        self.commands.flush()
+        if prof is not None:
+            prof.lap("commands")
+        self.conn.simulationStep()
+        if prof is not None:
+            prof.lap("simulationStep")
+        self._collectState(self.collect)
+        if prof is not None:
+            prof.lap("collect")
+        self.allCars.update()
+        if prof is not None:
+            prof.lap("sort")
+        if self.recorder is not None:
+            self.recorder.record((step + 1) * self.simStepLength, self.allCars)
+            if prof is not None:
+                prof.lap("record")
+        if self.metrics is not None:
+            self.metrics.update(step, self.allCars.x, self.allCars.v,
+                                self.allCars.lane)
+            if prof is not None:
+                prof.lap("metrics")
+        for view in self.live:
+            view.update(self, step)
+        if prof is not None:
+            prof.lap("live")
+
+        for (idx, car) in enumerate(self.allCars):
+            if prof is not None:
+                prof.lap("cars")
+            if self.colors:
+                self._setCarColor(car, self.speedRange)
+                if prof is not None:
+                    prof.lap("colors")
+            carFn = self.carFns[car["type"]]
+            if carFn is not None and not isBatchFn(carFn):
+                carFn((idx, car), self, step)
+                if prof is not None:
+                    prof.lap("carFn:" + car["type"])
+        for (vtype, carFn) in self.carFns.iteritems():
+            if isBatchFn(carFn):
+                if prof is not None:
+                    prof.lap("cars")
+                self._runBatchFn(vtype, carFn, step)
+                if prof is not None:
+                    prof.lap("carFn:" + vtype)
+        if self.screenshots:
+            # Save a frame of the gui output to file 
+            # Combine all frames to make a video animation of sim results
+            self.conn.gui.screenshot("View #0", os.path.abspath(
+                    "%s/%08d.png" % (self.frame_path, step)))
+        if prof is not None:
+            prof.lap("screenshot")
+        for condition in self.stopConditions:
+            reason = condition.check(self, step)
+            if reason is not None:
+                self.stopped = (step, reason)
+                print "Stopping %s after step %d: %s" % (self.label, step, reason)
+                break
+        if prof is not None:
+            prof.lap("stop")
+            prof.end()
+        self.stepNum += 1
+
+    def finish(self):
+        """
+        End the simulation started with start(), closing its connection (or
+        handing its SUMO back to the pool it came from), and print how many
+        vehicle commands the run sent and the command buffer dropped
+        """
+        if self.server is not None:
+            self.pool.release(self.server, os.path.abspath(self.netfn))
+            self.server = None
+        else:
+            self.conn.close()
+        if self.recorder is not None:
+            self.recorder.save()
+        for view in self.live:
+            view.finish(self)
+        issued, dropped = self.commands.summary()
+        self.commandCounts = {"issued": issued, "dropped": dropped}
+        print "Commands of %s: %d sent, %d dropped (%.0f%%)" % (self.label,
+                issued, dropped, 100. * dropped / max(1, issued + dropped))
+        if self.profiler is not None:
+            npzfn, jsonfn, summary = self.profiler.save("%s%s" % (defaults.DATA_PATH,
+                    self.name+"-"+self.label), self.numCars)
+            self.outs["profile"] = jsonfn
+            self.outs["profileSteps"] = npzfn
+            self.profile = summary
+            print "Step profile of %s:" % self.label
+            print formatSummary(summary)
         sys.stdout.flush()
-        self.sumoProcess.wait()
+        if self.sumoProcess is not None:
+            self.sumoProcess.wait()
+
+    def _runBatchFn(self, vtype, carFn, step):
+        code = self.allCars.typeCodes.get(vtype)
+        if code is None:
+            return
+        slots = np.flatnonzero(self.allCars.type == code)
+        if len(slots) == 0:
+            return
+
+        speeds, lanes = carFn(self.allCars.batch(slots), self, step)
+        ids = self.allCars.ids
+        # Only issue the commands the controller asked for
+        for i in np.flatnonzero(~np.isnan(speeds)):
+            self.commands.slowDown(ids[slots[i]], float(speeds[i]), carFn.duration)
+        for i in np.flatnonzero(lanes >= 0):
+            self.commands.changeLane(ids[slots[i]], int(lanes[i]), LANE_CHANGE_DURATION)
+
+    def snapshot(self):
+        """
+        Save the run started with start() as it is between two steps, for
+        other runs to start from (see start and branches): the simulator's
+        state (saveState, written to DATA_PATH), the random module's state,
+        the pending commands, the recorded trajectory, the online metrics so
+        far and the state of car functions that have a getState attribute (restored with their
+        setState).
+        :return: snapshot dict
+        """
+        ext = ".state.pkl" if self.sumo == ringsim.BACKEND else ".state.xml"
+        # SUMO writes it from its own working directory, which for a pooled
+        # SUMO need not be ours
+        statefn = os.path.abspath("%s%s-step%06d%s" % (defaults.DATA_PATH,
+                self.name+"-"+self.label, self.stepNum, ext))
+        self.conn.simulation.saveState(statefn)
+        return {
+                "step"        : self.stepNum,
+                "state"       : statefn,
+                "random"      : random.getstate(),
+                "carNames"    : list(self.carNames),
+                "commands"    : self.commands.state(),
+                "carFns"      : dict((vtype, fn.getState())
+                                     for (vtype, fn) in self.carFns.iteritems()
+                                     if hasattr(fn, "getState")),
+                "trajectory"  : None if self.recorder is None else
+                                self.recorder.arrays(),
+                "metrics"     : None if self.metrics is None else
+                                self.metrics.state(),
+                }
 
     def getCars(self, idx, numBack = None, numForward = None, 
                            dxBack = None, dxForward = None,
                            lane = None):
-        ret = []
-        x = self.allCars[idx]["x"]
-
-        for i in range(idx-1, -1, -1) + range(self.numCars-1, idx, -1):
-            c = self.allCars[i]
-            if (dxBack is not None and (x - c["x"]) % self.length > dxBack) or \
-               (numBack is not None and len(ret) >= numBack):
-                    break
-            if (lane is None or c["lane"] == lane):
-                    ret.insert(0, c)
-
-        cnt = len(ret)
-
-        for i in range(idx+1, self.numCars) + range(0, idx):
-            c = self.allCars[i]
-            if (dxForward is not None and (c["x"]-x) % self.length > dxForward) or \
-               (numForward is not None and (len(ret) - cnt) >= numForward):
-                    break
-            if (lane is None or c["lane"] == lane):
-                    ret.append(c)
-
-        return ret
+        return self.allCars.getCars(idx, numBack=numBack, numForward=numForward,
+                                    dxBack=dxBack, dxForward=dxForward,
+                                    lane=lane)
 
 
-    def simulate(self, opts, sumo=defaults.BINARY, speedRange=None, sublane=False):
+    def start(self, opts, sumo=defaults.BINARY, speedRange=None, sublane=False,
+            collect="subscribe", colors=None, outputs=None, outputPeriod=None,
+            compress=False, record=False, pool=None, snapshot=None, live=None,
+            screenshots=None, profile=False, metrics=True, stop=None):
+        """
+        Start a simulation of opts and add its cars, without stepping it;
+        advance it with step() and end it with finish().  Takes the same
+        arguments as simulate.
+        """
 
         self.label = opts.get("label", None)
         tag = opts.get("tag", None)
@@ -250,15 +508,175 @@ class LoopSim:
         if tag is not None:
             self.label += "-" + tag
 
-        self._simInit([x["name"] for x in paramsList], sumo, sublane)
-        self._addTypes(paramsList)
-        self._addCars(paramsList)
-        self._run(self.simSteps, speedRange, sumo)
-
-    def plot(self, show=True, save=False, speedRange=None, fuelRange=None):
+        self.parsed = None
+        self.pool = pool
+        self.server = None
+        start = time.time()
+        self._simInit(paramsList, sumo, sublane, outputs, outputPeriod, compress,
+                      pool)
+        if snapshot is not None:
+            self._restoreCars(snapshot, paramsList)
+            self._addTypes(paramsList)
+        else:
+            self._addTypes(paramsList)
+            self._addCars(paramsList)
+        # Seconds from starting (or reloading) the simulator to the first step
+        self.startupTime = time.time() - start
+        if colors is None:
+            colors = sumo == "sumo-gui"
+        if screenshots is None:
+            screenshots = sumo == "sumo-gui"
+
+        self.sumo = sumo
+        self.speedRange = speedRange
+        self.collect = collect
+        self.colors = colors
+        self.screenshots = screenshots
+        self.frame_path = ensure_dir("%s/%s" % (self.vid_path, self.name+"-"+self.label))
+        self._subscribe(collect)
+        self.profiler = None
+        self.profile = None
+        if profile:
+            self.profiler = StepProfiler(sorted(vtype for (vtype, fn)
+                    in self.carFns.iteritems() if fn is not None))
+            # count the TraCI calls of the steps, commands included
+            self.conn = CountingConnection(self.conn, self.profiler)
+        self.allCars = CarState(self.carNames, self.edgestarts, self.length)
+        self.commands = CommandBuffer(self.conn, self.simStepLength)
+        self.stepNum = 0
+
+        self.metrics = None
+        if metrics:
+            self.metrics = OnlineMetrics(self.length, self.simSteps,
+                                         self.simStepLength, self.speedLimit)
+
+        self.recorder = None
+        if record:
+            self.outs["trajectory"] = "%s%s.traj.npz" % (defaults.DATA_PATH, self.name+"-"+self.label)
+            self.recorder = TrajectoryRecorder(self.carNames, self.length,
+                                               fn=self.outs["trajectory"])
+
+        if snapshot is not None:
+            self.stepNum = snapshot["step"]
+            random.setstate(snapshot["random"])
+            self.commands.restore(snapshot["commands"])
+            for (vtype, state) in snapshot["carFns"].iteritems():
+                carFn = self.carFns.get(vtype)
+                if hasattr(carFn, "setState"):
+                    carFn.setState(state)
+            if self.recorder is not None and snapshot["trajectory"] is not None:
+                self.recorder.resume(snapshot["trajectory"])
+            if self.metrics is not None and snapshot.get("metrics") is not None:
+                self.metrics.restore(snapshot["metrics"])
+
+        if live is None:
+            live = []
+        elif not isinstance(live, list):
+            live = [live]
+        self.live = live
+        for view in live:
+            view.start(self)
+
+        if stop is None:
+            stop = []
+        elif not isinstance(stop, list):
+            stop = [stop]
+        self.stopConditions = stop
+        self.stopped = None
+        for condition in stop:
+            condition.start(self)
+
+    def simulate(self, opts, sumo=defaults.BINARY, speedRange=None, sublane=False,
+            collect="subscribe", colors=None, outputs=None, outputPeriod=None,
+            compress=False, record=False, pool=None, snapshot=None, live=None,
+            screenshots=None, profile=False, metrics=True, stop=None):
+        """
+        :param sumo: SUMO binary to run, or "ring" for the built-in ring
+                     simulator (ringsim.RingSim)
+        :param collect: how car state is read each step, one of COLLECT_MODES
+        :param colors: color cars by speed; by default only with sumo-gui
+        :param outputs: SUMO XML outputs to write, keys of makecirc.OUTPUTS
+                        (default all of them, [] for none)
+        :param outputPeriod: write emission output only every that many
+                             seconds
+        :param compress: gzip the XML outputs
+        :param record: record the cars' trajectories in process
+                       (recorder.TrajectoryRecorder), which plot() then
+                       uses instead of the emission output
+        :param pool: sumopool.SumoPool to take a running SUMO from instead
+                     of starting one
+        :param snapshot: carry on from a snapshot() of another run, up to
+                         the simSteps of opts.  opts must have the same cars
+                         (names and counts); their functions and type
+                         parameters can differ.  The XML outputs only cover
+                         the steps after the snapshot, a recording covers
+                         the whole run if the snapshot's run was recorded
+                         too.
+        :param live: view (or list of views) the run is shown in as it
+                     goes: liveview.LiveHeatmap, video.RingVideo
+        :param screenshots: save a sumo-gui screenshot every step, by
+                            default only with sumo-gui; RingVideo is much
+                            faster
+        :param profile: time the phases of every step and count its TraCI
+                        calls (see profiler), written to DATA_PATH and
+                        printed at the end of the run
+        :param metrics: keep the loop speed, loop time, speed deviation,
+                        flow and waves of every lane as the run goes (see
+                        metrics.OnlineMetrics)
+        :param stop: condition (or list of conditions) to end the run
+                     before simSteps on (see stopping); sim.stopped is then
+                     (step, reason)
+        :return: summary of the metrics (OnlineMetrics.summary), None
+                 without metrics; runs stopped during the warm-up it leaves
+                 out have a truncated summary.  Its "commands" are the
+                 vehicle commands sent and dropped (sim.commandCounts)
+        """
+        self.start(opts, sumo=sumo, speedRange=speedRange, sublane=sublane,
+                   collect=collect, colors=colors, outputs=outputs,
+                   outputPeriod=outputPeriod, compress=compress,
+                   record=record, pool=pool, snapshot=snapshot, live=live,
+                   screenshots=screenshots, profile=profile, metrics=metrics,
+                   stop=stop)
+        for step in range(self.stepNum, self.simSteps):
+            self.step()
+            if self.stopped is not None:
+                break
+        self.finish()
+        if self.metrics is not None:
+            summary = self.metrics.summary()
+            summary["commands"] = self.commandCounts
+            if summary["truncated"]:
+                print "Warning: %s stopped after %d steps, before the first " \
+                      "%d the metrics leave out; they are all NaN" % (
+                      self.label, self.stepNum, self.metrics.firstStep)
+            return summary
+
+    def parse(self):
+        """
+        Summarize the trajectories recorded by the last simulate(), or else
+        parse its emission output, only once per run (and only once per
+        emission file, see parsexml.cachedParsexml)
+        :return: the tuple returned by parsexml
+        """
+        if self.parsed is None and self.recorder is not None:
+            self.parsed = parsetrajectory(self.recorder, self.length, self.speedLimit)
+        elif self.parsed is None:
+            if "emission" not in self.outs:
+                raise ValueError("Nothing to plot: simulate with record=True "
+                                 "or with emission output")
+            self.parsed = cachedParsexml(self.outs["emission"], self.edgestarts,
+                                         self.length, self.speedLimit,
+                                         numSteps=self.simSteps+1)
+        return self.parsed
+
+    def plot(self, show=True, save=False, speedRange=None, fuelRange=None,
+            fast=False):
+        """
+        :param fast: draw the figure at its pixel resolution (see
+                     plots.pcolor_multi), for long runs
+        """
         # Plot results
-        emfn = self.outs["emission"]
-        trng, xrng, avgspeeds, lanespeeds, (laneoccupancy, typecolors), totfuel, looptimes = parsexml(emfn, self.edgestarts, self.length, self.speedLimit)
+        trng, xrng, avgspeeds, lanespeeds, (laneoccupancy, typecolors), totfuel, looptimes = self.parse()
 
         if speedRange == 'avg':
             mnspeed = min([min(s) for s in avgspeeds.values()])
@@ -291,15 +709,70 @@ class LoopSim:
                 (avgspeeds, "Average loop speed (m/s)"),
                 (lanespeeds, mnspeed, mxspeed, "Speed (m/s)"),
                 (looptimes, "Loop transit time (s)"),
-                (totfuel, mnfuel, mxfuel, "Speed std. dev. (m/s)"))
+                (totfuel, mnfuel, mxfuel, "Speed std. dev. (m/s)"),
+                fast=fast)
 
         fig = plt.gcf()
         if show:
             plt.show()
         if save:
-            fig.savefig(defaults.IMG_PATH + self.name + "-" + self.label + ".png")
+            self.imgfn = defaults.IMG_PATH + self.name + "-" + self.label + ".png"
+            fig.savefig(self.imgfn)
         return plt
 
+def lockstep(sims, optsList, callback=None, **kwargs):
+    """
+    Run several LoopSims side by side in this process, stepping each of them
+    once per round.  Give every sim its own port (e.g. port=None).
+    :param sims: list of LoopSims
+    :param optsList: opts to simulate for each sim
+    :param callback: called as callback(sims, step) after every round, when
+                     all sims have made that step
+    :param kwargs: other arguments for simulate (sumo, collect...)
+    """
+    started = []
+    try:
+        for (sim, opts) in zip(sims, optsList):
+            sim.start(opts, **kwargs)
+            started.append(sim)
+        for step in range(max(sim.simSteps - sim.stepNum for sim in sims)):
+            for sim in sims:
+                if sim.stepNum < sim.simSteps and sim.stopped is None:
+                    sim.step()
+            if callback is not None:
+                callback(sims, step)
+    finally:
+        for sim in started:
+            sim.finish()
+
+def branches(sim, opts, branchStep, optsList, **kwargs):
+    """
+    Simulate opts for branchStep steps, then carry on from there with each
+    of optsList in turn instead of simulating them all from the start.  The
+    runs must only differ after branchStep (e.g. SwitchVTypeFn switching at
+    or after it), and have the same cars as opts.
+    :param sim: LoopSim to run everything on
+    :param opts: opts of the shared first part; its label (or tag) should
+                 differ from the branches' so it doesn't share their outputs
+    :param branchStep: step to branch at
+    :param optsList: opts of the branches
+    :param kwargs: other arguments for simulate (sumo, record...); stopping
+                   conditions only apply to the branches, the shared part
+                   always runs to branchStep
+    :return: generator of sim after each finished branch, ready to parse or
+             plot
+    """
+    sim.start(opts, **dict(kwargs, stop=None))
+    try:
+        for step in range(branchStep):
+            sim.step()
+        snapshot = sim.snapshot()
+    finally:
+        sim.finish()
+    for branchOpts in optsList:
+        sim.simulate(branchOpts, snapshot=snapshot, **kwargs)
+        yield sim
+
 # this is the main entry point of this script
 if __name__ == "__main__":
     from carfns import randomChangeLaneFn, ACCFnBuilder, changeFasterLaneBuilder, MidpointFnBuilder, SwitchVTypeFn
@@ -1,3 +1,6 @@
+import fcntl
+import hashlib
+import os
 import subprocess
 import sys
 from lxml import etree
@@ -8,6 +11,12 @@ import config as defaults
 
 E = etree.Element
 
+# SUMO outputs makecirc can turn on, with the suffix of their option name
+OUTPUTS = {"netstate": "dump", 
+           "amitran":"output", 
+           "lanechange":"output", 
+           "emission":"output", }
+
 def makexml(name, nsl):
     xsi = "http://www.w3.org/2001/XMLSchema-instance"
     ns = {"xsi": xsi}
@@ -18,74 +27,116 @@ def makexml(name, nsl):
 def printxml(t, fn):
     etree.ElementTree(t).write(fn, pretty_print=True, encoding='UTF-8', xml_declaration=True) 
 
+def xmlbytes(t):
+    return etree.tostring(t, pretty_print=True, encoding='UTF-8', xml_declaration=True)
+
+# How often makenet found the network it was asked for already built
+netCacheStats = {"hit": 0, "miss": 0}
+
 def makenet(base, length, lanes, 
         speedLimit=defaults.SPEED_LIMIT, 
         path=""):
-
+    """
+    Make the loop network with netconvert, or reuse it if it's in path
+    already.  Networks are named by a hash of the netconvert inputs (which
+    include the RESOLUTION of the curves), and built under a lock and
+    renamed into place, so processes asking for the same one at the same
+    time build it once.
+    :return: name of the .net.xml file
+    """
     name = "%s-%dm%dl" % (base, length, lanes)
 
-    nodfn = "%s.nod.xml" % name
-    edgfn = "%s.edg.xml" % name
-    typfn = "%s.typ.xml" % name
-    cfgfn = "%s.netccfg" % name
-    netfn = "%s.net.xml" % name
-
     r = length/pi
     edgelen = length/4.
 
-    x = makexml("nodes", "http://sumo.dlr.de/xsd/nodes_file.xsd")
-    x.append(E("node", id="bottom",x=repr(0), y=repr(-r)))
-    x.append(E("node", id="right", x=repr(r), y=repr(0)))
-    x.append(E("node", id="top",   x=repr(0), y=repr(r)))
-    x.append(E("node", id="left",  x=repr(-r),y=repr(0)))
-    printxml(x, path+nodfn)
+    nod = makexml("nodes", "http://sumo.dlr.de/xsd/nodes_file.xsd")
+    nod.append(E("node", id="bottom",x=repr(0), y=repr(-r)))
+    nod.append(E("node", id="right", x=repr(r), y=repr(0)))
+    nod.append(E("node", id="top",   x=repr(0), y=repr(r)))
+    nod.append(E("node", id="left",  x=repr(-r),y=repr(0)))
 
-    x = makexml("edges", "http://sumo.dlr.de/xsd/edges_file.xsd")
-    x.append(E("edge", attrib={"id":"bottom", "from":"bottom","to":"right", "type":"edgeType", 
+    edg = makexml("edges", "http://sumo.dlr.de/xsd/edges_file.xsd")
+    edg.append(E("edge", attrib={"id":"bottom", "from":"bottom","to":"right", "type":"edgeType", 
         "shape": " ".join(["%.2f,%.2f" % ( r*cos(t), r*sin(t) )
                 for t in linspace(-pi/2,0,defaults.RESOLUTION)]),
         "length": repr(edgelen)}))
-    x.append(E("edge", attrib={"id":"right",  "from":"right", "to":"top",   "type":"edgeType",
+    edg.append(E("edge", attrib={"id":"right",  "from":"right", "to":"top",   "type":"edgeType",
         "shape": " ".join(["%.2f,%.2f" % ( r*cos(t), r*sin(t) )
                 for t in linspace(0,pi/2,defaults.RESOLUTION)]),
         "length": repr(edgelen)}))
-    x.append(E("edge", attrib={"id":"top",    "from":"top",   "to":"left",  "type":"edgeType",
+    edg.append(E("edge", attrib={"id":"top",    "from":"top",   "to":"left",  "type":"edgeType",
         "shape": " ".join(["%.2f,%.2f" % ( r*cos(t), r*sin(t) )
                 for t in linspace(pi/2,pi,defaults.RESOLUTION)]),
         "length": repr(edgelen)}))
-    x.append(E("edge", attrib={"id":"left",   "from":"left",  "to":"bottom","type":"edgeType",
+    edg.append(E("edge", attrib={"id":"left",   "from":"left",  "to":"bottom","type":"edgeType",
         "shape": " ".join(["%.2f,%.2f" % ( r*cos(t), r*sin(t) )
                 for t in linspace(pi,3*pi/2,defaults.RESOLUTION)]),
         "length": repr(edgelen)}))
-    printxml(x, path+edgfn)
-
-    x = makexml("types", "http://sumo.dlr.de/xsd/types_file.xsd")
-    x.append(E("type", id="edgeType",  numLanes=repr(lanes), speed=repr(speedLimit)))
-    printxml(x, path+typfn)
-
-    x = makexml("configuration", "http://sumo.dlr.de/xsd/netconvertConfiguration.xsd")
-    t = E("input")
-    t.append(E("node-files", value=nodfn))
-    t.append(E("edge-files", value=edgfn))
-    t.append(E("type-files", value=typfn))
-    x.append(t)
-    t = E("output")
-    t.append(E("output-file", value=netfn))
-    x.append(t)
-    t = E("processing")
-    t.append(E("no-internal-links", value="true"))
-    t.append(E("no-turnarounds", value="true"))
-    x.append(t)
-    printxml(x, path+cfgfn)
-
-    # netconvert -c $(cfg) --output-file=$(net)
-    retcode = subprocess.call(
-        ['netconvert', "-c", path+cfgfn],
-        stdout=sys.stdout, stderr=sys.stderr)
+
+    typ = makexml("types", "http://sumo.dlr.de/xsd/types_file.xsd")
+    typ.append(E("type", id="edgeType",  numLanes=repr(lanes), speed=repr(speedLimit)))
+
+    inputs = [xmlbytes(nod), xmlbytes(edg), xmlbytes(typ)]
+    name = "%s-%s" % (name, hashlib.sha1("".join(inputs)).hexdigest()[:10])
+
+    nodfn = "%s.nod.xml" % name
+    edgfn = "%s.edg.xml" % name
+    typfn = "%s.typ.xml" % name
+    cfgfn = "%s.netccfg" % name
+    netfn = "%s.net.xml" % name
+
+    if os.path.exists(path+netfn):
+        netCacheStats["hit"] += 1
+        return path+netfn
+
+    with open(path+netfn+".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(path+netfn):
+            # someone else built it while we waited
+            netCacheStats["hit"] += 1
+            return path+netfn
+        netCacheStats["miss"] += 1
+
+        for (fn, data) in zip([nodfn, edgfn, typfn], inputs):
+            with open(path+fn, "w") as f:
+                f.write(data)
+
+        tmpfn = "%s.tmp%d" % (netfn, os.getpid())
+        x = makexml("configuration", "http://sumo.dlr.de/xsd/netconvertConfiguration.xsd")
+        t = E("input")
+        t.append(E("node-files", value=nodfn))
+        t.append(E("edge-files", value=edgfn))
+        t.append(E("type-files", value=typfn))
+        x.append(t)
+        t = E("output")
+        t.append(E("output-file", value=tmpfn))
+        x.append(t)
+        t = E("processing")
+        t.append(E("no-internal-links", value="true"))
+        t.append(E("no-turnarounds", value="true"))
+        x.append(t)
+        printxml(x, path+cfgfn)
+
+        # netconvert -c $(cfg) --output-file=$(net)
+        retcode = subprocess.call(
+            ['netconvert', "-c", path+cfgfn],
+            stdout=sys.stdout, stderr=sys.stderr)
+        if retcode != 0 or not os.path.exists(path+tmpfn):
+            raise RuntimeError("netconvert failed to build %s" % (path+netfn))
+        os.rename(path+tmpfn, path+netfn)
 
     return path+netfn
 
-def makecirc(name, netfn=None, maxspeed=30, numcars=0, typelist=None, maxt=3000, mint=0, dataprefix="data/"):
+def makecirc(name, netfn=None, maxspeed=30, numcars=0, typelist=None, maxt=3000, mint=0, dataprefix="data/",
+        outputs=None, period=None, compress=False):
+    """
+    :param outputs: SUMO outputs to write, keys of OUTPUTS (default all)
+    :param period: write emission output only every period seconds
+                   (device.emissions.period); the other outputs can't be
+                   sampled
+    :param compress: write the outputs gzipped (.xml.gz)
+    :return: (config file name, {output: file name})
+    """
     roufn = "%s.rou.xml" % name
     addfn = "%s.add.xml" % name
     cfgfn = "%s.sumo.cfg" % name
@@ -128,16 +179,16 @@ def makecirc(name, netfn=None, maxspeed=30, numcars=0, typelist=None, maxt=3000,
                 inp.append(E("gui-settings-file", value=gui))
         return inp
 
-    def outputs(name, prefix="data/"):
+    def outputconf(name, prefix="data/", keys=None, compress=False):
         t = E("output")
-        outs = {"netstate": "dump", 
-                "amitran":"output", 
-                "lanechange":"output", 
-                "emission":"output", }
+        outs = {}
 
-        for (key, val) in outs.iteritems():
+        for key in (OUTPUTS if keys is None else keys):
             fn = prefix+"%s.%s.xml" % (name, key)
-            t.append(E("%s-%s" % (key, val), value=fn))
+            if compress:
+                # SUMO gzips outputs whose names end in .gz
+                fn += ".gz"
+            t.append(E("%s-%s" % (key, OUTPUTS[key]), value=fn))
             outs[key] = fn
         return t, outs
 
@@ -174,8 +225,12 @@ def makecirc(name, netfn=None, maxspeed=30, numcars=0, typelist=None, maxt=3000,
 
     cfg = makexml("configuration", "http://sumo.dlr.de/xsd/sumoConfiguration.xsd")
     cfg.append(inputs(name, net=netfn, add=addfn, rou=roufn, gui=guifn))
-    t, outs = outputs(name, prefix=dataprefix)
+    t, outs = outputconf(name, prefix=dataprefix, keys=outputs, compress=compress)
     cfg.append(t)
+    if period is not None and "emission" in outs:
+        t = E("emissions")
+        t.append(E("device.emissions.period", value=repr(period)))
+        cfg.append(t)
     t = E("time")
     t.append(E("begin", value=repr(mint)))
     t.append(E("end", value=repr(maxt)))
@@ -0,0 +1,196 @@
+"""
+Loop metrics of a LoopSim run accumulated as it goes, from the car state it
+collects every step, so the numbers a sweep reports need neither emission
+output nor parsing it.
+
+Per lane and step this takes the same quantities parsexml does (the loop
+speed, the mean of the speed profile interpolated around the loop; the
+loop time, length over loop speed; and the standard deviation of the cars'
+speeds), plus the flow (cars per hour past a point, as density times mean
+speed) and the stop-and-go waves: stretches of the loop where the speed
+profile is below jamRatio of its mean.  Every few seconds each wave is
+matched to the nearest one of the time before, which gives their speed
+(negative when they move backwards, as jams do).
+
+Each of these keeps a running mean and variance (Welford), so memory does
+not grow with the run.  Like sweep.summarize, only the steps after the
+first `skip` of the run count; a run that ends before that (see stopping)
+has nothing to average, and its summary says it is truncated.
+"""
+import math
+
+import numpy as np
+
+from parsexml import interp
+
+
+class RunningStats(object):
+    """ Running count, mean and variance of a series (Welford) """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def push(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other):
+        """ Stats of both series together (Chan et al.) """
+        merged = RunningStats()
+        merged.n = self.n + other.n
+        if merged.n == 0:
+            return merged
+        delta = other.mean - self.mean
+        merged.mean = self.mean + delta * other.n / merged.n
+        merged.m2 = self.m2 + other.m2 + delta ** 2 * self.n * other.n / merged.n
+        return merged
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.n) if self.n else float("nan")
+
+    def summary(self):
+        return {"mean": self.mean if self.n else float("nan"), "std": self.std,
+                "n": self.n}
+
+
+# What is kept per lane
+SERIES = ["avgspeed", "looptime", "speeddev", "throughput", "waves", "wavespeed"]
+
+
+def jamCenters(speeds, threshold):
+    """
+    Middles of the stretches of a speed profile around the loop (one value
+    per metre) below threshold
+    """
+    below = speeds < threshold
+    if not below.any() or below.all():
+        return np.empty(0)
+    # start from a point outside any jam, so none wraps around the end
+    shift = np.flatnonzero(~below)[0]
+    below = np.roll(below, -shift).astype(np.int8)
+    edges = np.diff(below)
+    starts = np.flatnonzero(edges == 1) + 1
+    ends = np.flatnonzero(edges == -1) + 1
+    if len(ends) < len(starts):
+        ends = np.append(ends, len(below))
+    return ((starts + ends - 1) / 2. + shift) % len(speeds)
+
+
+class OnlineMetrics(object):
+    """
+    :param length: loop length (m)
+    :param numSteps: steps of the whole run
+    :param stepLength: seconds per step
+    :param vdefault: loop speed of a lane without cars, as in parsexml
+    :param skip: fraction of the run to leave out as warm-up
+    :param jamRatio: a wave is where the speed is below this fraction of
+                     the lane's loop speed
+    :param waveInterval: seconds between the wave positions that are
+                         matched to measure the waves' speed
+    :param maxWaveSpeed: waves matched further apart than this speed times
+                         waveInterval are not counted as the same wave
+    """
+
+    def __init__(self, length, numSteps, stepLength, vdefault=0, skip=0.5,
+                 jamRatio=0.5, waveInterval=5., maxWaveSpeed=10.):
+        self.length = int(length)
+        self.stepLength = stepLength
+        self.vdefault = vdefault
+        self.firstStep = int(numSteps * skip)
+        self.jamRatio = jamRatio
+        self.waveEvery = max(1, int(round(waveInterval / stepLength)))
+        self.maxShift = maxWaveSpeed * self.waveEvery * stepLength
+        self.xq = np.arange(self.length)
+        # steps the run has made, counted or not
+        self.stepsRun = 0
+        self.lanes = {}
+        # wave positions per lane at the last wave speed measurement
+        self.lastCenters = {}
+
+    def _lane(self, lid):
+        if lid not in self.lanes:
+            self.lanes[lid] = dict((k, RunningStats()) for k in SERIES)
+        return self.lanes[lid]
+
+    def update(self, step, x, v, lane):
+        """
+        Add the state after a step
+        :param x, v, lane: loop position, speed and lane arrays of the cars
+        """
+        self.stepsRun = step + 1
+        if step < self.firstStep:
+            return
+        measureWaves = (step - self.firstStep) % self.waveEvery == 0
+        for l in np.unique(lane).tolist():
+            onLane = lane == l
+            xs, vs = x[onLane], v[onLane]
+            lid = str(l)
+            stats = self._lane(lid)
+
+            speeds = interp(xs, vs, self.length, self.vdefault)(self.xq)
+            avgspeed = speeds.mean()
+            stats["avgspeed"].push(avgspeed)
+            stats["looptime"].push(self.length / avgspeed if avgspeed
+                                   else float("inf"))
+            stats["speeddev"].push(vs.std())
+            stats["throughput"].push(3600. * vs.sum() / self.length)
+
+            centers = jamCenters(speeds, self.jamRatio * avgspeed)
+            stats["waves"].push(len(centers))
+            if measureWaves:
+                last = self.lastCenters.get(lid)
+                if last is not None and len(last) and len(centers):
+                    # each wave's shift to the nearest one of the last time
+                    d = (centers[:, None] - last[None, :] + self.length / 2.) \
+                        % self.length - self.length / 2.
+                    shifts = d[np.arange(len(centers)), np.abs(d).argmin(axis=1)]
+                    for shift in shifts[np.abs(shifts) <= self.maxShift].tolist():
+                        stats["wavespeed"].push(shift / (self.waveEvery *
+                                                         self.stepLength))
+                self.lastCenters[lid] = centers
+
+    def summary(self):
+        """
+        :return: dict with the mean over time and lanes of each of SERIES
+                 (throughput and waves summed over lanes instead), and the
+                 mean and std of each per lane under "lanes", the number
+                 of steps counted, and whether the run was truncated:
+                 ended before the warm-up did, with all of them NaN
+        """
+        ret = {"lanes": dict((lid, dict((k, s.summary())
+                                        for (k, s) in stats.iteritems()))
+                             for (lid, stats) in self.lanes.iteritems())}
+        for k in SERIES:
+            pooled = RunningStats()
+            for stats in self.lanes.itervalues():
+                pooled = pooled.merge(stats[k])
+            ret[k] = pooled.mean if pooled.n else float("nan")
+        for k in ["throughput", "waves"]:
+            ret[k] = sum(stats[k].mean for stats in self.lanes.itervalues())
+        ret["steps"] = max([s["avgspeed"].n for s in self.lanes.itervalues()] or [0])
+        ret["truncated"] = self.stepsRun <= self.firstStep
+        return ret
+
+    def state(self):
+        """ What snapshot saves, for restore """
+        return {
+                "lanes"       : dict((lid, dict((k, (s.n, s.mean, s.m2))
+                                                for (k, s) in stats.iteritems()))
+                                     for (lid, stats) in self.lanes.iteritems()),
+                "lastCenters" : dict((lid, c.copy())
+                                     for (lid, c) in self.lastCenters.iteritems()),
+                }
+
+    def restore(self, state):
+        self.lanes = {}
+        for (lid, stats) in state["lanes"].iteritems():
+            lane = self._lane(lid)
+            for (k, (n, mean, m2)) in stats.iteritems():
+                lane[k].n, lane[k].mean, lane[k].m2 = n, mean, m2
+        self.lastCenters = dict((lid, c.copy())
+                                for (lid, c) in state["lastCenters"].iteritems())
@@ -1,80 +1,154 @@
-from lxml import objectify
-from scipy import interpolate
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+from lxml import etree
 import numpy as np
 
 def interp(x, y, xmax, vdefault=0):
+        """
+        Linear interpolation of y(x) around a loop of length xmax: past the
+        last point it wraps around to the first
+        :return: function of loop positions
+        """
         if len(x) == 0:
             x = [0]
             y = [vdefault]
 
-        newx = []; newy = []
+        # sort once (cars level with each other stay in file order) and
+        # wrap the ends around by concatenation
+        x = np.asarray(x, dtype=float)
+        order = np.argsort(x, kind="mergesort")
+        x, y = x[order], np.asarray(y, dtype=float)[order]
+        x = np.concatenate(([x[-1] - xmax], x, [x[0] + xmax]))
+        y = np.concatenate(([y[-1]], y, [y[0]]))
 
-        newindex = x.index(max(x))
-        newx.append(x[newindex] - xmax)
-        newy.append(y[newindex])
+        return lambda xs: np.interp(xs, x, y)
 
-        newindex = x.index(min(x))
-        newx.append(x[newindex] + xmax)
-        newy.append(y[newindex])
+def timesteps(fn):
+    """
+    Iterate over the <timestep> elements of an emission file (gzipped if its
+    name ends in .gz) as they are read, freeing each one (and everything
+    before it) once it's been used, so only one timestep is held in memory
+    at a time
+    """
+    source = gzip.open(fn, "rb") if fn.endswith(".gz") else open(fn, "rb")
+    try:
+        for (event, timestep) in etree.iterparse(source, events=("end",), tag="timestep"):
+            yield timestep
+            timestep.clear()
+            while timestep.getprevious() is not None:
+                del timestep.getparent()[0]
+    finally:
+        source.close()
 
-        x.extend(newx); y.extend(newy)
+# Rows allocated at a time when the number of timesteps isn't known up front
+CHUNK_STEPS = 1024
 
-        f = interpolate.interp1d(x, y, assume_sorted=False)
-        return f
+def _laneFills(xmax, vdefault):
+    """
+    (dtype, row shape, value) of the result arrays of a lane; the value is
+    what a timestep where the lane has no cars gets
+    """
+    return {
+        "speeds"    : (np.float32, (xmax,), 0),
+        "occupancy" : (np.uint8, (xmax,), 0),
+        "avgspeed"  : (float, (), vdefault),
+        "stddev"    : (float, (), 0),
+        "looptime"  : (float, (), xmax * 1.0 / vdefault if vdefault else np.inf),
+        }
 
-def parsexml(fn, edgestarts, xmax, vdefault=0):
-    obj = objectify.parse(file(fn)).getroot()
+def _laneArrays(rows, xmax, vdefault):
+    """ Result arrays of one lane, with a row per timestep """
+    lane = {}
+    for (k, (dtype, shape, value)) in _laneFills(xmax, vdefault).iteritems():
+        lane[k] = np.empty((rows,) + shape, dtype=dtype)
+        lane[k].fill(value)
+    return lane
 
-    trng = []
-    xrng = range(0, xmax)
-    looptimes = {}
-    lanespeeds = {}
-    laneoccupancy = {}
-    avgspeeds = {}
-    totfuel = {}
-    typecolors = {}
+def _resize(lane, rows, xmax, vdefault):
+    """ Grow or trim the arrays of a lane to the given number of rows, in place """
+    for (k, (dtype, shape, value)) in _laneFills(xmax, vdefault).iteritems():
+        n = len(lane[k])
+        lane[k].resize((rows,) + shape, refcheck=False)
+        lane[k][n:] = value
 
-    for timestep in obj.timestep:
+def emissionSteps(fn, edgestarts):
+    """
+    (time, {lane: [car dicts]}) for each timestep of an emission file
+    """
+    for timestep in timesteps(fn):
         t = float(timestep.get("time"))
 
         lanedata = {}
-        try:
-            for vehicle in timestep.vehicle:
-                d = {}
-                d["name"] = vehicle.get("id")
-                d["type"] = vehicle.get("id")[:-4]
-                d["edge"] = vehicle.get("lane")[:-2]
-                d["v"] = float(vehicle.get("speed"))
-                d["pos"] = float(vehicle.get("pos"))
-                d["x"] = d["pos"] + edgestarts[d["edge"]]
-
-                d["CO2"] = float(vehicle.get("CO2"))
-                d["CO"] = float(vehicle.get("CO"))
-                d["fuel"] = float(vehicle.get("fuel"))
-
-                lid = vehicle.get("lane")[-1]
-                lanedata.setdefault(lid, []).append(d)
-        except AttributeError:
-            pass
+        for vehicle in timestep.iterchildren("vehicle"):
+            d = {}
+            d["name"] = vehicle.get("id")
+            d["type"] = vehicle.get("id")[:-4]
+            d["edge"] = vehicle.get("lane")[:-2]
+            d["v"] = float(vehicle.get("speed"))
+            d["pos"] = float(vehicle.get("pos"))
+            d["x"] = d["pos"] + edgestarts[d["edge"]]
+
+            d["CO2"] = float(vehicle.get("CO2"))
+            d["CO"] = float(vehicle.get("CO"))
+            d["fuel"] = float(vehicle.get("fuel"))
+
+            lid = vehicle.get("lane")[-1]
+            lanedata.setdefault(lid, []).append(d)
+
+        yield t, lanedata
+
+def summarize(steps, xmax, vdefault=0, numSteps=None):
+    """
+    Per lane speeds, occupancy and loop statistics of the cars on a loop
+    over time, as returned by parsexml
+    :param steps: (time, {lane: cars}) for each timestep, where each car is
+                  a dict with (at least) its loop position x, speed v and
+                  type
+    :param numSteps: number of timesteps, if known, so the result arrays are
+                     allocated once; otherwise they grow from CHUNK_STEPS
+                     rows by doubling
+    """
+    trng = []
+    xrng = range(0, xmax)
+    xq = np.arange(xmax)
+    lanes = {}
+    typecolors = {}
+    rows = numSteps or CHUNK_STEPS
+
+    for (t, lanedata) in steps:
+        row = len(trng)
+        if row == rows:
+            rows = max(2 * rows, CHUNK_STEPS)
+            for lane in lanes.itervalues():
+                _resize(lane, rows, xmax, vdefault)
 
         for lid, thislane in lanedata.iteritems():
+            if lid not in lanes:
+                # rows of earlier timesteps keep the empty lane values
+                lanes[lid] = _laneArrays(rows, xmax, vdefault)
+            lane = lanes[lid]
+
             # interpolate the values of velocity, fuel to get a _f_unction of loop position
             vf = interp([x["x"] for x in thislane], [x["v"] for x in thislane], xmax, vdefault)
-            ff = interp([x["x"] for x in thislane], [x["fuel"] for x in thislane], xmax, 0)
             types = set([x["type"] for x in thislane])
             for tp in types:
                 if tp not in typecolors:
                     typecolors[tp] = len(typecolors)+1
 
-            intx = dict((int(x["x"]), typecolors[x["type"]]) for x in thislane)
-
             '''
+            ff = interp([x["x"] for x in thislane], [x["fuel"] for x in thislane], xmax, 0)
             fuel = ff(xrng)/vf(xrng)
             '''
 
-            fx = vf(xrng)
-            lanespeeds.setdefault(lid, [[0]*len(xrng)]*len(trng)).append(fx)
-            laneoccupancy.setdefault(lid, [[0]*len(xrng)]*len(trng)).append([intx.get(x, 0) for x in xrng])
+            fx = vf(xq)
+            lane["speeds"][row] = fx
+            for x in thislane:
+                if int(x["x"]) < xmax:
+                    lane["occupancy"][row, int(x["x"])] = typecolors[x["type"]]
 
             '''
             dx = np.diff(np.array(xrng + [xrng[0] + xmax]))
@@ -84,23 +158,128 @@ def parsexml(fn, edgestarts, xmax, vdefault=0):
             loopfuel = np.sum(fuel*dx)
             '''
 
-            avgspeed = np.mean(vf(xrng))
+            avgspeed = np.mean(fx)
             looptime = xmax/avgspeed
+            '''
             loopfuel = np.mean([x["fuel"] for x in thislane])*looptime
+            '''
 
             # XXX Quick hack : Plot std dev of velocity instead.
             loopfuel = np.std([x["v"] for x in thislane])
 
-            avgspeeds.setdefault(lid, [vdefault]*len(trng)).append(avgspeed)
-            totfuel.setdefault(lid, [0]*len(trng)).append(loopfuel)
-            looptimes.setdefault(lid, [xmax * 1.0 / vdefault]*len(trng)).append(looptime)
+            lane["avgspeed"][row] = avgspeed
+            lane["stddev"][row] = loopfuel
+            lane["looptime"][row] = looptime
 
         trng.append(t)
 
+    if rows != len(trng):
+        for lane in lanes.itervalues():
+            _resize(lane, len(trng), xmax, vdefault)
+
     '''
     for lid, lt in looptimes.iteritems():
         print "Total looptime, lane %s:" % lid, np.mean(lt[100:]), np.percentile(lt[100:], (0, 25, 75, 100))
     for lid, ft in totfuel.iteritems():
         print "Total fuel consumed, lane %s:" % lid, np.mean(ft[100:]), np.percentile(ft[100:], (0, 25, 75, 100))
     '''
-    return trng, xrng, avgspeeds, lanespeeds, (laneoccupancy, typecolors), totfuel, looptimes
+    def column(k):
+        return dict((lid, lane[k]) for (lid, lane) in lanes.iteritems())
+
+    return trng, xrng, column("avgspeed"), column("speeds"), \
+           (column("occupancy"), typecolors), column("stddev"), column("looptime")
+
+def parsexml(fn, edgestarts, xmax, vdefault=0, numSteps=None):
+    """
+    :param numSteps: number of timesteps in the file, if known (see summarize)
+    :return: trng, xrng, avgspeeds, lanespeeds, (laneoccupancy, typecolors),
+             totfuel, looptimes.  lanespeeds (float32) and laneoccupancy
+             (uint8, typecolors codes) map each lane to a (T, xmax) array,
+             avgspeeds, totfuel and looptimes to one value per timestep.
+    """
+    return summarize(emissionSteps(fn, edgestarts), xmax, vdefault, numSteps)
+
+# Bump when the format of parsexml's outputs changes, to invalidate caches
+CACHE_VERSION = 1
+
+# Names of parsexml's per lane outputs, as stored in the cache
+CACHE_ARRAYS = ("avgspeeds", "lanespeeds", "laneoccupancy", "totfuel", "looptimes")
+
+def _cacheKey(fn, edgestarts, xmax, vdefault):
+    """
+    What a cached parse of fn depends on: the file's size, mtime and a digest
+    of its first and last blocks (hashing all of a large file would take
+    longer than loading the cache), and the parsexml arguments
+    """
+    st = os.stat(fn)
+    digest = hashlib.sha1()
+    with open(fn, "rb") as f:
+        digest.update(f.read(1 << 16))
+        f.seek(max(0, st.st_size - (1 << 16)))
+        digest.update(f.read())
+    return {
+        "version"    : CACHE_VERSION,
+        "size"       : st.st_size,
+        "mtime"      : st.st_mtime,
+        "sha1"       : digest.hexdigest(),
+        "edgestarts" : sorted(edgestarts.items()),
+        "xmax"       : xmax,
+        "vdefault"   : vdefault,
+        }
+
+def _loadCache(cachedir, key):
+    try:
+        with open(os.path.join(cachedir, "meta.json")) as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if meta["key"] != json.loads(json.dumps(key)):
+        return None
+
+    def load(name):
+        return np.load(os.path.join(cachedir, name + ".npy"), mmap_mode="r")
+
+    lanes = [str(lid) for lid in meta["lanes"]]
+    out = dict((k, dict((lid, load("%s-%s" % (k, lid))) for lid in lanes))
+               for k in CACHE_ARRAYS)
+    typecolors = dict((str(k), v) for (k, v) in meta["typecolors"].iteritems())
+    return load("trng"), range(0, meta["key"]["xmax"]), out["avgspeeds"], \
+           out["lanespeeds"], (out["laneoccupancy"], typecolors), \
+           out["totfuel"], out["looptimes"]
+
+def _saveCache(cachedir, key, parsed):
+    trng, xrng, avgspeeds, lanespeeds, (laneoccupancy, typecolors), totfuel, looptimes = parsed
+    out = dict(zip(CACHE_ARRAYS, (avgspeeds, lanespeeds, laneoccupancy, totfuel, looptimes)))
+
+    # written next to the cache and renamed over it, so readers never see
+    # half a cache
+    tmpdir = "%s.tmp%d" % (cachedir, os.getpid())
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    np.save(os.path.join(tmpdir, "trng.npy"), np.asarray(trng))
+    for (k, lanes) in out.iteritems():
+        for (lid, a) in lanes.iteritems():
+            np.save(os.path.join(tmpdir, "%s-%s.npy" % (k, lid)), a)
+    with open(os.path.join(tmpdir, "meta.json"), "w") as f:
+        json.dump({"key": key, "lanes": sorted(avgspeeds),
+                   "typecolors": typecolors}, f)
+
+    if os.path.isdir(cachedir):
+        shutil.rmtree(cachedir)
+    os.rename(tmpdir, cachedir)
+
+def cachedParsexml(fn, edgestarts, xmax, vdefault=0, numSteps=None):
+    """
+    parsexml, with its outputs cached as .npy files in the directory
+    fn + ".cache".  As long as fn and the arguments are unchanged, later
+    calls (from this or any other process) load them memory-mapped instead
+    of parsing fn again.  The arrays loaded from the cache are read-only.
+    """
+    cachedir = fn + ".cache"
+    key = _cacheKey(fn, edgestarts, xmax, vdefault)
+    parsed = _loadCache(cachedir, key)
+    if parsed is None:
+        parsed = parsexml(fn, edgestarts, xmax, vdefault, numSteps)
+        _saveCache(cachedir, key, parsed)
+    return parsed
@@ -61,6 +61,23 @@ def pcolor(title, (xrng, xlabel),
 
     return plt
 
+def blocks(n, m):
+    """
+    Starts of at most m nearly equal blocks covering range(n)
+    """
+    return np.unique(np.linspace(0, n, min(n, m) + 1).astype(int)[:-1])
+
+def blockMeans(a, starts, axis=0):
+    """
+    Means of a over the blocks of an axis starting at starts
+    """
+    a = np.asarray(a, dtype=float)
+    sums = np.add.reduceat(a, starts, axis=axis)
+    counts = np.diff(np.r_[starts, a.shape[axis]])
+    shape = [1] * a.ndim
+    shape[axis] = len(counts)
+    return sums / counts.reshape(shape)
+
 def mybp(vax, bpdata, bppos, label, ltcolor, dkcolor):
     bp = vax.boxplot(bpdata, positions=bppos, widths=0.6, patch_artist=True)
     for box in bp['boxes']:
@@ -80,7 +97,15 @@ def pcolor_multi(title, (xrng, xlabel),
                   (vdict, vlabel), 
                   (sdict, smin, smax, slabel),
                   (ldict, llabel),
-                  (fdict, fmin, fmax, flabel)):
+                  (fdict, fmin, fmax, flabel),
+                  fast=False):
+    """
+    :param fast: draw the lane speeds as images averaged down to the pixels
+                 of their axes, and the time series at one point per pixel
+                 column, instead of a pcolormesh quad per position and
+                 timestep.  Much faster for long runs, and indistinguishable
+                 at the figure's resolution.
+    """
 
     numlanes = len(sdict)
 
@@ -92,22 +117,48 @@ def pcolor_multi(title, (xrng, xlabel),
     vax = axarr[-1,0]
     fax = axarr[-1,1]
 
-    x, y = np.meshgrid(xrng, yrng)
+    if fast:
+        # a block of timesteps per pixel column of the lane axes
+        tstarts = blocks(len(yrng), int(axarr[0,1].get_window_extent().width))
+        tq = blockMeans(yrng, tstarts)
+    else:
+        x, y = np.meshgrid(xrng, yrng)
 
     for (ax2, ax, sid) in zip(axarr[:,0], axarr[:,1], sorted(sdict)):
-        tv = T(np.array(sdict[sid]))
-        cax = ax.pcolormesh(T(y), T(x), tv,
-                vmin=smin, vmax=smax, 
-                cmap=my_cmap)
+        speeds = np.asarray(sdict[sid])
+        if fast:
+            xstarts = blocks(len(xrng), int(ax.get_window_extent().height))
+            img = blockMeans(blockMeans(speeds, tstarts, axis=0), xstarts, axis=1)
+            cax = ax.imshow(T(img), origin='lower', aspect='auto',
+                    interpolation='nearest',
+                    extent=(yrng[0], yrng[-1], xrng[0], xrng[-1]),
+                    vmin=smin, vmax=smax,
+                    cmap=my_cmap)
+
+            vmn = np.minimum.reduceat(np.min(speeds, axis=1), tstarts)
+            v25 = blockMeans(np.percentile(speeds, 25, axis=1), tstarts)
+            v75 = blockMeans(np.percentile(speeds, 75, axis=1), tstarts)
+            vmx = np.maximum.reduceat(np.max(speeds, axis=1), tstarts)
+            t = tq
+            vline = blockMeans(vdict[sid], tstarts)
+            fline = blockMeans(fdict[sid], tstarts)
+        else:
+            tv = T(speeds)
+            cax = ax.pcolormesh(T(y), T(x), tv,
+                    vmin=smin, vmax=smax, 
+                    cmap=my_cmap)
+
+            vmn = np.min(tv, axis=0)
+            v25 = np.percentile(tv, 25, axis=0)
+            v75 = np.percentile(tv, 75, axis=0)
+            vmx = np.max(tv, axis=0)
+            t = yrng
+            vline = vdict[sid]
+            fline = fdict[sid]
         ax.set_ylabel(xlabel + "\nLane %s"%sid)
         ax.axis('tight')
 
-        vmn = np.min(tv, axis=0)
-        v25 = np.percentile(tv, 25, axis=0)
-        v75 = np.percentile(tv, 75, axis=0)
-        vmx = np.max(tv, axis=0)
-
-        fax.plot(yrng, fdict[sid], label="lane %s" % sid)
+        fax.plot(t, fline, label="lane %s" % sid)
 
         handles, labels = fax.get_legend_handles_labels()
         lbl = handles[-1]
@@ -117,10 +168,10 @@ def pcolor_multi(title, (xrng, xlabel),
         #ax.set_title("lane %s" % sid, color=linecolor, x=-0.1)
 
         lc = colors.colorConverter.to_rgba(linecolor, alpha=0.1)
-        ax2.fill_between(yrng, vmn, vmx, color=lc)
+        ax2.fill_between(t, vmn, vmx, color=lc)
         lc = colors.colorConverter.to_rgba(linecolor, alpha=0.25)
-        ax2.fill_between(yrng, v25, v75, color=lc)
-        ax2.plot(yrng, vdict[sid], label="lane %s" % sid, color=linecolor)
+        ax2.fill_between(t, v25, v75, color=lc)
+        ax2.plot(t, vline, label="lane %s" % sid, color=linecolor)
 
         ax2.set_ylabel(vlabel + "\nLane %s"%sid)
         ax2.set_ylim([smin, smax])
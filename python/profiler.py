@@ -0,0 +1,201 @@
+"""
+Where the wall time of LoopSim steps goes.
+
+With simulate(opts, profile=True) every step is split into phases (sending
+the buffered commands, simulationStep, reading the car state, sorting it,
+recording, online metrics, live views, coloring, each vehicle type's car
+function, screenshots, stopping conditions) and the TraCI calls it makes are counted.  At the end of the
+run the per-step timings are written to DATA_PATH as <name-label>.profile.npz
+and a summary (mean, median and 99th percentile of every phase, TraCI calls
+per car and step) as <name-label>.profile.json, and the summary is printed.
+Without profile the steps only test whether a profiler is set.
+
+    python profiler.py data/...profile.json     # print a summary again
+"""
+import json
+import sys
+import time
+
+import numpy as np
+
+
+# Step phases in the order LoopSim.step goes through them; car functions
+# get a "carFn:<vtype>" phase each, between colors and screenshot.
+# "cars" is the loop over the cars itself.
+PHASES = ("commands", "simulationStep", "collect", "sort", "record", "metrics",
+          "live", "cars", "colors")
+LAST_PHASES = ("screenshot", "stop")
+
+# TraCI calls answered from the results simulationStep already brought
+# back, without a round trip to SUMO
+LOCAL_CALLS = frozenset(["getSubscriptionResults",
+                         "getContextSubscriptionResults",
+                         "getAllSubscriptionResults",
+                         "getAllContextSubscriptionResults"])
+
+
+class StepProfiler(object):
+    """
+    Per-step phase timings and TraCI call counts of one run
+    """
+
+    def __init__(self, vtypes):
+        """
+        :param vtypes: vehicle types that have a car function
+        """
+        self.phases = list(PHASES) + ["carFn:" + vtype for vtype in vtypes] + \
+                      list(LAST_PHASES)
+        self.column = dict((phase, i) for (i, phase) in enumerate(self.phases))
+        self.steps = []
+        self.rows = []
+        self.calls = []
+        # TraCI calls by "domain.method", over the whole run
+        self.methodCalls = {}
+        self.stepCalls = 0
+
+    def begin(self, step):
+        """ Start timing step """
+        self.steps.append(step)
+        self.row = [0.] * len(self.phases)
+        self.last = time.time()
+
+    def lap(self, phase):
+        """ Add the time since the last lap (or begin) to phase """
+        now = time.time()
+        self.row[self.column[phase]] += now - self.last
+        self.last = now
+
+    def end(self):
+        """ Finish the step begun last """
+        self.rows.append(self.row)
+        self.calls.append(self.stepCalls)
+        self.stepCalls = 0
+
+    def count(self, name, local):
+        """ Count a TraCI call; called by CountingConnection """
+        self.methodCalls[name] = self.methodCalls.get(name, 0) + 1
+        if not local:
+            self.stepCalls += 1
+
+    def times(self):
+        """ (steps, phases) array of seconds """
+        return np.array(self.rows, dtype=np.float64).reshape(-1, len(self.phases))
+
+    def summary(self, numCars):
+        """
+        :return: dict of per-phase statistics in milliseconds per step, and
+                 TraCI calls per step and per car-step
+        """
+        times = self.times() * 1000
+        total = times.sum(axis=1)
+        runTotal = max(total.sum(), 1e-12)
+        carSteps = float(max(1, numCars * len(self.rows)))
+
+        phases = {}
+        for (phase, col) in zip(self.phases + ["total"],
+                                list(times.T) + [total]):
+            if len(col) == 0:
+                continue
+            phases[phase] = {
+                    "mean"  : float(col.mean()),
+                    "p50"   : float(np.percentile(col, 50)),
+                    "p99"   : float(np.percentile(col, 99)),
+                    "share" : float(col.sum() / runTotal),
+                    }
+
+        calls = np.array(self.calls, dtype=np.float64)
+        return {
+                "steps"           : len(self.rows),
+                "cars"            : numCars,
+                "order"           : self.phases + ["total"],
+                "phases"          : phases,
+                "callsPerStep"    : float(calls.mean()) if len(calls) else 0.,
+                "callsPerCarStep" : float(calls.sum() / carSteps),
+                "methods"         : dict((name, n / carSteps)
+                                         for (name, n) in self.methodCalls.iteritems()),
+                }
+
+    def save(self, prefix, numCars):
+        """
+        Write the timings to prefix.profile.npz and the summary to
+        prefix.profile.json
+        :return: (npz, json) file names, and the summary
+        """
+        summary = self.summary(numCars)
+        npzfn = prefix + ".profile.npz"
+        np.savez(npzfn, phases=np.array(self.phases), steps=np.array(self.steps),
+                 times=self.times(), calls=np.array(self.calls))
+        jsonfn = prefix + ".profile.json"
+        with open(jsonfn, "w") as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        return npzfn, jsonfn, summary
+
+
+def formatSummary(summary):
+    """ A StepProfiler summary as a table """
+    lines = ["%-20s %10s %10s %10s %7s" % ("phase (ms/step)", "mean", "p50",
+                                           "p99", "share")]
+    for phase in summary["order"]:
+        stats = summary["phases"].get(phase)
+        if stats is None or (phase != "total" and stats["mean"] == 0):
+            continue
+        lines.append("%-20s %10.3f %10.3f %10.3f %6.1f%%" % (phase,
+                stats["mean"], stats["p50"], stats["p99"], 100 * stats["share"]))
+    lines.append("%d steps, %d cars, %.1f TraCI calls per step, "
+                 "%.2f per car-step" % (summary["steps"], summary["cars"],
+                 summary["callsPerStep"], summary["callsPerCarStep"]))
+    for (name, n) in sorted(summary["methods"].items(), key=lambda x: -x[1]):
+        lines.append("    %-40s %8.3f per car-step" % (name, n))
+    return "\n".join(lines)
+
+
+class _CountingDomain(object):
+    """ A TraCI domain (conn.vehicle, ...) that counts its method calls """
+
+    def __init__(self, domain, name, profiler):
+        self._domain = domain
+        self._name = name
+        self._profiler = profiler
+
+    def __getattr__(self, attr):
+        value = getattr(self._domain, attr)
+        if callable(value):
+            value = _counted(value, self._name + "." + attr, self._profiler)
+        # only look each one up once
+        setattr(self, attr, value)
+        return value
+
+
+def _counted(fn, name, profiler):
+    local = name.rsplit(".", 1)[-1] in LOCAL_CALLS
+    def call(*args, **kwargs):
+        profiler.count(name, local)
+        return fn(*args, **kwargs)
+    return call
+
+
+class CountingConnection(object):
+    """
+    Stands in for a TraCI connection (or RingSim) and counts the calls made
+    through it in a StepProfiler
+    """
+
+    def __init__(self, conn, profiler):
+        self._conn = conn
+        self._profiler = profiler
+
+    def __getattr__(self, attr):
+        value = getattr(self._conn, attr)
+        if callable(value):
+            value = _counted(value, attr, self._profiler)
+        else:
+            value = _CountingDomain(value, attr, self._profiler)
+        setattr(self, attr, value)
+        return value
+
+
+if __name__ == "__main__":
+    for fn in sys.argv[1:]:
+        with open(fn) as f:
+            print fn
+            print formatSummary(json.load(f))
@@ -0,0 +1,126 @@
+"""
+In-process recording of car trajectories, instead of having SUMO write them
+out as XML and parsing that back.
+
+LoopSim.simulate(opts, record=True) hands the loop position, speed and lane
+of every car to a TrajectoryRecorder each step, and saves them in
+DATA_PATH as a .traj.npz when the run ends.  That takes 9 bytes per car and
+step against about 300 for a line of emission XML.  plot() then summarizes
+the recorded arrays directly, and parsetrajectory does the same for a saved
+file.
+"""
+import numpy as np
+
+from parsexml import summarize
+
+
+# Steps per buffer; a full buffer is kept and a new one started
+CHUNK_STEPS = 1024
+
+
+class TrajectoryRecorder(object):
+    """
+    Chunked buffers of the per-step state of every car of a LoopSim, in
+    carNames (slot) order
+    """
+
+    def __init__(self, carNames, length, fn=None, chunkSteps=CHUNK_STEPS):
+        self.ids = list(carNames)
+        self.length = length
+        self.fn = fn
+        self.chunkSteps = chunkSteps
+        self.chunks = []
+        self._newChunk()
+
+    def _newChunk(self):
+        rows, n = self.chunkSteps, len(self.ids)
+        self.buf = {
+            "t"    : np.zeros(rows),
+            "x"    : np.zeros((rows, n), dtype=np.float32),
+            "v"    : np.zeros((rows, n), dtype=np.float32),
+            "lane" : np.zeros((rows, n), dtype=np.int8),
+            }
+        self.row = 0
+
+    def record(self, t, cars):
+        """
+        :param t: simulation time (s)
+        :param cars: carstate.CarState after update()
+        """
+        if self.row == self.chunkSteps:
+            self.chunks.append(self.buf)
+            self._newChunk()
+        buf, row = self.buf, self.row
+        buf["t"][row] = t
+        buf["x"][row] = cars.x
+        buf["v"][row] = cars.v
+        buf["lane"][row] = cars.lane
+        self.row += 1
+
+    def resume(self, traj):
+        """
+        Start from the steps of another recording of the same cars, e.g. the
+        run a LoopSim snapshot was taken in
+        :param traj: TrajectoryRecorder.arrays()
+        """
+        if list(traj["ids"]) != self.ids:
+            raise ValueError("Can't resume a recording of other cars")
+        self.chunks = [dict((k, traj[k]) for k in self.buf)] + self.chunks
+
+    def __len__(self):
+        return sum(len(c["t"]) for c in self.chunks) + self.row
+
+    def arrays(self):
+        """
+        :return: dict of everything recorded so far: ids, length, t (T,) and
+                 x, v, lane (T, number of cars)
+        """
+        parts = self.chunks + [dict((k, a[:self.row]) for (k, a) in self.buf.iteritems())]
+        traj = dict((k, np.concatenate([p[k] for p in parts])) for k in self.buf)
+        traj["ids"] = np.array(self.ids)
+        traj["length"] = self.length
+        return traj
+
+    def save(self, fn=None):
+        """ Write the trajectory to fn (default self.fn) """
+        fn = fn or self.fn
+        np.savez(fn, **self.arrays())
+        return fn
+
+
+def loadTrajectory(fn):
+    """ The arrays saved by TrajectoryRecorder.save """
+    data = np.load(fn)
+    try:
+        return dict((k, data[k]) for k in data.files)
+    finally:
+        data.close()
+
+
+def trajectorySteps(traj):
+    """
+    (time, {lane: [car dicts]}) for each step of a trajectory, like
+    parsexml.emissionSteps
+    """
+    # car names are <type>-<3 digit index>, as in emission output
+    types = [str(vehID)[:-4] for vehID in traj["ids"]]
+    for (t, x, v, lane) in zip(traj["t"].tolist(), traj["x"], traj["v"], traj["lane"]):
+        lanedata = {}
+        for (cx, cv, cl, tp) in zip(x.tolist(), v.tolist(), lane.tolist(), types):
+            lanedata.setdefault(str(cl), []).append({"x": cx, "v": cv, "type": tp})
+        yield t, lanedata
+
+
+def parsetrajectory(traj, xmax=None, vdefault=0):
+    """
+    parsexml's outputs for a trajectory
+    :param traj: TrajectoryRecorder, its arrays() or the name of a saved file
+    :param xmax: loop length, by default the one recorded
+    """
+    if isinstance(traj, TrajectoryRecorder):
+        traj = traj.arrays()
+    elif isinstance(traj, basestring):
+        traj = loadTrajectory(traj)
+    if xmax is None:
+        xmax = int(traj["length"])
+    return summarize(trajectorySteps(traj), xmax, vdefault, len(traj["t"]))
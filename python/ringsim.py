@@ -0,0 +1,523 @@
+"""
+Pure-Python/NumPy ring road simulator, usable by LoopSim in place of SUMO.
+
+RingSim implements the part of the TraCI interface LoopSim uses (vehicle,
+vehicletype and edge domains, subscriptions, simulationStep, saveState and
+loadState, close) on top of per-vehicle NumPy arrays, so there is no
+netconvert, no SUMO process and no socket.  Select it with
+LoopSim.simulate(opts, sumo="ring").
+
+The ring has the same four edges makenet builds.  Cars follow the Krauss
+model (SUMO's default, including the imperfection sigma) or IDM, chosen per
+vehicle type, and only change lanes when asked to with changeLane.  If an
+emission file name is given, every step (or one every emissionPeriod) is
+written in the format of SUMO's emission-output, so parsexml and LoopSim.plot work unchanged.  Fuel and
+CO/CO2 come from a coarse road-load power estimate, not from HBEFA.
+"""
+import cPickle as pickle
+import gzip
+
+import numpy as np
+
+# TraCI protocol constants, for use without the SUMO tools
+# (same values as traci/constants.py)
+CMD_GET_VEHICLE_VARIABLE = 0xa4
+VAR_SPEED = 0x40
+VAR_MAXSPEED = 0x41
+VAR_TYPE = 0x4f
+VAR_ROAD_ID = 0x50
+VAR_LANE_INDEX = 0x52
+VAR_LANEPOSITION = 0x56
+VAR_SPEED_FACTOR = 0x5e
+VAR_TELEPORT_STARTING_VEHICLES_NUMBER = 0x75
+VAR_COLLIDING_VEHICLES_NUMBER = 0x80
+
+# Name LoopSim.simulate takes in place of a SUMO binary
+BACKEND = "ring"
+
+EDGES = ["bottom", "right", "top", "left"]
+
+# SUMO's vType defaults
+DEFAULT_TYPE = {
+        "accel"           : 2.6,
+        "decel"           : 4.5,
+        "sigma"           : 0.5,
+        "tau"             : 1.0,
+        "length"          : 5.0,
+        "minGap"          : 2.5,
+        "maxSpeed"        : 70.0,
+        "speedFactor"     : 1.0,
+        "speedDev"        : 0.0,
+        "carFollowModel"  : "Krauss",
+        }
+
+# SUMO's floor on drawn speed factors, so no car wants to stand still
+MIN_SPEED_FACTOR = 0.2
+
+NUMERIC_PARAMS = ["accel", "decel", "sigma", "tau", "length", "minGap",
+                  "maxSpeed", "speedFactor", "speedDev"]
+
+# Per-vehicle arrays
+FLOAT_ARRAYS = ["x", "v", "f", "slowFrom", "slowTo", "slowStart", "slowEnd",
+                "laneUntil", "fuel"]
+INT_ARRAYS = ["lane", "type", "laneTarget"]
+
+# What saveState writes, besides the random state
+STATE = FLOAT_ARRAYS + INT_ARRAYS + ["ids", "index", "types", "typeNames",
+                                     "time", "steps"]
+
+# Road-load parameters for the fuel estimate
+MASS = 1500.        # kg
+DRAG = 0.7          # Cd * frontal area, m^2
+ROLLING = 0.01
+IDLE_FUEL = 0.2     # ml/s
+FUEL_ENERGY = 8550. # J per ml of fuel at the wheels (34.2 MJ/l, 25%)
+CO2_PER_FUEL = 2392. # mg/ml
+CO_PER_FUEL = 20.   # mg/ml
+
+# A <vehicle> of SUMO's emission-output, formatted with (id, CO2, CO, fuel,
+# route edge, type, edge, lane, pos, speed, angle, x, y)
+EMISSION_VEHICLE = ('        <vehicle id="%s" eclass="HBEFA3/PC_G_EU4" '
+                    'CO2="%.2f" CO="%.2f" HC="0.00" NOx="0.00" PMx="0.00" '
+                    'fuel="%.2f" electricity="0.00" noise="0.00" route="route%s" '
+                    'type="%s" waiting="0.00" lane="%s_%d" pos="%.2f" '
+                    'speed="%.2f" angle="%.2f" x="%.2f" y="%.2f"/>\n')
+
+
+def fuelRate(v, a):
+    """ Fuel (ml/s) of cars at speeds v accelerating at a """
+    power = MASS * a * v + 0.5 * 1.2 * DRAG * v ** 3 + ROLLING * MASS * 9.81 * v
+    return IDLE_FUEL + np.maximum(power, 0) / FUEL_ENERGY
+
+
+class _VehicleType(object):
+    def __init__(self, sim):
+        self._sim = sim
+
+    def _set(self, typeID, key, value):
+        self._sim._typeParams(typeID)[key] = value
+        self._sim._dirty = True
+
+    def setMaxSpeed(self, typeID, speed):
+        self._set(typeID, "maxSpeed", speed)
+
+    def setAccel(self, typeID, accel):
+        self._set(typeID, "accel", accel)
+
+    def setDecel(self, typeID, decel):
+        self._set(typeID, "decel", decel)
+
+    def setImperfection(self, typeID, sigma):
+        self._set(typeID, "sigma", sigma)
+
+    def setTau(self, typeID, tau):
+        self._set(typeID, "tau", tau)
+
+    def setSpeedFactor(self, typeID, factor):
+        self._set(typeID, "speedFactor", factor)
+
+    def setSpeedDeviation(self, typeID, deviation):
+        self._set(typeID, "speedDev", deviation)
+
+    def setShapeClass(self, typeID, shapeClass):
+        self._set(typeID, "shape", shapeClass)
+
+    def setLength(self, typeID, length):
+        self._set(typeID, "length", length)
+
+    def setMinGap(self, typeID, minGap):
+        self._set(typeID, "minGap", minGap)
+
+
+class _Vehicle(object):
+    def __init__(self, sim):
+        self._sim = sim
+        self._subscriptions = {}
+
+    def addFull(self, vehID, routeID, typeID="DEFAULT_VEHTYPE", **kwargs):
+        edge = routeID[len("route"):] if routeID.startswith("route") else EDGES[0]
+        self._sim._add(vehID, typeID, self._sim.edgestarts[edge])
+
+    def moveTo(self, vehID, laneID, pos):
+        edge, lane = laneID.rsplit("_", 1)
+        i = self._sim.index[vehID]
+        self._sim.x[i] = (self._sim.edgestarts[edge] + pos) % self._sim.length
+        self._sim.lane[i] = int(lane)
+
+    def getTypeID(self, vehID):
+        return self._sim._var(VAR_TYPE, self._sim.index[vehID])
+
+    def getRoadID(self, vehID):
+        return self._sim._var(VAR_ROAD_ID, self._sim.index[vehID])
+
+    def getLanePosition(self, vehID):
+        return self._sim._var(VAR_LANEPOSITION, self._sim.index[vehID])
+
+    def getLaneIndex(self, vehID):
+        return self._sim._var(VAR_LANE_INDEX, self._sim.index[vehID])
+
+    def getSpeed(self, vehID):
+        return self._sim._var(VAR_SPEED, self._sim.index[vehID])
+
+    def getMaxSpeed(self, vehID):
+        return self._sim._var(VAR_MAXSPEED, self._sim.index[vehID])
+
+    def getSpeedFactor(self, vehID):
+        return self._sim._var(VAR_SPEED_FACTOR, self._sim.index[vehID])
+
+    def setColor(self, vehID, color):
+        pass
+
+    def setType(self, vehID, typeID):
+        sim = self._sim
+        sim.type[sim.index[vehID]] = sim._typeCode(typeID)
+
+    def slowDown(self, vehID, speed, duration):
+        """ Change speed linearly to speed over duration (ms) """
+        sim = self._sim
+        i = sim.index[vehID]
+        sim.slowFrom[i] = sim.v[i]
+        sim.slowTo[i] = speed
+        sim.slowStart[i] = sim.time
+        sim.slowEnd[i] = sim.time + max(duration / 1000., sim.stepLength)
+
+    def changeLane(self, vehID, laneIndex, duration):
+        """ Move towards laneIndex as soon as it is safe, for duration (ms) """
+        sim = self._sim
+        i = sim.index[vehID]
+        sim.laneTarget[i] = min(max(laneIndex, 0), sim.numLanes - 1)
+        sim.laneUntil[i] = sim.time + duration / 1000.
+
+    def subscribe(self, objectID, varIDs=(VAR_ROAD_ID, VAR_LANEPOSITION),
+                  begin=0, end=2**31-1):
+        self._subscriptions[objectID] = varIDs
+
+    def getSubscriptionResults(self, objectID=None):
+        sim = self._sim
+        if objectID is None:
+            return dict((v, sim._results(sim.index[v], varIDs))
+                        for (v, varIDs) in self._subscriptions.iteritems())
+        varIDs = self._subscriptions.get(objectID)
+        if varIDs is None:
+            return None
+        return sim._results(sim.index[objectID], varIDs)
+
+
+class _Edge(object):
+    def __init__(self, sim):
+        self._sim = sim
+        self._contexts = {}
+
+    def subscribeContext(self, objectID, domain, dist,
+                         varIDs=(VAR_ROAD_ID, VAR_LANEPOSITION),
+                         begin=0, end=2**31-1):
+        self._contexts[objectID] = varIDs
+
+    def getContextSubscriptionResults(self, objectID=None):
+        varIDs = self._contexts.get(objectID)
+        if varIDs is None:
+            return None
+        sim = self._sim
+        code = EDGES.index(objectID)
+        return dict((sim.ids[i], sim._results(i, varIDs))
+                    for i in np.flatnonzero(sim._edges() == code))
+
+
+class _Gui(object):
+    def screenshot(self, viewID, filename):
+        pass
+
+
+class _Simulation(object):
+    def __init__(self, sim):
+        self._sim = sim
+        self._subscription = ()
+
+    def saveState(self, fileName):
+        """ Write the vehicles, types, clock and random state to fileName """
+        sim = self._sim
+        state = dict((name, getattr(sim, name)) for name in STATE)
+        state["rng"] = sim.rng.get_state()
+        with open(fileName, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+    def loadState(self, fileName):
+        """
+        Replace the simulation with one saved by saveState; the emission
+        output carries on in this simulation's file
+        """
+        sim = self._sim
+        with open(fileName, "rb") as f:
+            state = pickle.load(f)
+        sim.rng.set_state(state.pop("rng"))
+        for (name, value) in state.iteritems():
+            setattr(sim, name, value)
+        sim._dirty = True
+
+    def getStartingTeleportNumber(self):
+        # cars are never taken off the ring
+        return 0
+
+    def getCollidingVehiclesNumber(self):
+        """ Vehicles overlapping the one ahead of them on their lane """
+        sim = self._sim
+        if not len(sim.ids):
+            return 0
+        p = sim._params()
+        gap = sim._gaps(sim._leaders(sim.lane), p) + p["minGap"]
+        return int((gap < 0).sum())
+
+    def subscribe(self, varIDs, begin=0, end=2**31-1):
+        self._subscription = varIDs
+
+    def getSubscriptionResults(self):
+        getters = {
+                VAR_TELEPORT_STARTING_VEHICLES_NUMBER : self.getStartingTeleportNumber,
+                VAR_COLLIDING_VEHICLES_NUMBER         : self.getCollidingVehiclesNumber,
+                }
+        return dict((var, getters[var]()) for var in self._subscription)
+
+
+class RingSim(object):
+    """
+    Vectorized multi-lane ring road
+    :param length: ring length (m)
+    :param numLanes: number of lanes
+    :param speedLimit: road speed limit (m/s)
+    :param stepLength: simulation step (s)
+    :param carFollowModels: {typeID: "Krauss" or "IDM"}, Krauss by default
+    :param emissionFile: if given, write SUMO-style emission output here
+                         (gzipped if it ends in .gz)
+    :param emissionPeriod: write emission output only every that many
+                           seconds, like SUMO's device.emissions.period
+    :param seed: seed for speed factors and dawdling
+    """
+
+    def __init__(self, length, numLanes, speedLimit, stepLength=1.0,
+                 carFollowModels=None, emissionFile=None, emissionPeriod=None,
+                 seed=None):
+        self.length = float(length)
+        self.numLanes = numLanes
+        self.speedLimit = speedLimit
+        self.stepLength = stepLength
+        self.edgelen = self.length / len(EDGES)
+        self.edgestarts = dict((e, i * self.edgelen) for (i, e) in enumerate(EDGES))
+        self.rng = np.random.RandomState(seed)
+        self.time = 0.
+        self.steps = 0
+
+        self.types = {}
+        self.typeNames = []
+        for (typeID, model) in (carFollowModels or {}).iteritems():
+            self._typeParams(typeID)["carFollowModel"] = model
+        self._dirty = True
+
+        self.ids = []
+        self.index = {}
+        for name in FLOAT_ARRAYS:
+            setattr(self, name, np.zeros(0))
+        for name in INT_ARRAYS:
+            setattr(self, name, np.zeros(0, dtype=np.int32))
+
+        self.vehicle = _Vehicle(self)
+        self.vehicletype = _VehicleType(self)
+        self.edge = _Edge(self)
+        self.gui = _Gui()
+        self.simulation = _Simulation(self)
+
+        self._out = None
+        self._emissionEvery = 1
+        if emissionPeriod:
+            self._emissionEvery = max(1, int(round(emissionPeriod / stepLength)))
+        if emissionFile is not None:
+            if emissionFile.endswith(".gz"):
+                self._out = gzip.open(emissionFile, "wb")
+            else:
+                self._out = open(emissionFile, "w")
+            self._out.write('<?xml version="1.0" encoding="UTF-8"?>\n\n'
+                            '<emission-export>\n')
+
+    def _typeParams(self, typeID):
+        if typeID not in self.types:
+            self.types[typeID] = dict(DEFAULT_TYPE)
+            self.typeNames.append(typeID)
+        return self.types[typeID]
+
+    def _typeCode(self, typeID):
+        self._typeParams(typeID)
+        return self.typeNames.index(typeID)
+
+    def _params(self):
+        """ Per-vehicle arrays of the numeric type parameters """
+        if self._dirty:
+            table = dict((k, np.array([self.types[t][k] for t in self.typeNames],
+                                      dtype=float))
+                         for k in NUMERIC_PARAMS)
+            table["idm"] = np.array([self.types[t]["carFollowModel"] == "IDM"
+                                     for t in self.typeNames])
+            self._table = table
+            self._dirty = False
+        return dict((k, a[self.type]) for (k, a) in self._table.iteritems())
+
+    def _add(self, vehID, typeID, x):
+        tp = self._typeParams(typeID)
+        # Per-vehicle speed factor, drawn like SUMO's: speedDev is the
+        # absolute deviation, clipped at 2 devs and MIN_SPEED_FACTOR
+        f, dev = tp["speedFactor"], tp["speedDev"]
+        if dev > 0:
+            f = np.clip(self.rng.normal(f, dev),
+                        max(f - 2 * dev, MIN_SPEED_FACTOR), f + 2 * dev)
+
+        self.index[vehID] = len(self.ids)
+        self.ids.append(vehID)
+        for (name, value) in [("x", x), ("v", 0.), ("f", f), ("slowFrom", 0.),
+                              ("slowTo", 0.), ("slowStart", 0.), ("slowEnd", -1.),
+                              ("laneUntil", -1.), ("fuel", 0.), ("lane", 0),
+                              ("type", self._typeCode(typeID)), ("laneTarget", 0)]:
+            setattr(self, name, np.append(getattr(self, name), value))
+
+    def _edges(self):
+        return np.minimum((self.x // self.edgelen).astype(int), len(EDGES) - 1)
+
+    def _var(self, var, i):
+        if var == VAR_TYPE:
+            return self.typeNames[self.type[i]]
+        elif var == VAR_ROAD_ID:
+            return EDGES[min(int(self.x[i] // self.edgelen), len(EDGES) - 1)]
+        elif var == VAR_LANEPOSITION:
+            return float(self.x[i] - self.edgestarts[self._var(VAR_ROAD_ID, i)])
+        elif var == VAR_LANE_INDEX:
+            return int(self.lane[i])
+        elif var == VAR_SPEED:
+            return float(self.v[i])
+        elif var == VAR_MAXSPEED:
+            return float(self.types[self.typeNames[self.type[i]]]["maxSpeed"])
+        elif var == VAR_SPEED_FACTOR:
+            return float(self.f[i])
+        raise ValueError("Unsupported variable 0x%x" % var)
+
+    def _results(self, i, varIDs):
+        return dict((var, self._var(var, i)) for var in varIDs)
+
+    def _leaders(self, lane):
+        """
+        Leader of every vehicle on the given lanes; a vehicle alone on its
+        lane is its own leader
+        """
+        n = len(self.ids)
+        order = np.lexsort((self.x, lane))
+        lanes = lane[order]
+        start = np.r_[0, np.flatnonzero(np.diff(lanes)) + 1]
+        end = np.r_[start[1:], n]
+        nxt = np.arange(1, n + 1)
+        nxt[end - 1] = start
+        leader = np.empty(n, dtype=int)
+        leader[order] = order[nxt]
+        return leader
+
+    def _gaps(self, leader, p):
+        """ Bumper to bumper gaps (minus minGap) to the given leaders """
+        dist = (self.x[leader] - self.x) % self.length
+        dist[leader == np.arange(len(leader))] = self.length
+        return dist - p["length"][leader] - p["minGap"]
+
+    def _safeSpeed(self, gap, v, vl, p):
+        # Krauss safe speed
+        return vl + (gap - vl * p["tau"]) / ((v + vl) / (2 * p["decel"]) + p["tau"])
+
+    def _changeLanes(self, p):
+        """ Move requested cars one lane towards their target if it's safe """
+        want = np.flatnonzero((self.laneTarget != self.lane) &
+                              (self.laneUntil > self.time))
+        for i in want:
+            target = self.lane[i] + np.sign(self.laneTarget[i] - self.lane[i])
+            others = np.flatnonzero(self.lane == target)
+            if len(others):
+                ahead = (self.x[others] - self.x[i]) % self.length
+                lead, follow = others[np.argmin(ahead)], others[np.argmax(ahead)]
+                gapAhead = ahead.min() - p["length"][lead] - p["minGap"][i]
+                gapBehind = self.length - ahead.max() - p["length"][i] - p["minGap"][follow]
+                if gapAhead < 0 or gapBehind < 0:
+                    continue
+                # neither this car nor its new follower may need to brake
+                # harder than they can
+                vsafe = self._safeSpeed(gapAhead, self.v[i], self.v[lead],
+                                        dict((k, a[i]) for (k, a) in p.iteritems()))
+                fsafe = self._safeSpeed(gapBehind, self.v[follow], self.v[i],
+                                        dict((k, a[follow]) for (k, a) in p.iteritems()))
+                if vsafe < self.v[i] - p["decel"][i] * self.stepLength or \
+                   fsafe < self.v[follow] - p["decel"][follow] * self.stepLength:
+                    continue
+            self.lane[i] = target
+
+    def simulationStep(self, step=0):
+        dt = self.stepLength
+        if len(self.ids):
+            p = self._params()
+            self._changeLanes(p)
+
+            leader = self._leaders(self.lane)
+            gap = self._gaps(leader, p)
+            v, vl = self.v, self.v[leader]
+            vmax = np.minimum(p["maxSpeed"], self.f * self.speedLimit)
+            vsafe = self._safeSpeed(gap, v, vl, p)
+
+            # Krauss: accelerate up to the safe speed, then dawdle
+            vkrauss = np.minimum(np.minimum(v + p["accel"] * dt, vmax), vsafe)
+            vkrauss = np.maximum(vkrauss - p["sigma"] * p["accel"] * dt *
+                                 self.rng.uniform(size=len(v)), 0)
+
+            # IDM
+            s = np.maximum(gap + p["minGap"], 0.1)
+            sstar = p["minGap"] + np.maximum(0, v * p["tau"] + v * (v - vl) /
+                                             (2 * np.sqrt(p["accel"] * p["decel"])))
+            accel = p["accel"] * (1 - (v / vmax) ** 4 - (sstar / s) ** 2)
+            vidm = np.minimum(v + accel * dt, vsafe)
+
+            vnext = np.where(p["idm"], vidm, vkrauss)
+
+            # slowDown overrides the model, within the car's abilities
+            slow = self.slowEnd > self.time
+            frac = np.clip((self.time + dt - self.slowStart) /
+                           (self.slowEnd - self.slowStart), 0, 1)
+            vslow = self.slowFrom + (self.slowTo - self.slowFrom) * frac
+            vslow = np.clip(vslow, v - p["decel"] * dt,
+                            np.minimum(v + p["accel"] * dt, vsafe))
+            vnext = np.where(slow, vslow, vnext)
+
+            # brake no harder than decel unless it's needed to stay safe
+            vnext = np.maximum(vnext, np.minimum(v - p["decel"] * dt, vsafe))
+            vnext = np.maximum(vnext, 0)
+
+            self.fuel = fuelRate(vnext, (vnext - v) / dt)
+            self.x = (self.x + vnext * dt) % self.length
+            self.v = vnext
+
+        self.time += dt
+        self.steps += 1
+        if self._out is not None and self.steps % self._emissionEvery == 0:
+            self._writeEmissions()
+
+    def _writeEmissions(self):
+        out = self._out
+        out.write('    <timestep time="%.2f">\n' % self.time)
+        edges = [EDGES[e] for e in self._edges()]
+        pos = self.x - np.array([self.edgestarts[e] for e in edges])
+        # positions on the circle makenet lays out (radius length/pi)
+        r = self.length / np.pi
+        theta = 2 * np.pi * self.x / self.length - np.pi / 2
+        rows = zip(self.ids, (self.fuel * CO2_PER_FUEL).tolist(),
+                   (self.fuel * CO_PER_FUEL).tolist(), self.fuel.tolist(),
+                   edges, [self.typeNames[t] for t in self.type], edges,
+                   self.lane.tolist(), pos.tolist(), self.v.tolist(),
+                   (np.degrees(-theta) % 360).tolist(),
+                   (r * np.cos(theta)).tolist(), (r * np.sin(theta)).tolist())
+        for row in rows:
+            out.write(EMISSION_VEHICLE % row)
+        out.write('    </timestep>\n')
+
+    def close(self):
+        if self._out is not None:
+            self._out.write('</emission-export>\n')
+            self._out.close()
+            self._out = None
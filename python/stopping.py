@@ -0,0 +1,114 @@
+"""
+Conditions for ending a LoopSim run before its simSteps, checked after every
+step:
+
+    sim.simulate(opts, stop=[SteadyState(), Collisions(), WallClock(600)])
+
+A condition has start(sim), called when the run starts, and check(sim,
+step), which returns why the run should stop (a short string) or None.  The
+run ends after the first step a condition gives a reason for and finishes
+as usual (outputs closed, recording saved, metrics summarized), and
+sim.stopped is (step, reason); it is None when the run made all its steps.
+"""
+import time
+
+import numpy as np
+
+from loopsim import tc
+
+
+class SteadyState(object):
+    """
+    Stop once the cars' average speed has settled: its variance over the
+    last `window` seconds stayed under `threshold` for `hold` seconds in a
+    row.  A ring stuck in a permanent jam settles too.
+    :param window: seconds the rolling variance is taken over
+    :param hold: seconds the variance has to stay under threshold
+    :param threshold: variance, in (m/s)^2
+    :param after: fraction of simSteps before which the run never stops, by
+                  default the warm-up metrics.OnlineMetrics and
+                  sweep.summarize leave out; the `hold` seconds are
+                  counted from there, so they have at least that many
+                  settled steps to go on
+    """
+
+    def __init__(self, window=30., hold=60., threshold=0.05, after=0.5):
+        self.window = window
+        self.hold = hold
+        self.threshold = threshold
+        self.after = after
+
+    def start(self, sim):
+        self.windowSteps = max(2, int(round(self.window / sim.simStepLength)))
+        self.holdSteps = max(1, int(round(self.hold / sim.simStepLength)))
+        self.firstStep = int(sim.simSteps * self.after)
+        self.speeds = np.empty(self.windowSteps)
+        self.count = 0
+        self.settled = 0
+
+    def check(self, sim, step):
+        self.speeds[self.count % self.windowSteps] = sim.allCars.v.mean()
+        self.count += 1
+        if self.count < self.windowSteps:
+            return None
+        var = self.speeds.var()
+        if var >= self.threshold:
+            self.settled = 0
+            return None
+        # only the settled steps the metrics count make up the hold
+        if step >= self.firstStep:
+            self.settled += 1
+        if self.settled >= self.holdSteps:
+            return "steady: speed variance %.3g under %g for %gs" % (
+                    var, self.threshold, self.hold)
+        return None
+
+
+class Collisions(object):
+    """
+    Stop when more vehicles than allowed have teleported (SUMO takes cars
+    that are stuck or collide off the road for a while) or collided.  The
+    counts come with each step through a simulation subscription, without
+    a TraCI round trip of their own.
+    :param maxTeleports: teleports the run may have
+    :param maxCollisions: collisions the run may have
+    """
+
+    def __init__(self, maxTeleports=0, maxCollisions=0):
+        self.maxTeleports = maxTeleports
+        self.maxCollisions = maxCollisions
+
+    def start(self, sim):
+        self.teleports = 0
+        self.collisions = 0
+        sim.conn.simulation.subscribe([tc.VAR_TELEPORT_STARTING_VEHICLES_NUMBER,
+                                       tc.VAR_COLLIDING_VEHICLES_NUMBER])
+
+    def check(self, sim, step):
+        res = sim.conn.simulation.getSubscriptionResults()
+        self.teleports += res[tc.VAR_TELEPORT_STARTING_VEHICLES_NUMBER]
+        self.collisions += res[tc.VAR_COLLIDING_VEHICLES_NUMBER]
+        if self.teleports > self.maxTeleports:
+            return "%d teleports" % self.teleports
+        if self.collisions > self.maxCollisions:
+            return "%d collisions" % self.collisions
+        return None
+
+
+class WallClock(object):
+    """
+    Stop when the run has taken more than `seconds` of wall time since it
+    started
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def start(self, sim):
+        self.started = time.time()
+
+    def check(self, sim, step):
+        elapsed = time.time() - self.started
+        if elapsed > self.seconds:
+            return "out of time: %.0fs" % elapsed
+        return None
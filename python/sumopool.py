@@ -0,0 +1,119 @@
+"""
+Running SUMO processes kept between LoopSim runs.
+
+Starting SUMO costs a process launch, loading the network and connecting
+TraCI, which traci.connect retries about once a second until SUMO listens.
+For short runs that is a large share of the wall time.  A SumoPool keeps
+its SUMO processes running: a run started with LoopSim.simulate(opts,
+pool=pool) takes an idle one and has it load the run's configuration with
+traci.load, which restarts the simulation (network, vehicle types from the
+run's routes file, outputs) in the same process and over the same
+connection.  The run's cars are then added as usual.
+
+Releasing a server loads the bare network, so that SUMO writes out and
+closes the outputs of the run that just ended.
+
+    pool = SumoPool()
+    for opts in optsList:
+        sim.simulate(opts, sumo="sumo", pool=pool)
+        sim.plot(save=True)
+    pool.close()
+"""
+import subprocess
+import sys
+
+from loopsim import freePort, traci
+
+
+class SumoServer(object):
+    """ A SUMO process listening for TraCI on its own port """
+
+    def __init__(self, binary, args):
+        """
+        :param binary: path of the sumo or sumo-gui binary
+        :param args: SUMO options of the first run, without --remote-port
+        """
+        self.binary = binary
+        self.port = freePort()
+        self.process = subprocess.Popen(
+                [binary] + list(args) + ["--remote-port", str(self.port)],
+                stdout=sys.stdout, stderr=sys.stderr)
+        self.conn = traci.connect(self.port)
+        self.runs = 1
+
+    def load(self, args):
+        """ Restart the simulation with other SUMO options """
+        self.conn.load(list(args))
+        self.runs += 1
+
+    def close(self):
+        self.conn.close()
+        self.process.wait()
+
+
+class SumoPool(object):
+    """
+    Idle SumoServers, per SUMO binary.  Not shared between processes: give
+    every worker its own pool.
+    """
+
+    def __init__(self):
+        self.idle = {}
+        self.servers = []
+        # how the runs got their SUMO
+        self.stats = {"spawn": 0, "load": 0}
+
+    def acquire(self, binary, args):
+        """
+        A SumoServer running a simulation of args, reusing an idle one if
+        there is one
+        :param binary: path of the sumo or sumo-gui binary
+        :param args: SUMO options, without --remote-port.  Give files as
+                     absolute paths: the server may have been started from
+                     another working directory
+        """
+        idle = self.idle.get(binary, [])
+        while idle:
+            server = idle.pop()
+            try:
+                server.load(args)
+            except traci.FatalTraCIError:
+                # SUMO went away while idle; start another
+                self._discard(server)
+                continue
+            self.stats["load"] += 1
+            return server
+
+        server = SumoServer(binary, args)
+        self.servers.append(server)
+        self.stats["spawn"] += 1
+        return server
+
+    def release(self, server, netfn):
+        """
+        End server's run and keep it for the next one
+        :param netfn: network the server idles on, as an absolute path
+        """
+        try:
+            server.load(["-n", netfn, "--no-step-log"])
+        except traci.FatalTraCIError:
+            self._discard(server)
+            return
+        self.idle.setdefault(server.binary, []).append(server)
+
+    def _discard(self, server):
+        self.servers.remove(server)
+        try:
+            server.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """ Stop all SUMO processes of the pool, idle or not """
+        for server in self.servers:
+            try:
+                server.close()
+            except traci.FatalTraCIError:
+                pass
+        self.servers = []
+        self.idle = {}
@@ -0,0 +1,295 @@
+"""
+Run many LoopSim configurations in parallel.
+
+A sweep is a list of jobs, each a dict with
+    "sim"      : keyword arguments for the LoopSim constructor
+    "opts"     : the opts passed to LoopSim.simulate
+    "simulate" : (optional) other keyword arguments for simulate, e.g. sumo,
+                 outputs or record
+    "plot"     : (optional) keyword arguments for plot, None for no plot
+    "branches" : (optional) list of opts to carry on with from step
+                 "branchStep" of opts, instead of simulating each of them
+                 from the start (see loopsim.branches); the job gets a
+                 result per branch
+    "live"     : (optional) keyword arguments for a liveview.LiveHeatmap
+                 writing frames of the runs to the job's live/ directory
+                 while they run
+
+runSweep runs the jobs on a pool of worker processes.  Every job runs in its
+own directory under the sweep's output directory (so its data/, img/ and
+video/ files and the SUMO configs makecirc writes can't clash with another
+job's) and talks to SUMO on a free port picked by the OS, so jobs can
+overlap.  Networks are shared: all jobs use the NET_PATH of the process
+starting the sweep, where makenet builds each one only once.  The random
+seed is reset before every job, as the sweep scripts did before each
+configuration.
+
+With warm=True each worker keeps its SUMO running between jobs (see
+sumopool), and only the first job of a worker pays for starting it.  The
+startup column has the seconds each job took to get to its first step, and
+the commands and dropped columns the vehicle commands it sent and the ones
+its command buffer found it did not need to (see cmdbuffer).
+
+The metrics columns come from the runs' online metrics (see metrics), so
+jobs without a plot can run with "simulate": {"outputs": []} and write no
+XML at all.  Stopping conditions (see stopping) go in "simulate" too, e.g.
+"stop": [SteadyState()]; the steps and stop columns say how far each run
+got and why it stopped, and truncated marks runs that stopped before the
+warm-up the metrics leave out ended, whose metrics are NaN.
+
+The workers are forked and reach the jobs through a module global, since car
+functions are closures and can't be pickled.
+"""
+import copy
+import csv
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import time
+import traceback
+
+import numpy as np
+
+import config as defaults
+import makecirc
+from liveview import LiveHeatmap
+from loopsim import LoopSim, branches, ensure_dir
+from sumopool import SumoPool
+
+
+# Columns of the results table, in order
+COLUMNS = ["job", "branch", "label", "time", "startup", "steps", "stop",
+           "truncated", "avgspeed", "looptime", "speeddev", "throughput",
+           "waves", "wavespeed", "commands", "dropped", "image", "net", "error"]
+
+# Metrics of a run taken from its online metrics summary
+METRICS = ["avgspeed", "looptime", "speeddev", "throughput", "waves", "wavespeed"]
+
+# Jobs of the sweep being run, read by the workers by index
+_jobs = []
+_outdir = None
+# The worker's SumoPool in warm sweeps
+_pool = None
+
+
+def grid(simArgs, optsList, **kwargs):
+    """
+    Jobs for every combination of constructor args and opts
+    :param simArgs: list of LoopSim keyword argument dicts
+    :param optsList: list of simulate opts
+    :param kwargs: other job keys shared by all jobs (simulate, plot)
+    :return: list of jobs for runSweep
+    """
+    jobs = []
+    for (sim, opts) in itertools.product(simArgs, optsList):
+        job = {"sim": sim, "opts": opts}
+        job.update(kwargs)
+        jobs.append(job)
+    return jobs
+
+
+def summarize(parsed, skip=0.5):
+    """
+    Summary metrics of a run, averaged over lanes and the last part of it
+    :param parsed: output of parsexml (LoopSim.parse)
+    :param skip: fraction of the run to leave out as warm-up
+    :return: dict of avgspeed (m/s), looptime (s) and speeddev (m/s)
+    """
+    trng, xrng, avgspeeds, lanespeeds, occupancy, totfuel, looptimes = parsed
+    start = int(len(trng) * skip)
+    metrics = {}
+    for (key, data) in [("avgspeed", avgspeeds), ("looptime", looptimes),
+                        ("speeddev", totfuel)]:
+        values = [v for lane in data.values() for v in lane[start:]]
+        metrics[key] = float(np.mean(values)) if values else float("nan")
+    return metrics
+
+
+def _finishRun(sim, job, result):
+    # Collect the outputs and metrics of a finished run, and plot it
+    result["label"] = sim.label
+    result["startup"] = sim.startupTime
+    # runs can end early on stopping conditions (see stopping)
+    result["steps"] = sim.stepNum
+    result["stop"] = sim.stopped[1] if sim.stopped is not None else ""
+    # vehicle commands sent, and left out by the command buffer
+    result["commands"] = sim.commandCounts["issued"]
+    result["dropped"] = sim.commandCounts["dropped"]
+    result["outputs"] = dict((k, os.path.abspath(fn))
+                             for (k, fn) in sim.outs.iteritems())
+    if sim.metrics is not None:
+        # no need to parse outputs for these
+        summary = sim.metrics.summary()
+        result.update((k, summary[k]) for k in METRICS)
+        result["truncated"] = summary["truncated"]
+    else:
+        result.update(summarize(sim.parse()))
+
+    plotArgs = job.get("plot")
+    if plotArgs is not None:
+        # the workers render with Agg, at the figure's pixel resolution
+        plotArgs = dict(plotArgs, show=False, save=True)
+        plotArgs.setdefault("fast", True)
+        plt = sim.plot(**plotArgs)
+        plt.close("all")
+        result["image"] = os.path.abspath(sim.imgfn)
+
+
+def _runJob(i):
+    job = _jobs[i]
+    jobdir = ensure_dir(os.path.join(_outdir, "job%03d" % i))
+    os.chdir(jobdir)
+    result = {"job": i, "label": job["opts"].get("label"), "dir": jobdir}
+    results = [result]
+    stats = dict(makecirc.netCacheStats)
+    start = time.time()
+    try:
+        if defaults.RANDOM_SEED:
+            random.seed(defaults.RANDOM_SEED)
+
+        simArgs = dict(job["sim"])
+        simArgs.setdefault("port", None)
+        sim = LoopSim(**simArgs)
+        simulateArgs = dict(job.get("simulate", {}))
+        if _pool is not None:
+            simulateArgs.setdefault("pool", _pool)
+        if job.get("live") is not None:
+            simulateArgs["live"] = LiveHeatmap(frames="live", **job["live"])
+        if "branches" not in job:
+            sim.simulate(job["opts"], **simulateArgs)
+            _finishRun(sim, job, result)
+        else:
+            # the first branch's time includes the shared part
+            runs = branches(sim, job["opts"], job["branchStep"],
+                            job["branches"], **simulateArgs)
+            results = []
+            for (b, opts) in enumerate(job["branches"]):
+                result = {"job": i, "branch": b, "label": opts.get("label"),
+                          "dir": jobdir}
+                results.append(result)
+                _finishRun(next(runs), job, result)
+                result["time"] = time.time() - start
+                start = time.time()
+    except Exception:
+        result["error"] = traceback.format_exc()
+        print >> sys.stderr, "Job %d failed:\n%s" % (i, result["error"])
+    if "time" not in result:
+        result["time"] = time.time() - start
+    for k in stats:
+        if makecirc.netCacheStats[k] > stats[k]:
+            # whether makenet built this job's network or reused it
+            results[0]["net"] = k
+    return results
+
+
+def _initWorker(warm):
+    global _pool
+    # workers only ever save plots
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+    if warm:
+        _pool = SumoPool()
+        # stop the pool's SUMOs when the worker exits
+        multiprocessing.util.Finalize(_pool, _pool.close, exitpriority=10)
+
+
+def runSweep(jobs, outdir="sweep/", processes=None, warm=False):
+    """
+    Run jobs on a pool of processes
+    :param jobs: list of job dicts (see grid)
+    :param outdir: directory holding one subdirectory per job and the
+                   results.csv table
+    :param processes: number of workers, defaults to the number of CPUs
+    :param warm: keep a SUMO running in each worker for its next job
+                 instead of starting one per job
+    :return: list of result dicts, in job order, with the keys in COLUMNS
+             and the paths of each job's outputs
+    """
+    global _jobs, _outdir
+    _jobs = list(jobs)
+    _outdir = os.path.abspath(ensure_dir(outdir))
+    cwd = os.getcwd()
+    netPath = defaults.NET_PATH
+    defaults.NET_PATH = os.path.abspath(ensure_dir(netPath)) + "/"
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(_jobs)))
+
+    pool = multiprocessing.Pool(processes, initializer=_initWorker,
+                                initargs=(warm,))
+    try:
+        results = []
+        for (done, jobResults) in enumerate(
+                pool.imap_unordered(_runJob, range(len(_jobs)))):
+            print "Job %d/%d done (%s) in %.1fs" % (done+1, len(_jobs),
+                    ", ".join(str(r["label"]) for r in jobResults),
+                    sum(r["time"] for r in jobResults))
+            results.extend(jobResults)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        os.chdir(cwd)
+        defaults.NET_PATH = netPath
+
+    results.sort(key=lambda r: (r["job"], r.get("branch")))
+    print "Network cache: %d hits, %d misses" % (
+            len([r for r in results if r.get("net") == "hit"]),
+            len([r for r in results if r.get("net") == "miss"]))
+    startups = [r["startup"] for r in results if "startup" in r]
+    if startups:
+        print "Startup: %.2fs per job, %.1fs in total" % (np.mean(startups),
+                                                          sum(startups))
+    writeTable(results, os.path.join(_outdir, "results.csv"))
+    return results
+
+
+def writeTable(results, fn):
+    with open(fn, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for r in results:
+            writer.writerow([r.get(c, "") if c != "error" else
+                             r.get(c, "").strip().split("\n")[-1]
+                             for c in COLUMNS])
+
+
+def printTable(results):
+    print "%4s %-40s %8s %11s %9s %9s %9s  %s" % ("job", "label", "time (s)",
+            "startup (s)", "avgspeed", "looptime", "speeddev", "image")
+    for r in results:
+        if "error" in r:
+            print "%4d %-40s %8.1f  %s" % (r["job"], r["label"], r["time"],
+                    r["error"].strip().split("\n")[-1])
+            continue
+        print "%4d %-40s %8.1f %11.2f %9.2f %9.1f %9.2f  %s" % (r["job"],
+                r["label"], r["time"], r["startup"], r["avgspeed"],
+                r["looptime"], r["speeddev"], r.get("image", ""))
+
+
+if __name__ == "__main__":
+    from agent_types import basicHumanParams, basicACCParams
+
+    humanParams = copy.copy(basicHumanParams)
+    humanParams["count"] = 30
+    optsList = []
+    for count in [10, 20, 30]:
+        accParams = copy.copy(basicACCParams)
+        accParams["count"] = count
+        optsList.append({
+            "paramsList" : [humanParams, accParams],
+            "simSteps"   : 500,
+            "tag"        : "sweep",
+        })
+    simArgs = [{"name": "loopsim", "length": 1000, "numLanes": 2,
+                "simStepLength": 0.5}]
+
+    sumo = sys.argv[1] if len(sys.argv) > 1 else defaults.BINARY
+    results = runSweep(grid(simArgs, optsList, simulate={"sumo": sumo},
+                            plot={}))
+    printTable(results)
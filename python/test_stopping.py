@@ -0,0 +1,91 @@
+"""
+Runs on the ring simulator that stopping conditions end early:
+
+    python test_stopping.py
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from agent_types import basicHumanParams
+from loopsim import LoopSim
+from stopping import Collisions, WallClock
+
+
+class AtStep(object):
+    """ Stop after a given step """
+
+    def __init__(self, step):
+        self.step = step
+
+    def start(self, sim):
+        pass
+
+    def check(self, sim, step):
+        if step >= self.step:
+            return "step %d" % step
+        return None
+
+
+class StoppingTest(unittest.TestCase):
+
+    def setUp(self):
+        # LoopSim makes its data/, img/... directories here
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        random.seed(0)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def simulate(self, stop, simSteps=200, count=20):
+        sim = LoopSim("stop", length=500, numLanes=1, port=None)
+        opts = {"paramsList": [dict(basicHumanParams, count=count)],
+                "simSteps": simSteps}
+        return sim, sim.simulate(opts, sumo="ring", outputs=[], stop=stop)
+
+    def test_stop_after_warmup(self):
+        sim, summary = self.simulate(AtStep(149))
+        self.assertEqual(sim.stopped, (149, "step 149"))
+        self.assertEqual(sim.stepNum, 150)
+        # steps 100 to 149 count
+        self.assertEqual(summary["steps"], 50)
+        self.assertFalse(summary["truncated"])
+        self.assertTrue(np.isfinite(summary["avgspeed"]))
+
+    def test_stop_during_warmup_is_truncated(self):
+        sim, summary = self.simulate(AtStep(49))
+        self.assertEqual(sim.stepNum, 50)
+        self.assertEqual(summary["steps"], 0)
+        self.assertTrue(summary["truncated"])
+        self.assertTrue(np.isnan(summary["avgspeed"]))
+
+    def test_full_run(self):
+        sim, summary = self.simulate(WallClock(3600))
+        self.assertIsNone(sim.stopped)
+        self.assertEqual(sim.stepNum, 200)
+        self.assertFalse(summary["truncated"])
+
+
+    def test_collisions(self):
+        sim, summary = self.simulate(Collisions(), simSteps=50)
+        # the ring simulator's cars keep their gaps
+        self.assertIsNone(sim.stopped)
+        # two cars in the same place collide right away
+        sim = LoopSim("stop", length=500, numLanes=1, port=None)
+        sim.start({"paramsList": [dict(basicHumanParams, count=2)],
+                   "simSteps": 50}, sumo="ring", outputs=[], stop=Collisions())
+        sim.conn.x[:] = 10.
+        sim.step()
+        sim.finish()
+        self.assertEqual(sim.stopped, (0, "2 collisions"))
+
+
+if __name__ == "__main__":
+    unittest.main()
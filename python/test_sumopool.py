@@ -0,0 +1,56 @@
+"""
+SumoPool runs of sweep jobs, which each run in their own directory, against
+faketraci:
+
+    python test_sumopool.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import faketraci
+
+fake = faketraci.install()
+
+import sumopool
+from loopsim import LoopSim
+
+
+class PooledRunsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        self.netfn = os.path.join(self.tmpdir, "loop.net.xml")
+        open(self.netfn, "w").close()
+        # the fake is the SUMO process as well
+        self.popen = sumopool.subprocess.Popen
+        sumopool.subprocess.Popen = lambda *args, **kwargs: fake
+
+    def tearDown(self):
+        sumopool.subprocess.Popen = self.popen
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_jobs_in_other_directories_reuse_the_server(self):
+        pool = sumopool.SumoPool()
+        for job in range(2):
+            # as sweep._runJob does
+            jobdir = os.path.join(self.tmpdir, "job%03d" % job)
+            os.mkdir(jobdir)
+            os.chdir(jobdir)
+            sim = LoopSim("pool", length=1000, numLanes=1, port=None)
+            sim.netfn = self.netfn
+            # with a config of another name in each directory
+            sim.simulate({"paramsList": [{"name": "human", "count": 4}],
+                          "simSteps": 5, "label": "job%03d" % job},
+                         sumo="sumo", pool=pool)
+            self.assertEqual(sim.stepNum, 5)
+        self.assertEqual(pool.stats, {"spawn": 1, "load": 1})
+        self.assertEqual(fake.cwd, os.path.join(self.tmpdir, "job000"))
+        pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
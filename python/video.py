@@ -0,0 +1,180 @@
+"""
+Video of a LoopSim run drawn straight from the car state it collects, in
+place of a sumo-gui screenshot PNG per step.
+
+RingVideo draws the loop as a NumPy raster (the road, and every car as a
+dot colored by its speed) and hands each frame to a background thread,
+which pipes it to ffmpeg to encode one .mp4, or when there is no ffmpeg
+appends it to an uncompressed .frames.npy stack (np.load(fn,
+mmap_mode="r") gives a (frames, height, width, 3) array).  The simulation
+only waits on the writer when it falls a whole queue of frames behind.
+
+    sim.simulate(opts, live=RingVideo(fps=24))
+
+The file goes to VID_PATH, and its name to sim.outs["video"].
+"""
+import distutils.spawn
+import Queue
+import struct
+import subprocess
+import threading
+
+import numpy as np
+
+from plots import my_cmap
+
+
+# Frames the simulation can get ahead of the writer thread
+QUEUE_FRAMES = 64
+
+
+def npyHeader(shape, length=None):
+    """
+    .npy header of a uint8 array of shape, padded to length bytes, so a
+    stack can be written before its number of frames is known and the
+    header rewritten in place
+    """
+    header = "{'descr': '|u1', 'fortran_order': False, 'shape': %r, }" % (tuple(shape),)
+    if length is None:
+        # magic, version, header length, header, newline; 64 byte aligned
+        length = (10 + len(header) + 1 + 63) // 64 * 64
+    header += " " * (length - 10 - len(header) - 1) + "\n"
+    return "\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header
+
+
+class FrameWriter(threading.Thread):
+    """
+    Writes the frames put into its queue to an ffmpeg process or a
+    .frames.npy stack
+    """
+
+    def __init__(self, fn, width, height, fps):
+        """
+        :param fn: file name without extension
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = Queue.Queue(QUEUE_FRAMES)
+        self.shape = (height, width, 3)
+        self.frames = 0
+        self.error = None
+
+        ffmpeg = distutils.spawn.find_executable("ffmpeg")
+        if ffmpeg is not None:
+            self.fn = fn + ".mp4"
+            self.process = subprocess.Popen([ffmpeg, "-y", "-loglevel", "error",
+                    "-f", "rawvideo", "-pix_fmt", "rgb24",
+                    "-s", "%dx%d" % (width, height), "-r", repr(fps),
+                    "-i", "-", "-pix_fmt", "yuv420p", self.fn],
+                    stdin=subprocess.PIPE)
+            self.out = self.process.stdin
+        else:
+            self.fn = fn + ".frames.npy"
+            self.process = None
+            self.out = open(self.fn, "wb")
+            # room for any number of frames in the header
+            self.headerLength = len(npyHeader((10**12,) + self.shape))
+            self.out.write(npyHeader((0,) + self.shape, self.headerLength))
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                # keep draining so the simulation never blocks
+                continue
+            try:
+                self.out.write(frame.tostring())
+                self.frames += 1
+            except (IOError, OSError) as e:
+                self.error = e
+
+    def close(self):
+        """ Write the frames still queued and close the file """
+        self.queue.put(None)
+        self.join()
+        if self.process is not None:
+            self.out.close()
+            self.process.wait()
+        else:
+            self.out.seek(0)
+            self.out.write(npyHeader((self.frames,) + self.shape, self.headerLength))
+            self.out.close()
+        if self.error is not None:
+            raise self.error
+
+
+class RingVideo(object):
+    """
+    :param fps: frames per second of simulated time, at most one per
+                step.  The video plays at the rate of the frames kept
+                (self.rate), so always at the speed of simulated time
+    :param size: width and height of the frames in pixels
+    :param speedRange: (min, max) of the car colors, by default 0 to the
+                       fastest car type's maxSpeed
+    """
+
+    def __init__(self, fps=24, size=480, speedRange=None):
+        self.fps = fps
+        self.size = size - size % 2  # yuv420p needs even sizes
+        self.speedRange = speedRange
+        self.writer = None
+
+    def start(self, sim):
+        """ Draw the road and start a writer for a run of sim """
+        size = self.size
+        self.every = max(1, int(round(1. / (self.fps * sim.simStepLength))))
+        self.rate = 1. / (self.every * sim.simStepLength)
+        self.lut = (my_cmap(np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+        self.vmin, self.vmax = self.speedRange or (0, sim.maxSpeed)
+
+        # road radius and lane width in pixels
+        self.center = size / 2.
+        rmax = 0.45 * size
+        self.laneWidth = min(0.1 * size / sim.numLanes, 2 * np.pi * rmax / 100)
+        self.router = rmax
+        rinner = rmax - sim.numLanes * self.laneWidth
+        yy, xx = np.mgrid[:size, :size] - self.center
+        r = np.hypot(xx, yy)
+        self.background = np.empty((size, size, 3), dtype=np.uint8)
+        self.background.fill(255)
+        self.background[(r <= self.router) & (r >= rinner)] = 96
+
+        # pixel offsets of a car's dot
+        rc = max(1, int(self.laneWidth * 0.4))
+        dy, dx = np.mgrid[-rc:rc+1, -rc:rc+1]
+        inside = dx**2 + dy**2 <= rc**2
+        self.dotx, self.doty = dx[inside], dy[inside]
+
+        fn = "%s%s" % (sim.vid_path, sim.name+"-"+sim.label)
+        self.writer = FrameWriter(fn, size, size, self.rate)
+        self.writer.start()
+        sim.outs["video"] = self.writer.fn
+
+    def frame(self, sim):
+        """ The current state of sim as an RGB raster """
+        cars = sim.allCars
+        # cars go round counterclockwise from the bottom, lane 0 outside
+        theta = 2 * np.pi * cars.x / sim.length - np.pi / 2
+        r = self.router - (cars.lane + 0.5) * self.laneWidth
+        px = np.rint(self.center + r * np.cos(theta)).astype(int)
+        py = np.rint(self.center - r * np.sin(theta)).astype(int)
+        level = np.clip((cars.v - self.vmin) / float(self.vmax - self.vmin), 0, 1)
+        colors = self.lut[(level * 255).astype(int)]
+
+        img = self.background.copy()
+        ix = np.clip(px[:, None] + self.dotx, 0, self.size - 1)
+        iy = np.clip(py[:, None] + self.doty, 0, self.size - 1)
+        img[iy, ix] = colors[:, None]
+        return img
+
+    def update(self, sim, step):
+        """ Called by sim after every step """
+        if step % self.every == 0:
+            self.writer.queue.put(self.frame(sim))
+
+    def finish(self, sim):
+        """ Called by sim when the run ends: finish writing the file """
+        self.writer.close()
+        self.writer = None